@@ -0,0 +1,334 @@
+import asyncio
+import os
+import tempfile
+from functools import partial
+
+import backend
+import chunks
+import manage
+
+
+class AsyncFileManager:
+    """
+    Asynchronous interface to the state of a repository, for use within an asyncio event
+    loop (e.g. by the control loop, an IPC server or the GUI). Git commands are run as
+    asynchronous subprocesses, so several operations may be in progress at once without
+    blocking the loop. Every operation may be cancelled or given a timeout, in which case
+    any git process it is running is terminated.
+
+    Parsing, commit messages and the version index are shared with FileManager.
+    """
+
+    def __init__(
+        self,
+        dir_path,
+        temp_path,
+        batch_size=0,
+        preview_cache_size=None,
+        chunk_threshold=0,
+        timeout=None,
+    ):
+        """
+        Creates new AsyncFileManager for directory at given path. The repository is
+        prepared synchronously, as in FileManager.
+
+        Arguments:
+            dir_path (str): path of target directory
+            temp_path (str): path of temp directory
+            batch_size (int): maximum number of files stored in a single commit (0 for
+                no limit)
+            preview_cache_size (int): maximum size in megabytes of opened versions kept
+                in the temp directory
+            chunk_threshold (int): minimum size in megabytes of files which are split
+                into chunks stored outside the repository (0 to disable)
+            timeout (float): default number of seconds after which operations are
+                cancelled (None for no limit)
+        """
+        self.manager = manage.FileManager(
+            dir_path, temp_path, batch_size, preview_cache_size, chunk_threshold
+        )
+        self.repo = backend.AsyncGitBackend(self.manager.repo)
+        self.timeout = timeout
+        # Stores and restorations stage files, so are not run concurrently
+        self.lock = asyncio.Lock()
+
+    @property
+    def dir_path(self):
+        return self.manager.dir_path
+
+    @property
+    def batch_size(self):
+        return self.manager.batch_size
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        self.manager.batch_size = batch_size
+
+    async def get_changes(self, paths=None, timeout=None):
+        """
+        Returns the changes made to files in the form of ChangeData objects (see
+        FileManager.get_changes).
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted. All changes are returned if None.
+            timeout (float): seconds after which the operation is cancelled, defaults
+                to the timeout of the manager
+
+        Returns (list(ChangeData)): changes made to files
+        """
+        return await self._wait(self._get_changes(paths), timeout)
+
+    async def has_changed(self, paths=None, timeout=None):
+        """
+        Returns true if changes to files have occurred.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted. All files are checked if None.
+            timeout (float): seconds after which the operation is cancelled
+
+        Returns (boolean): true if changes to files have occurred
+        """
+        changes = self._get_changes(paths, optional_locks=False)
+        return bool(await self._wait(changes, timeout))
+
+    async def store_changes(self, paths=None, timeout=None):
+        """
+        Stores all changes and returns list of files that were successfully committed
+        (see FileManager.store_changes). If cancelled, changes which have not been
+        committed are stored by the next call.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted. All changes are stored if None.
+            timeout (float): seconds after which the operation is cancelled
+
+        Returns: list(str): all files that were committed
+        """
+        return await self._wait(self._store_changes(paths), timeout)
+
+    async def get_file_versions(
+        self,
+        file_path,
+        limit=None,
+        offset=0,
+        before=None,
+        since=None,
+        until=None,
+        timeout=None,
+    ):
+        """
+        Returns the versions of given file, in order of most recent to least recent
+        (see FileManager.get_file_versions). The version index is brought up to date on
+        a separate thread.
+
+        Arguments:
+            file_path (str): path of file for which versions will be retrieved
+            limit (int): maximum number of versions returned (None for no limit)
+            offset (int): number of most recent versions skipped
+            before (int): number of version preceding the first version returned
+            since (datetime.datetime): earliest time of versions
+            until (datetime.datetime): latest time of versions
+            timeout (float): seconds after which the operation is cancelled
+
+        Returns (list(VersionData)): versions of given file
+        """
+        lookup = asyncio.to_thread(
+            self.manager.get_file_versions,
+            file_path,
+            limit,
+            offset,
+            before,
+            since,
+            until,
+        )
+        return await self._wait(lookup, timeout)
+
+    async def open_file_version(self, file_path, version_num, timeout=None):
+        """
+        Open specified version of given file, writing it to the preview cache if it is
+        not already cached.
+
+        Arguments:
+            file_path (str): path of target file. Must be an absolute file path.
+            version_num (int): number of version to be retrieved
+            timeout (float): seconds after which the operation is cancelled
+        """
+        await self._wait(self._open_file_version(file_path, version_num), timeout)
+
+    async def restore_file_version(self, file_path, version_num, timeout=None):
+        """
+        Restores specified version of given file.
+
+        Arguments:
+            file_path (str): path of target file
+            version_num (int): number of version to be restored
+            timeout (float): seconds after which the operation is cancelled
+        """
+        await self._wait(self._restore_file_version(file_path, version_num), timeout)
+
+    async def _wait(self, operation, timeout):
+        """
+        Waits for the given operation to complete, cancelling it if the timeout expires.
+
+        Arguments:
+            operation (awaitable): operation to be awaited
+            timeout (float): seconds after which the operation is cancelled, defaults
+                to the timeout of the manager
+
+        Returns: result of operation
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(operation, timeout)
+
+    async def _get_changes(self, paths=None, optional_locks=True):
+        # Paths matching ignore rules may be looked up in the index
+        args = await asyncio.to_thread(
+            self.manager._get_status_args, paths, optional_locks
+        )
+        if args is None:
+            return []
+        output = await self.repo.run(args)
+        records = output.decode("utf-8", "surrogateescape").split("\0")
+        return list(self.manager._parse_status(x for x in records if x))
+
+    async def _store_changes(self, paths=None):
+        async with self.lock:
+            changes = await self._stage_untracked(await self._get_changes(paths))
+            committed = await self._store_batched(changes)
+            if committed:
+                await asyncio.to_thread(self.manager._update_indexes)
+            return committed
+
+    async def _store_batched(self, changes):
+        """
+        Stores the given changes in groups of at most batch_size files (see
+        FileManager._store_batched).
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
+
+        Returns: list(str): all files that were committed
+        """
+        manager = self.manager
+        committed = []
+        for group, message in manager._get_batches(changes):
+            with manager._write_message(message) as message_path:
+                add, commit, reset = manager._get_batch_commands(group, message_path)
+                try:
+                    for args, paths in (add, commit):
+                        await self.repo(
+                            *args, _in=paths, _env=backend.LITERAL_PATHSPECS
+                        )
+                    committed.extend(x.file_path for x in group)
+                except backend.GitError:
+                    # Uncommitted changes are left to the next call
+                    try:
+                        await self.repo(
+                            *reset[0], _in=reset[1], _env=backend.LITERAL_PATHSPECS
+                        )
+                    except backend.GitError:
+                        pass
+        return committed
+
+    async def _stage_untracked(self, changes):
+        """
+        Stages all untracked entries among the given changes at once (see
+        FileManager._stage_untracked).
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
+
+        Returns (list(ChangeData)): changes with untracked files staged
+        """
+        untracked = [x.file_path for x in changes if "??" in x.codes]
+        tracked = [x for x in changes if "??" not in x.codes]
+        if not untracked:
+            return changes
+        args, paths = self.manager._get_stage_command(untracked)
+        try:
+            await self.repo(*args, _in=paths, _env=backend.LITERAL_PATHSPECS)
+        except backend.GitError:
+            return tracked
+        staged = [x for x in await self._get_changes(untracked) if x.index == "A"]
+        return tracked + staged
+
+    async def _open_file_version(self, file_path, version_num):
+        target_ver = await asyncio.to_thread(
+            self.manager._get_target_version, file_path, version_num
+        )
+        file_name = os.path.split(file_path)[1]
+        ref = f"{target_ver.c_hash}:{target_ver.path}"
+        if self.manager.preview_cache is None:
+            self.manager.preview_cache = self.manager._create_preview_cache()
+        preview_cache = self.manager.preview_cache
+        try:
+            preview_path = await asyncio.to_thread(preview_cache.get, ref, file_name)
+            if preview_path is None:
+                preview_path = await self._store_preview(preview_cache, ref, file_name)
+            self.manager._open_destination(preview_path)
+        except (backend.GitError, OSError):
+            raise manage.VersionError(
+                f"Unable to view version {version_num} of {file_name}"
+            )
+
+    async def _store_preview(self, preview_cache, ref, file_name):
+        """
+        Writes the version with the given reference to the preview cache and returns its
+        path. Large blobs are streamed from git, while small blobs (which may be
+        pointers to chunked files) are written on a separate thread.
+
+        Arguments:
+            preview_cache (cache.PreviewCache): cache of opened versions
+            ref (str): reference of version, of the form '<commit>:<path>'
+            file_name (str): name of file the version is opened as
+
+        Returns (str): path of cached version
+        """
+        blob, _, size = await self.repo.check_object(ref)
+        if size <= chunks.MAX_POINTER_SIZE:
+            write = partial(self.manager._write_blob, blob, size)
+            return await asyncio.to_thread(
+                preview_cache.store, ref, blob, file_name, write
+            )
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=preview_cache.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                await self.repo.copy_object(blob, f)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return await asyncio.to_thread(
+            preview_cache.add, ref, blob, file_name, temp_path
+        )
+
+    async def _restore_file_version(self, file_path, version_num):
+        target_ver = await asyncio.to_thread(
+            self.manager._get_target_version, file_path, version_num
+        )
+        rel_path = self.manager._get_relative_path(file_path)
+        async with self.lock:
+            try:
+                await asyncio.to_thread(
+                    self.manager._write_version, target_ver, file_path
+                )
+                await self.repo.add(
+                    "-f", "--", rel_path, _env=backend.LITERAL_PATHSPECS
+                )
+                if await self.repo.status(
+                    "-s", "--", rel_path, _env=backend.LITERAL_PATHSPECS
+                ):
+                    await self.repo.commit(
+                        "-m",
+                        f'Restore "{target_ver.message}"',
+                        "--",
+                        rel_path,
+                        _env=backend.LITERAL_PATHSPECS,
+                    )
+                    await asyncio.to_thread(self.manager.index.sync)
+            except (backend.GitError, OSError):
+                raise manage.VersionError(
+                    f"Unable to restore version {version_num} of "
+                    f"{os.path.split(file_path)[1]}"
+                )
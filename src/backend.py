@@ -0,0 +1,646 @@
+import asyncio
+import contextlib
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+
+# Commands which modify the index, refs or working tree. These are never run
+# concurrently within a repository, as git would fail to acquire its lock files.
+WRITE_COMMANDS = {
+    "add",
+    "checkout",
+    "commit",
+    "commit-graph",
+    "gc",
+    "init",
+    "maintenance",
+    "multi-pack-index",
+    "mv",
+    "prune",
+    "prune-packed",
+    "reflog",
+    "repack",
+    "reset",
+    "rm",
+    "update-index",
+    "update-ref",
+}
+
+# Environment of commands given paths of files, so that names containing wildcards
+# (e.g. "x[1].txt") are not treated as glob patterns
+LITERAL_PATHSPECS = {"GIT_LITERAL_PATHSPECS": "1"}
+
+# Prevents a console window being created for each git process on Windows
+CREATION_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+_backends = {}
+_backends_lock = threading.Lock()
+# Functions called with a CommandRecord after each git command completes
+_command_hooks = []
+
+
+def get_backend(dir_path, max_workers=4):
+    """
+    Returns the shared backend for the repository at the given path, creating it if
+    necessary. All managers of a repository within a process use the same backend, so
+    the number of git processes per repository remains bounded.
+
+    Arguments:
+        dir_path (str): path of repository
+        max_workers (int): maximum number of concurrent git commands
+
+    Returns (GitBackend): backend for repository
+    """
+    with _backends_lock:
+        if dir_path not in _backends:
+            _backends[dir_path] = GitBackend(dir_path, max_workers)
+        return _backends[dir_path]
+
+
+def add_command_hook(hook):
+    """
+    Registers a function to be called with a CommandRecord after every git command run
+    by any backend (including object reads by persistent processes). Hooks are called on
+    the thread which ran the command, so must be quick and thread-safe.
+
+    Arguments:
+        hook (function): function taking a CommandRecord
+    """
+    _command_hooks.append(hook)
+
+
+def remove_command_hook(hook):
+    if hook in _command_hooks:
+        _command_hooks.remove(hook)
+
+
+def _notify(args, start, returncode, output_size):
+    """
+    Calls the command hooks with the details of a completed command.
+
+    Arguments:
+        args (list(str)): arguments of command
+        start (float): time at which command started (performance counter)
+        returncode (int): exit status of command, or None if it was terminated
+        output_size (int): number of bytes of output read
+    """
+    if not _command_hooks:
+        return
+    record = CommandRecord(
+        tuple(args), time.perf_counter() - start, returncode, output_size
+    )
+    for hook in list(_command_hooks):
+        try:
+            hook(record)
+        except Exception as e:
+            # Instrumentation must never cause a git command to fail
+            print(f"Command hook failed: {e}")
+
+
+@dataclass(frozen=True)
+class CommandRecord:
+    """
+    Immutable data class storing the details of a completed git command.
+    """
+
+    args: tuple
+    # Duration in seconds, exit status (None if terminated) and bytes of output
+    duration: float
+    returncode: int
+    output_size: int
+
+    @property
+    def command(self):
+        """
+        Returns the git command (e.g. "status"), ignoring any global options.
+        """
+        args = iter(self.args)
+        for arg in args:
+            if arg == "-c":
+                next(args, None)
+            elif not arg.startswith("-"):
+                return arg
+        return ""
+
+
+class GitBackend:
+    """
+    Long-lived git interface for a single repository. Object reads are served by
+    persistent 'git cat-file --batch' and 'git cat-file --batch-check' processes, while
+    all other commands are executed by a bounded pool of workers, with write commands
+    serialised through a single writer.
+
+    Commands may be invoked in the same way as a command baked with sh (e.g.
+    backend.commit(m="message") runs 'git commit -m message').
+    """
+
+    def __init__(self, dir_path, max_workers=4):
+        """
+        Creates new backend for repository at given path.
+
+        Arguments:
+            dir_path (str): path of repository
+            max_workers (int): maximum number of concurrent git commands
+        """
+        self.dir_path = dir_path
+        self._workers = threading.BoundedSemaphore(max_workers)
+        self._writer = threading.Lock()
+        self._reader = BatchReader(dir_path, "--batch")
+        self._checker = BatchReader(dir_path, "--batch-check")
+
+    def __call__(self, *args, _in=None, _env=None, **kwargs):
+        """
+        Runs git command with given arguments and returns its output.
+
+        Arguments:
+            args (str): command and positional arguments
+            _in (str): data to be written to standard input of command
+            _env (dict(str, str)): environment variables added for command
+            kwargs: options, converted to '-k value' or '--key=value'
+
+        Returns (str): standard output of command
+        """
+        args = list(args) + self._convert_options(kwargs)
+        stdin = _in.encode("utf-8", "surrogateescape") if _in else None
+        stdout = self.run(args, stdin, _env)
+        return stdout.decode("utf-8", "surrogateescape")
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        command = attr.replace("_", "-")
+
+        def run_command(*args, **kwargs):
+            return self(command, *args, **kwargs)
+
+        return run_command
+
+    def run(self, args, stdin=None, env=None, output=None):
+        """
+        Runs git command with given arguments using one of the pool's workers and returns
+        its raw output.
+
+        Arguments:
+            args (list(str)): command and arguments
+            stdin (bytes): data to be written to standard input of command
+            env (dict(str, str)): environment variables added for command
+            output (file): binary file to which standard output is written directly,
+                so that large outputs are not held in memory
+
+        Returns (bytes): standard output of command (empty if written to output)
+        """
+        lock = self._writer if args and args[0] in WRITE_COMMANDS else _NullLock()
+        with lock, self._workers:
+            start = time.perf_counter()
+            process = subprocess.run(
+                ["git"] + list(args),
+                cwd=self.dir_path,
+                env=dict(os.environ, **env) if env else None,
+                input=stdin,
+                stdout=subprocess.PIPE if output is None else output,
+                stderr=subprocess.PIPE,
+                creationflags=CREATION_FLAGS,
+            )
+        process.stdout = process.stdout or b""
+        _notify(args, start, process.returncode, len(process.stdout))
+        if process.returncode != 0:
+            raise GitError(
+                process.stderr.decode("utf-8", "replace").strip(), process.returncode
+            )
+        return process.stdout
+
+    def stream(self, args, separator=b"\0", env=None):
+        """
+        Runs git command with given arguments using one of the pool's workers, yielding
+        each record of its output as soon as it is read. The worker is held until the
+        output has been consumed or the generator is closed.
+
+        Arguments:
+            args (list(str)): command and arguments
+            separator (bytes): separator of output records
+            env (dict(str, str)): environment variables added for command
+
+        Returns (generator(str)): records of output
+        """
+        with self._workers:
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                ["git"] + list(args),
+                cwd=self.dir_path,
+                env=dict(os.environ, **env) if env else None,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                creationflags=CREATION_FLAGS,
+            )
+            output_size = 0
+            try:
+                buffer = b""
+                for chunk in iter(lambda: process.stdout.read1(65536), b""):
+                    output_size += len(chunk)
+                    records = (buffer + chunk).split(separator)
+                    buffer = records.pop()
+                    for record in records:
+                        yield record.decode("utf-8", "surrogateescape")
+                if buffer:
+                    yield buffer.decode("utf-8", "surrogateescape")
+                stderr = process.stderr.read()
+                if process.wait() != 0:
+                    raise GitError(
+                        stderr.decode("utf-8", "replace").strip(), process.returncode
+                    )
+            finally:
+                returncode = process.poll()
+                if returncode is None:
+                    # Terminated rather than killed so that git removes any lock files
+                    process.terminate()
+                    process.wait()
+                process.stdout.close()
+                process.stderr.close()
+                _notify(args, start, returncode, output_size)
+
+    def read_object(self, name):
+        """
+        Returns the type and contents of the object with the given name (e.g. a hash or
+        '<commit>:<path>'), without starting a new process.
+
+        Arguments:
+            name (str): name of object
+
+        Returns (tuple(str, bytes)): type and contents of object
+        """
+        start = time.perf_counter()
+        obj_type, contents = self._reader.read(name)
+        _notify(["cat-file", "--batch"], start, 0, len(contents))
+        return obj_type, contents
+
+    def copy_object(self, name, output):
+        """
+        Writes the contents of the object with the given name to the given binary file
+        in chunks, without starting a new process or holding the whole object in memory.
+
+        Arguments:
+            name (str): name of object
+            output (file): binary file object to which contents are written
+
+        Returns (int): size of object
+        """
+        start = time.perf_counter()
+        size = self._reader.copy(name, output)
+        _notify(["cat-file", "--batch"], start, 0, size)
+        return size
+
+    def check_object(self, name):
+        """
+        Returns the hash, type and size of the object with the given name, without
+        starting a new process.
+
+        Arguments:
+            name (str): name of object
+
+        Returns (tuple(str, str, int)): hash, type and size of object
+        """
+        start = time.perf_counter()
+        info = self._checker.read(name)
+        _notify(["cat-file", "--batch-check"], start, 0, 0)
+        return info
+
+    def close(self):
+        """
+        Terminates the persistent processes of the backend.
+        """
+        self._reader.close()
+        self._checker.close()
+
+    def _convert_options(self, options):
+        """
+        Converts keyword options to command line arguments in the manner of sh.
+
+        Arguments:
+            options (dict): keyword options
+
+        Returns (list(str)): command line arguments
+        """
+        args = []
+        for key, value in options.items():
+            if len(key) == 1:
+                flag = f"-{key}"
+                args.extend([flag] if value is True else [flag, str(value)])
+            else:
+                flag = f"--{key.replace('_', '-')}"
+                args.append(flag if value is True else f"{flag}={value}")
+        return args
+
+
+class AsyncGitBackend:
+    """
+    Asynchronous git interface for a single repository, for use within an asyncio event
+    loop. Commands are run with asyncio.create_subprocess_exec by a bounded number of
+    workers, and write commands share the writer of the given backend, so they are never
+    run concurrently with write commands of synchronous managers of the repository.
+    Cancelling a command terminates its process.
+    """
+
+    def __init__(self, base, max_workers=4):
+        """
+        Creates new asynchronous backend for the repository of the given backend.
+
+        Arguments:
+            base (GitBackend): backend of repository
+            max_workers (int): maximum number of concurrent git commands
+        """
+        self.base = base
+        self.dir_path = base.dir_path
+        self._workers = asyncio.Semaphore(max_workers)
+
+    async def __call__(self, *args, _in=None, _env=None, **kwargs):
+        """
+        Runs git command with given arguments and returns its output.
+
+        Arguments:
+            args (str): command and positional arguments
+            _in (str): data to be written to standard input of command
+            _env (dict(str, str)): environment variables added for command
+            kwargs: options, converted to '-k value' or '--key=value'
+
+        Returns (str): standard output of command
+        """
+        args = list(args) + self.base._convert_options(kwargs)
+        stdout = await self.run(
+            args, _in.encode("utf-8", "surrogateescape") if _in else None, _env
+        )
+        return stdout.decode("utf-8", "surrogateescape")
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        command = attr.replace("_", "-")
+
+        async def run_command(*args, **kwargs):
+            return await self(command, *args, **kwargs)
+
+        return run_command
+
+    async def run(self, args, stdin=None, env=None):
+        """
+        Runs git command with given arguments and returns its raw output. If the calling
+        task is cancelled (e.g. by a timeout), the process is terminated.
+
+        Arguments:
+            args (list(str)): command and arguments
+            stdin (bytes): data to be written to standard input of command
+            env (dict(str, str)): environment variables added for command
+
+        Returns (bytes): standard output of command
+        """
+        if args and args[0] in WRITE_COMMANDS:
+            lock = self._hold_writer()
+        else:
+            lock = contextlib.nullcontext()
+        async with lock, self._workers:
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                "git",
+                *args,
+                cwd=self.dir_path,
+                env=dict(os.environ, **env) if env else None,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                creationflags=CREATION_FLAGS,
+            )
+            stdout = b""
+            try:
+                stdout, stderr = await process.communicate(stdin)
+            finally:
+                returncode = process.returncode
+                if returncode is None:
+                    # Terminated rather than killed so that git removes any lock files
+                    process.terminate()
+                    await process.wait()
+                _notify(args, start, returncode, len(stdout))
+        if process.returncode != 0:
+            raise GitError(stderr.decode("utf-8", "replace").strip(), process.returncode)
+        return stdout
+
+    async def check_object(self, name):
+        """
+        Returns the hash, type and size of the object with the given name. The object is
+        looked up by the persistent process of the synchronous backend, on a separate
+        thread, rather than by starting a new process.
+
+        Arguments:
+            name (str): name of object
+
+        Returns (tuple(str, str, int)): hash, type and size of object
+        """
+        return await asyncio.to_thread(self.base.check_object, name)
+
+    async def copy_object(self, name, output, chunk_size=65536):
+        """
+        Writes the contents of the blob with the given name to the given binary file as
+        it is read from 'git cat-file blob'.
+
+        Arguments:
+            name (str): name of blob
+            output (file): binary file object to which contents are written
+            chunk_size (int): maximum number of bytes read at once
+
+        Returns (int): size of blob
+        """
+        async with self._workers:
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                "git",
+                "cat-file",
+                "blob",
+                name,
+                cwd=self.dir_path,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                creationflags=CREATION_FLAGS,
+            )
+            size = 0
+            try:
+                while True:
+                    chunk = await process.stdout.read(chunk_size)
+                    if not chunk:
+                        break
+                    output.write(chunk)
+                    size += len(chunk)
+                stderr = await process.stderr.read()
+                await process.wait()
+            finally:
+                returncode = process.returncode
+                if returncode is None:
+                    process.terminate()
+                    await process.wait()
+                _notify(["cat-file", "blob"], start, returncode, size)
+        if process.returncode != 0:
+            raise GitError(stderr.decode("utf-8", "replace").strip(), process.returncode)
+        return size
+
+    @contextlib.asynccontextmanager
+    async def _hold_writer(self):
+        """
+        Acquires the writer of the synchronous backend without blocking the event loop.
+        """
+        lock = self.base._writer
+        if not lock.acquire(blocking=False):
+            acquired = asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                # The writer is released as soon as the pending acquisition completes
+                acquired.add_done_callback(lambda x: lock.release())
+                raise
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+class BatchReader:
+    """
+    Persistent 'git cat-file' process used to read objects or object information.
+    The process is restarted if it exits unexpectedly.
+    """
+
+    def __init__(self, dir_path, mode):
+        """
+        Creates new reader for repository at given path. The process is started when the
+        first object is read.
+
+        Arguments:
+            dir_path (str): path of repository
+            mode (str): either '--batch' or '--batch-check'
+        """
+        self.dir_path = dir_path
+        self.mode = mode
+        self.process = None
+        self.lock = threading.Lock()
+
+    def read(self, name):
+        """
+        Returns the contents (if in '--batch' mode) or information (if in
+        '--batch-check' mode) of the object with the given name.
+
+        Arguments:
+            name (str): name of object
+
+        Returns (tuple): type and contents, or hash, type and size of object
+        """
+        if "\n" in name:
+            raise GitError(f"Invalid object name {name!r}")
+        with self.lock:
+            try:
+                return self._read(name)
+            except (BrokenPipeError, OSError, ValueError):
+                # Process has exited, so is restarted and the read attempted once more
+                self.close()
+                return self._read(name)
+
+    def copy(self, name, output, chunk_size=65536):
+        """
+        Writes the contents of the object with the given name to the given binary file.
+        Only available in '--batch' mode.
+
+        Arguments:
+            name (str): name of object
+            output (file): binary file object to which contents are written
+            chunk_size (int): maximum number of bytes read at once
+
+        Returns (int): size of object
+        """
+        if "\n" in name:
+            raise GitError(f"Invalid object name {name!r}")
+        with self.lock:
+            try:
+                size = self._read_header(name)[2]
+            except (BrokenPipeError, OSError, ValueError):
+                self.close()
+                size = self._read_header(name)[2]
+            remaining = size
+            try:
+                while remaining > 0:
+                    chunk = self.process.stdout.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError("cat-file process exited")
+                    output.write(chunk)
+                    remaining -= len(chunk)
+                self.process.stdout.read(1)
+            except BaseException:
+                # Process output is no longer aligned with requests
+                self.close()
+                raise
+            return size
+
+    def close(self):
+        if self.process is None:
+            return
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process.wait()
+        self.process = None
+
+    def _read(self, name):
+        c_hash, obj_type, size = self._read_header(name)
+        if self.mode == "--batch-check":
+            return c_hash, obj_type, size
+        contents = self.process.stdout.read(size)
+        # Contents are followed by a newline
+        self.process.stdout.read(1)
+        return obj_type, contents
+
+    def _read_header(self, name):
+        """
+        Requests the object with the given name and reads the header of the response.
+
+        Arguments:
+            name (str): name of object
+
+        Returns (tuple(str, str, int)): hash, type and size of object
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                ["git", "cat-file", self.mode],
+                cwd=self.dir_path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                creationflags=CREATION_FLAGS,
+            )
+        self.process.stdin.write(name.encode("utf-8", "surrogateescape") + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode("utf-8", "surrogateescape")
+        if not header:
+            raise ValueError("cat-file process exited")
+        fields = header.split()
+        if fields[-1] in ("missing", "ambiguous"):
+            raise GitError(f"Object {name} is {fields[-1]}")
+        return fields[0], fields[1], int(fields[2])
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class GitError(Exception):
+    """
+    Exception raised when a git command fails.
+    """
+
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.message = message
+        self.returncode = returncode
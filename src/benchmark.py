@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import manage
+
+# Proportion, minimum and maximum size in bytes of each kind of generated file
+FILE_KINDS = [
+    ("text", 0.70, 100, 4 * 1024),
+    ("text", 0.25, 4 * 1024, 16 * 1024),
+    ("binary", 0.05, 16 * 1024, 256 * 1024),
+]
+FILES_PER_DIRECTORY = 100
+WORDS = ["version", "control", "file", "change", "commit", "tree", "index", "store"]
+
+
+class BenchmarkManager(manage.FileManager):
+    """
+    FileManager which does not open previewed versions, so that only their retrieval is
+    measured.
+    """
+
+    def _open_destination(self, path):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure FileManager operations on synthetic repositories."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="numbers of files in generated trees (e.g. 1000 10000 100000)",
+    )
+    parser.add_argument(
+        "--edits", type=float, default=0.01, help="proportion of files edited per cycle"
+    )
+    parser.add_argument(
+        "--history", type=int, default=200, help="number of versions of the deep file"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="samples per operation")
+    parser.add_argument("--batch-size", type=int, default=0, help="CommitBatchSize")
+    parser.add_argument("--seed", type=int, default=0, help="seed of generated data")
+    parser.add_argument("--output", help="path of JSON results (default: stdout)")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size} files", file=sys.stderr)
+        results.extend(run_benchmark(size, args))
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": get_revision(),
+        "git": subprocess.run(
+            ["git", "--version"], capture_output=True, text=True
+        ).stdout.strip(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def run_benchmark(size, args):
+    """
+    Measures each operation on a temporary repository containing the given number of
+    files.
+
+    Arguments:
+        size (int): number of files in tree
+        args (argparse.Namespace): parameters of benchmark
+
+    Returns (list(dict)): results of each operation
+    """
+    rng = random.Random(args.seed)
+    results = []
+
+    def record(operation, samples, **details):
+        results.append(summarise(operation, size, samples, **details))
+
+    with tempfile.TemporaryDirectory(prefix="verdite-bench-") as root:
+        dir_path = os.path.realpath(os.path.join(root, "tree"))
+        temp_path = os.path.join(root, "temp")
+        paths = generate_tree(dir_path, size, rng)
+        manager = BenchmarkManager(dir_path, temp_path, args.batch_size)
+        for config in (["user.name", "Benchmark"], ["user.email", "bench@localhost"]):
+            manager.repo.config(*config)
+
+        record("get_changes_initial", [measure(lambda: list(manager.get_changes()))])
+        record("store_changes_initial", [measure(manager.store_changes)])
+        record("has_changed_clean", repeat(manager.has_changed, args.repeat))
+
+        # Edit workload: a proportion of files is modified, and files are added and
+        # deleted, before the changes are detected and stored
+        edits = max(1, int(size * args.edits))
+        get_samples, has_samples, store_samples = [], [], []
+        for cycle in range(args.repeat):
+            paths = edit_tree(dir_path, paths, edits, rng, cycle)
+            has_samples.append(measure(manager.has_changed))
+            get_samples.append(measure(lambda: list(manager.get_changes())))
+            store_samples.append(measure(manager.store_changes))
+        record("has_changed_edited", has_samples, edits=edits)
+        record("get_changes_edited", get_samples, edits=edits)
+        record("store_changes_edited", store_samples, edits=edits)
+
+        # Deep history: a single file is saved repeatedly, as when it is edited
+        # continuously, and its versions are then retrieved
+        deep_path = os.path.join(dir_path, paths[0])
+        single_samples = []
+        for i in range(args.history):
+            write_file(deep_path, "text", 2048, rng, salt=i)
+            single_samples.append(measure(lambda: manager.store_changes([paths[0]])))
+        record("store_changes_single", single_samples)
+        manager.index.close()
+        os.remove(os.path.join(manager.git_dir, "verdite", "index.sqlite"))
+        record(
+            "get_file_versions_cold",
+            [measure(lambda: manager.get_file_versions(deep_path))],
+            versions=args.history + 1,
+        )
+        record(
+            "get_file_versions",
+            repeat(lambda: manager.get_file_versions(deep_path), args.repeat),
+            versions=args.history + 1,
+        )
+        open_samples, cached_samples = [], []
+        # Each version is opened once uncached, as versions share the preview cache
+        versions = range(1, args.history + 2)
+        for version_num in rng.sample(versions, min(args.repeat, len(versions))):
+            open_samples.append(
+                measure(lambda: manager.open_file_version(deep_path, version_num))
+            )
+            cached_samples.append(
+                measure(lambda: manager.open_file_version(deep_path, version_num))
+            )
+        record("open_file_version", open_samples)
+        record("open_file_version_cached", cached_samples)
+        record(
+            "restore_file_version",
+            repeat(
+                lambda: manager.restore_file_version(
+                    deep_path, rng.randint(1, args.history)
+                ),
+                args.repeat,
+            ),
+        )
+        manager.index.close()
+        manager.repo.close()
+    return results
+
+
+def generate_tree(dir_path, size, rng):
+    """
+    Creates a tree of files with a mixture of sizes and text and binary contents.
+
+    Arguments:
+        dir_path (str): path of root of tree
+        size (int): number of files
+        rng (random.Random): source of random data
+
+    Returns (list(str)): paths of files relative to root, with '/' separators
+    """
+    paths = []
+    for i in range(size):
+        directory = f"d{i // FILES_PER_DIRECTORY // FILES_PER_DIRECTORY}"
+        directory += f"/d{i // FILES_PER_DIRECTORY % FILES_PER_DIRECTORY}"
+        kind, minimum, maximum = choose_kind(rng)
+        path = f"{directory}/f{i}.{'txt' if kind == 'text' else 'bin'}"
+        write_file(os.path.join(dir_path, path), kind, rng.randint(minimum, maximum), rng)
+        paths.append(path)
+    return paths
+
+
+def edit_tree(dir_path, paths, edits, rng, cycle):
+    """
+    Modifies the given number of files, and adds and deletes a tenth as many.
+
+    Arguments:
+        dir_path (str): path of root of tree
+        paths (list(str)): paths of files in tree
+        edits (int): number of files modified
+        rng (random.Random): source of random data
+        cycle (int): number of edit cycle
+
+    Returns (list(str)): paths of files in tree after edits
+    """
+    # The first file is reserved for the deep history benchmark
+    for path in rng.sample(paths[1:], min(edits, len(paths) - 1)):
+        full_path = os.path.join(dir_path, path)
+        kind = "text" if path.endswith(".txt") else "binary"
+        write_file(full_path, kind, os.path.getsize(full_path), rng, salt=cycle)
+    changes = max(1, edits // 10)
+    deleted = set(rng.sample(paths[1:], min(changes, len(paths) - 1)))
+    for path in deleted:
+        os.remove(os.path.join(dir_path, path))
+    added = [f"new/c{cycle}/f{i}.txt" for i in range(changes)]
+    for path in added:
+        write_file(os.path.join(dir_path, path), "text", rng.randint(100, 4096), rng)
+    return [x for x in paths if x not in deleted] + added
+
+
+def choose_kind(rng):
+    value = rng.random()
+    for kind, proportion, minimum, maximum in FILE_KINDS:
+        if value < proportion:
+            return kind, minimum, maximum
+        value -= proportion
+    return FILE_KINDS[-1][0], FILE_KINDS[-1][2], FILE_KINDS[-1][3]
+
+
+def write_file(path, kind, size, rng, salt=None):
+    """
+    Writes a file of the given kind and approximate size.
+
+    Arguments:
+        path (str): path of file
+        kind (str): "text" or "binary"
+        size (int): size of file in bytes
+        rng (random.Random): source of random data
+        salt (int): value included in contents to ensure they change
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if kind == "binary":
+        data = rng.randbytes(size)
+    else:
+        words = []
+        length = 0
+        if salt is not None:
+            words.append(f"edit {salt}")
+        while length < size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        data = " ".join(words).encode("ascii")[:size]
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def measure(function):
+    """
+    Returns the time taken to call the given function, hiding its output.
+
+    Arguments:
+        function (function): function taking no arguments
+
+    Returns (float): seconds taken by function
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+
+def repeat(function, count):
+    return [measure(function) for _ in range(count)]
+
+
+def summarise(operation, size, samples, **details):
+    """
+    Returns the result of an operation.
+
+    Arguments:
+        operation (str): name of operation
+        size (int): number of files in tree
+        samples (list(float)): seconds taken by each call
+        details: additional parameters of operation
+
+    Returns (dict): statistics of samples
+    """
+    return dict(
+        operation=operation,
+        files=size,
+        samples=samples,
+        min=min(samples),
+        median=statistics.median(samples),
+        mean=statistics.fmean(samples),
+        max=max(samples),
+        **details,
+    )
+
+
+def get_revision():
+    process = subprocess.run(
+        ["git", "describe", "--always", "--dirty"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    return process.stdout.strip() or None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+
+MANIFEST_NAME = "manifest.json"
+
+
+class PreviewCache:
+    """
+    Content-addressed cache of previewed file versions. Each version is stored once per
+    blob hash (under the name of the file it was opened from), and the least recently
+    used versions are evicted once the total size of the cache exceeds its limit.
+    References of the form '<commit>:<path>' are mapped to blob hashes, so that a
+    recently viewed version can be reopened without consulting the repository.
+    """
+
+    def __init__(self, cache_dir, max_size=512 * 1024 * 1024):
+        """
+        Creates new cache in the given directory, removing any files which are not
+        recorded in its manifest and evicting entries beyond the size limit.
+
+        Arguments:
+            cache_dir (str): path of cache directory
+            max_size (int): maximum total size of cached versions in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        # Blob hashes and their file names, size and time of last access
+        self.entries = {}
+        # References ('<commit>:<path>') and the hashes of their blobs
+        self.refs = {}
+        self._load()
+        self._clean()
+
+    def get(self, ref, file_name):
+        """
+        Returns the path of the cached version with the given reference, or None if it
+        is not cached.
+
+        Arguments:
+            ref (str): reference of version, of the form '<commit>:<path>'
+            file_name (str): name of file the version is opened as
+
+        Returns (str): path of cached version
+        """
+        with self.lock:
+            blob = self.refs.get(ref)
+            if blob is None:
+                return None
+            return self.get_blob(blob, file_name)
+
+    def get_blob(self, blob, file_name):
+        """
+        Returns the path of the cached blob with the given hash, or None if it is not
+        cached.
+
+        Arguments:
+            blob (str): hash of blob
+            file_name (str): name of file the version is opened as
+
+        Returns (str): path of cached version
+        """
+        with self.lock:
+            entry = self.entries.get(blob)
+            if entry is None:
+                return None
+            path = self._get_path(blob, file_name)
+            if file_name not in entry["names"]:
+                # Same contents were previously opened under a different name
+                source = self._get_path(blob, entry["names"][0])
+                try:
+                    shutil.copyfile(source, path)
+                except OSError:
+                    self._remove(blob)
+                    return None
+                os.chmod(path, stat.S_IREAD)
+                entry["names"].append(file_name)
+                entry["accessed"] = time.time()
+                self._evict(keep=blob)
+            elif not self._is_intact(path, entry["size"]):
+                self._remove(blob)
+                return None
+            entry["accessed"] = time.time()
+            self._save()
+            return path
+
+    def store(self, ref, blob, file_name, write):
+        """
+        Stores the version with the given reference and blob hash in the cache, if it is
+        not already cached, and returns its path.
+
+        Arguments:
+            ref (str): reference of version, of the form '<commit>:<path>'
+            blob (str): hash of blob
+            file_name (str): name of file the version is opened as
+            write (function): function writing contents of blob to given binary file
+
+        Returns (str): path of cached version
+        """
+        with self.lock:
+            self.refs[ref] = blob
+            path = self.get_blob(blob, file_name)
+            if path is not None:
+                return path
+            path = self._get_path(blob, file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + ".part"
+            try:
+                with open(temp_path, "wb") as f:
+                    write(f)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            return self.add(ref, blob, file_name, temp_path)
+
+    def add(self, ref, blob, file_name, source_path):
+        """
+        Moves the given file, which holds the contents of the version with the given
+        reference and blob hash, into the cache and returns its new path. The file is
+        removed instead if the version is already cached. Used when a version is written
+        outside the lock of the cache (e.g. asynchronously).
+
+        Arguments:
+            ref (str): reference of version, of the form '<commit>:<path>'
+            blob (str): hash of blob
+            file_name (str): name of file the version is opened as
+            source_path (str): path of file on the same file system as the cache
+
+        Returns (str): path of cached version
+        """
+        with self.lock:
+            self.refs[ref] = blob
+            path = self.get_blob(blob, file_name)
+            if path is not None:
+                os.remove(source_path)
+                return path
+            path = self._get_path(blob, file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(source_path, path)
+            # Cached versions are read-only, so that they cannot be changed when opened
+            os.chmod(path, stat.S_IREAD)
+            self.entries[blob] = {
+                "names": [file_name],
+                "size": os.path.getsize(path),
+                "accessed": time.time(),
+            }
+            self._evict(keep=blob)
+            self._save()
+            return path
+
+    def _get_path(self, blob, file_name):
+        return os.path.join(self.cache_dir, blob, file_name)
+
+    def _is_intact(self, path, size):
+        try:
+            return os.path.getsize(path) == size
+        except OSError:
+            return False
+
+    def _evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache is within its size limit.
+        Each copy of a version (under a different file name) counts towards the size.
+        Entries which cannot be removed are skipped, and are removed by a later eviction.
+
+        Arguments:
+            keep (str): hash of blob which must not be removed
+        """
+        total = sum(x["size"] * len(x["names"]) for x in self.entries.values())
+        by_access = sorted(self.entries.items(), key=lambda x: x[1]["accessed"])
+        for blob, entry in by_access:
+            if total <= self.max_size:
+                break
+            if blob == keep:
+                continue
+            if self._remove(blob):
+                total -= entry["size"] * len(entry["names"])
+
+    def _remove(self, blob):
+        """
+        Removes the entry with the given blob hash and all references to it. If its
+        files cannot be removed (e.g. on Windows, while the version is open in another
+        application), the entry is kept so that it is removed later.
+
+        Arguments:
+            blob (str): hash of blob
+
+        Returns (bool): true if entry was removed
+        """
+        try:
+            self._remove_directory(os.path.join(self.cache_dir, blob))
+        except OSError:
+            # Any files which were removed are found to be missing when next opened
+            return False
+        self.entries.pop(blob, None)
+        self.refs = {k: v for k, v in self.refs.items() if v != blob}
+        return True
+
+    def _remove_directory(self, path):
+        def make_writable(function, target, exc_info):
+            # Read-only files cannot be removed on Windows
+            os.chmod(target, stat.S_IWRITE)
+            function(target)
+
+        shutil.rmtree(path, onerror=make_writable)
+
+    def _clean(self):
+        """
+        Removes files not recorded in the manifest and entries whose files are missing,
+        then evicts entries beyond the size limit.
+        """
+        with self.lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name == MANIFEST_NAME:
+                    continue
+                if name not in self.entries:
+                    try:
+                        if os.path.isdir(path):
+                            self._remove_directory(path)
+                        else:
+                            os.remove(path)
+                    except OSError:
+                        # Removed when the cache is next created
+                        pass
+            for blob, entry in list(self.entries.items()):
+                paths = [self._get_path(blob, x) for x in entry["names"]]
+                if not all(self._is_intact(x, entry["size"]) for x in paths):
+                    self._remove(blob)
+            self._evict()
+            self._save()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.cache_dir, MANIFEST_NAME), "r") as f:
+                manifest = json.load(f)
+            self.entries = manifest["entries"]
+            self.refs = manifest["refs"]
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+            self.refs = {}
+
+    def _save(self):
+        manifest_path = os.path.join(self.cache_dir, MANIFEST_NAME)
+        with open(manifest_path + ".part", "w") as f:
+            json.dump({"entries": self.entries, "refs": self.refs}, f)
+        os.replace(manifest_path + ".part", manifest_path)
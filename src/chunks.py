@@ -0,0 +1,393 @@
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+# First line of the pointer stored in the repository in place of a large file
+POINTER_HEADER = b"verdite-chunks 1\n"
+# Pointers are never larger than this, so larger blobs need not be inspected
+MAX_POINTER_SIZE = 1024 * 1024
+
+# Chunk sizes in bytes. Boundaries are found by a rolling hash of the last 32 bytes, so
+# an edit only changes the chunks it touches rather than every chunk after it.
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+BOUNDARY_MASK = 0xFFFF0000
+GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([x])).digest()[:4], "big") for x in range(256)
+)
+
+# Maximum length of the data in a pkt-line of git's long-running filter protocol
+MAX_PACKET_DATA = 65516
+
+
+class ChunkStore:
+    """
+    Content-addressed store of file chunks, kept next to the repository (in the git
+    directory). Files larger than the threshold are split into content-defined chunks,
+    each of which is stored once however many versions contain it, and the repository
+    holds a small pointer listing the chunks of the file. The growth of the store
+    therefore depends on the size of each edit rather than the size of the file.
+    """
+
+    def __init__(self, store_path, threshold):
+        """
+        Creates new store in the given directory.
+
+        Arguments:
+            store_path (str): path of chunk directory
+            threshold (int): minimum size in bytes of files which are chunked
+        """
+        self.store_path = store_path
+        self.threshold = threshold
+
+    def clean(self, blocks, output):
+        """
+        Writes the contents to be stored in the repository for the file with the given
+        contents: a pointer to its chunks if it is at least the threshold size, or
+        otherwise the contents unchanged.
+
+        Arguments:
+            blocks (iterable(bytes)): contents of file
+            output (function): function writing bytes to be stored in repository
+        """
+        blocks = iter(blocks)
+        head = bytearray()
+        for block in blocks:
+            head += block
+            if len(head) >= self.threshold:
+                break
+        else:
+            output(bytes(head))
+            return
+        if parse_pointer(head) is not None:
+            # Pointers are never chunked again
+            output(bytes(head))
+            for block in blocks:
+                output(block)
+            return
+        digest = hashlib.sha256()
+        entries = []
+        size = 0
+        for chunk in split_chunks(_prepend(head, blocks)):
+            digest.update(chunk)
+            entries.append((self._store_chunk(chunk), len(chunk)))
+            size += len(chunk)
+        output(create_pointer(size, digest.hexdigest(), entries))
+
+    def smudge(self, data, output):
+        """
+        Writes the contents of the working file for the given contents stored in the
+        repository, reassembling them from their chunks if they are a pointer.
+
+        Arguments:
+            data (bytes): contents stored in repository
+            output (function): function writing contents of file
+        """
+        pointer = parse_pointer(data)
+        if pointer is None:
+            output(data)
+        else:
+            self.write(pointer, output)
+
+    def write(self, pointer, output):
+        """
+        Writes the contents of the file described by the given pointer.
+
+        Arguments:
+            pointer (tuple): size, hash and chunks of file, as returned by parse_pointer
+            output (function): function writing contents of file
+        """
+        for chunk_hash, size in pointer[2]:
+            with open(self._get_path(chunk_hash), "rb") as f:
+                chunk = f.read()
+            if len(chunk) != size:
+                raise OSError(f"Chunk {chunk_hash} is damaged")
+            output(chunk)
+
+    def remove_unreferenced(self, referenced, min_age=3600):
+        """
+        Removes the chunks which are not referenced by any pointer. Recently written
+        chunks are kept, as they may belong to a file which is being stored.
+
+        Arguments:
+            referenced (set(str)): hashes of chunks referenced by pointers
+            min_age (float): minimum seconds since a chunk was written for it to be
+                removed
+
+        Returns (int): number of chunks removed
+        """
+        if not os.path.isdir(self.store_path):
+            return 0
+        removed = 0
+        now = time.time()
+        for prefix in os.listdir(self.store_path):
+            directory = os.path.join(self.store_path, prefix)
+            for name in os.listdir(directory):
+                if prefix + name in referenced:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if now - os.path.getmtime(path) >= min_age:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def _store_chunk(self, chunk):
+        """
+        Stores the given chunk if it is not already stored, and returns its hash.
+
+        Arguments:
+            chunk (bytes): contents of chunk
+
+        Returns (str): hash of chunk
+        """
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        path = self._get_path(chunk_hash)
+        if os.path.exists(path):
+            return chunk_hash
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(chunk)
+            os.replace(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+            raise
+        return chunk_hash
+
+    def _get_path(self, chunk_hash):
+        return os.path.join(self.store_path, chunk_hash[:2], chunk_hash[2:])
+
+
+def split_chunks(blocks):
+    """
+    Splits the contents of a file into content-defined chunks.
+
+    Arguments:
+        blocks (iterable(bytes)): contents of file
+
+    Returns (generator(bytes)): chunks of contents
+    """
+    buffer = b""
+    for block in blocks:
+        buffer += block
+        start = 0
+        while len(buffer) - start >= MAX_CHUNK_SIZE:
+            end = _find_boundary(buffer, start, len(buffer))
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+    start = 0
+    while start < len(buffer):
+        end = _find_boundary(buffer, start, len(buffer))
+        yield buffer[start:end]
+        start = end
+
+
+def _find_boundary(data, start, end):
+    """
+    Returns the end of the chunk starting at the given offset: the first position after
+    the minimum chunk size at which the rolling hash matches the boundary mask, or the
+    maximum chunk size if there is no such position.
+
+    Arguments:
+        data (bytes): data to be split
+        start (int): offset of start of chunk
+        end (int): offset of end of data
+
+    Returns (int): offset of end of chunk
+    """
+    if end - start <= MIN_CHUNK_SIZE:
+        return end
+    limit = min(end, start + MAX_CHUNK_SIZE)
+    position = start + MIN_CHUNK_SIZE
+    gear = GEAR
+    rolling = 0
+    for byte in data[position:limit]:
+        rolling = ((rolling << 1) + gear[byte]) & 0xFFFFFFFF
+        position += 1
+        if not rolling & BOUNDARY_MASK:
+            return position
+    return limit
+
+
+def _prepend(head, blocks):
+    yield bytes(head)
+    yield from blocks
+
+
+def create_pointer(size, file_hash, entries):
+    """
+    Returns pointer to a chunked file, having the form:
+
+        verdite-chunks 1
+        size <size>
+        sha256 <hash of file>
+        <hash of chunk> <size of chunk>
+        ...
+
+    Arguments:
+        size (int): size of file
+        file_hash (str): hash of file
+        entries (list(tuple(str, int))): hash and size of each chunk
+
+    Returns (bytes): pointer to file
+    """
+    lines = [f"size {size}", f"sha256 {file_hash}"]
+    lines += [f"{chunk_hash} {length}" for chunk_hash, length in entries]
+    return POINTER_HEADER + ("\n".join(lines) + "\n").encode("ascii")
+
+
+def parse_pointer(data):
+    """
+    Parses the given contents as a pointer to a chunked file.
+
+    Arguments:
+        data (bytes): contents of file stored in repository
+
+    Returns (tuple(int, str, list(tuple(str, int)))): size, hash and chunks of file, or
+        None if the contents are not a pointer
+    """
+    if not data.startswith(POINTER_HEADER) or len(data) > MAX_POINTER_SIZE:
+        return None
+    try:
+        lines = bytes(data[len(POINTER_HEADER) :]).decode("ascii").splitlines()
+        size = int(lines[0].split(" ")[1])
+        file_hash = lines[1].split(" ")[1]
+        entries = [(x.split(" ")[0], int(x.split(" ")[1])) for x in lines[2:]]
+    except (UnicodeDecodeError, IndexError, ValueError):
+        return None
+    if sum(x[1] for x in entries) != size:
+        return None
+    return size, file_hash, entries
+
+
+def get_filter_command(store_path, threshold):
+    """
+    Returns the command which git runs as the long-running filter process of the given
+    chunk store.
+
+    Arguments:
+        store_path (str): path of chunk directory
+        threshold (int): minimum size in bytes of files which are chunked
+
+    Returns (str): shell command running filter
+    """
+    script = os.path.abspath(__file__)
+    args = [sys.executable, script, store_path, str(threshold)]
+    return " ".join('"' + x.replace("\\", "/") + '"' for x in args)
+
+
+class FilterProcess:
+    """
+    Long-running filter used by git to clean (chunk) and smudge (reassemble) files, so
+    that a single process handles every file of a git command. Communicates with git
+    using the pkt-line protocol described in gitattributes(5).
+    """
+
+    def __init__(self, store, stdin, stdout):
+        """
+        Arguments:
+            store (ChunkStore): store of chunks
+            stdin (file): binary input from git
+            stdout (file): binary output to git
+        """
+        self.store = store
+        self.stdin = stdin
+        self.stdout = stdout
+
+    def run(self):
+        if self._read_text() != ["git-filter-client", "version=2"]:
+            raise ValueError("Unsupported filter protocol")
+        self._write_text(["git-filter-server", "version=2"])
+        # Files are only cleaned (chunked) if chunking is enabled, while chunked files
+        # are always reassembled
+        supported = ["capability=smudge"]
+        if self.store.threshold > 0:
+            supported.append("capability=clean")
+        self._write_text([x for x in self._read_text() if x in supported])
+        while True:
+            request = self._read_text()
+            if not request:
+                return
+            headers = dict(x.split("=", 1) for x in request)
+            blocks = iter(self._read_packet, None)
+            if headers.get("command") == "clean":
+                self._respond(lambda output: self.store.clean(blocks, output), blocks)
+            elif headers.get("command") == "smudge":
+                self._respond(
+                    lambda output: self.store.smudge(b"".join(blocks), output), blocks
+                )
+            else:
+                self._respond(None, blocks)
+
+    def _respond(self, apply, blocks):
+        """
+        Writes the result of the given filter function, or an error status if it fails.
+        Output is collected before the status is sent, so that a failure part-way
+        through does not leave git with partial contents.
+
+        Arguments:
+            apply (function): function taking an output function, or None if the
+                command is not supported
+            blocks (iterator(bytes)): contents sent by git, which must be consumed
+        """
+        parts = []
+        try:
+            if apply is not None:
+                apply(parts.append)
+        except (OSError, ValueError):
+            apply = None
+        finally:
+            for _ in blocks:
+                pass
+        if apply is None:
+            self._write_text(["status=error"])
+            return
+        self._write_text(["status=success"])
+        for part in parts:
+            for i in range(0, len(part), MAX_PACKET_DATA):
+                self._write_packet(part[i : i + MAX_PACKET_DATA])
+        self._write_flush()
+        # Empty list keeps the status given above
+        self._write_flush()
+
+    def _read_packet(self):
+        header = self.stdin.read(4)
+        if len(header) < 4:
+            raise EOFError("git closed the filter")
+        length = int(header, 16)
+        if length == 0:
+            return None
+        return self.stdin.read(length - 4)
+
+    def _read_text(self):
+        lines = []
+        for packet in iter(self._read_packet, None):
+            lines.append(packet.decode("utf-8", "surrogateescape").rstrip("\n"))
+        return lines
+
+    def _write_packet(self, data):
+        self.stdout.write(b"%04x" % (len(data) + 4) + data)
+
+    def _write_flush(self):
+        self.stdout.write(b"0000")
+        self.stdout.flush()
+
+    def _write_text(self, lines):
+        for line in lines:
+            self._write_packet(line.encode("utf-8", "surrogateescape") + b"\n")
+        self._write_flush()
+
+
+if __name__ == "__main__":
+    try:
+        store = ChunkStore(sys.argv[1], int(sys.argv[2]))
+        FilterProcess(store, sys.stdin.buffer, sys.stdout.buffer).run()
+    except EOFError:
+        pass
@@ -1,35 +1,219 @@
 import configparser
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_config_manager(config_name="config.ini"):
+    """
+    Returns the shared manager of the given configuration file, creating it if necessary,
+    so that the file is only parsed once per process.
+
+    Arguments:
+        config_name (str): path of configuration file
+
+    Returns (ConfigManager): manager of configuration file
+    """
+    with _managers_lock:
+        if config_name not in _managers:
+            _managers[config_name] = ConfigManager(config_name)
+        return _managers[config_name]
+
+
+@dataclass(frozen=True)
+class FolderSettings:
+    """
+    Immutable data class storing the settings of a single tracked folder.
+    """
+
+    path: str
+    active: bool
+    interval: int
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Immutable data class storing the values of all settings at a point in time.
+    """
+
+    target_path: str
+    temp_path: str
+    interval: int
+    active: bool
+    watch: bool
+    quiet_period: float
+    max_delay: float
+    batch_size: int
+    preview_cache_size: int
+    chunk_threshold: int
+    maintenance_idle_time: float
+    # Hours for which all versions are kept, then days for which hourly and daily
+    # versions are kept (None if all versions are kept indefinitely)
+    retention: tuple
+    # Paths of Prometheus metrics file and JSON event log ("" if not written)
+    metrics_path: str
+    metrics_log_path: str
+    metrics_interval: float
+    workers: int
+    # All tracked folders, the first of which is the target folder
+    folders: tuple
 
 
 class ConfigManager:
+    """
+    Interface to the configuration file. The file is parsed into a snapshot which is only
+    reloaded when the file is replaced or modified, and is written atomically so that
+    readers never observe a partially written file. Subscribers are notified whenever the
+    values of settings change.
+    """
+
+    def __init__(self, config_name="config.ini"):
+        """
+        Creates new manager of the given configuration file.
 
-    def __init__(self):
+        Arguments:
+            config_name (str): path of configuration file
+        """
         self.config = configparser.ConfigParser()
-        self.config_name = "config.ini"
+        self.config_name = config_name
+        self.snapshot = None
+        self.subscribers = []
+        self.lock = threading.RLock()
+        # Identity and modification time of the file when it was last read
+        self.file_state = None
         self.refresh()
 
     def refresh(self):
-        self.config.read(self.config_name)
+        """
+        Reloads the configuration file if it has changed since it was last read.
+        """
+        with self.lock:
+            try:
+                info = os.stat(self.config_name)
+                file_state = (info.st_ino, info.st_mtime_ns, info.st_size)
+            except OSError:
+                file_state = None
+            if file_state == self.file_state and self.snapshot is not None:
+                return
+            parser = configparser.ConfigParser()
+            try:
+                parser.read(self.config_name)
+                snapshot = self._create_snapshot(parser)
+            except (configparser.Error, KeyError, ValueError):
+                if self.snapshot is not None:
+                    # Keep the last valid values until the file is fixed
+                    return
+                raise
+            self.config = parser
+            self.file_state = file_state
+            self._set_snapshot(snapshot)
 
     def store(self):
-        with open(self.config_name, "w") as f:
-            self.config.write(f)
+        """
+        Writes the configuration to a temporary file, which then replaces the
+        configuration file.
+        """
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.config_name))
+            fd, temp_name = tempfile.mkstemp(
+                prefix=".config-", suffix=".tmp", dir=directory
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    self.config.write(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Temporary files are only readable by their owner, so the permissions
+                # of the configuration file are kept
+                os.chmod(temp_name, self._get_file_mode())
+                os.replace(temp_name, self.config_name)
+            except OSError:
+                os.remove(temp_name)
+                raise
+            self.refresh()
 
-    def get_target_path(self):
+    def _get_file_mode(self):
+        """
+        Returns the permissions of the configuration file, or the default permissions
+        of new files if it does not exist.
+
+        Returns (int): permission bits of file
+        """
+        try:
+            return os.stat(self.config_name).st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+    def subscribe(self, callback):
+        """
+        Registers a function to be called with the previous and new snapshots whenever
+        the values of settings change.
+
+        Arguments:
+            callback (function): function taking two ConfigSnapshot arguments
+        """
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def get_snapshot(self):
+        """
+        Returns the current values of all settings.
+
+        Returns (ConfigSnapshot): current settings
+        """
         self.refresh()
-        return self.config["DIRECTORIES"]["Target"]
+        return self.snapshot
+
+    def get_target_path(self):
+        return self.get_snapshot().target_path
 
     def get_temp_path(self):
-        self.refresh()
-        return self.config["DIRECTORIES"]["Temp"]
-    
+        return self.get_snapshot().temp_path
+
     def get_interval(self):
-        self.refresh()
-        return self.config["SETTINGS"].getint("CheckInterval")
+        return self.get_snapshot().interval
 
     def get_active(self):
-        self.refresh()
-        return self.config["SETTINGS"].getboolean("Active")
+        return self.get_snapshot().active
+
+    def get_watch(self):
+        return self.get_snapshot().watch
+
+    def get_quiet_period(self):
+        return self.get_snapshot().quiet_period
+
+    def get_max_delay(self):
+        return self.get_snapshot().max_delay
+
+    def get_batch_size(self):
+        return self.get_snapshot().batch_size
+
+    def get_preview_cache_size(self):
+        return self.get_snapshot().preview_cache_size
+
+    def get_chunk_threshold(self):
+        return self.get_snapshot().chunk_threshold
+
+    def get_maintenance_idle_time(self):
+        return self.get_snapshot().maintenance_idle_time
+
+    def get_retention(self):
+        return self.get_snapshot().retention
+
+    def get_folders(self):
+        return self.get_snapshot().folders
 
     def set_interval(self, interval):
         """
@@ -38,9 +222,8 @@ class ConfigManager:
         Arguments:
             interval (int): new interval value
         """
-        self.config["SETTINGS"]["CheckInterval"] = str(interval)
-        self.store()
-    
+        self._set_value("SETTINGS", "CheckInterval", str(interval))
+
     def set_active(self, active):
         """
         Sets active state to given value.
@@ -48,15 +231,112 @@ class ConfigManager:
         Arguments:
             active (bool): new active state
         """
-        self.config["SETTINGS"]["Active"] = str(active)
-        self.store()
+        self._set_value("SETTINGS", "Active", str(active))
 
     def set_target_path(self, dir_path):
         """
-        Sets active state to given value.
+        Sets target directory to given path.
 
         Arguments:
-            active (bool): new active state
+            dir_path (str): path of new target directory
+        """
+        self._set_value("DIRECTORIES", "Target", dir_path)
+
+    def _set_value(self, section, key, value):
+        """
+        Sets the given setting and stores the configuration. The file is reloaded first,
+        so that changes made by other processes are not overwritten.
+
+        Arguments:
+            section (str): section of setting
+            key (str): name of setting
+            value (str): new value of setting
+        """
+        with self.lock:
+            self.refresh()
+            self.config[section][key] = value
+            self.store()
+
+    def _set_snapshot(self, snapshot):
+        """
+        Replaces the current snapshot, notifying subscribers if any values changed.
+
+        Arguments:
+            snapshot (ConfigSnapshot): new snapshot
+        """
+        previous = self.snapshot
+        self.snapshot = snapshot
+        if previous is None or previous == snapshot:
+            return
+        for callback in list(self.subscribers):
+            callback(previous, snapshot)
+
+    def _get_retention(self, settings):
+        """
+        Returns the retention periods in the given settings section.
+
+        Arguments:
+            settings (configparser.SectionProxy): settings section
+
+        Returns (tuple(float, float, float)): hours for which all versions are kept,
+            then days for which hourly and daily versions are kept, or None if
+            retention is disabled
+        """
+        if not settings.getboolean("Retention", fallback=False):
+            return None
+        return (
+            settings.getfloat("RetainAllHours", fallback=24),
+            settings.getfloat("RetainHourlyDays", fallback=7),
+            settings.getfloat("RetainDailyDays", fallback=90),
+        )
+
+    def _create_snapshot(self, parser):
+        """
+        Returns snapshot of the settings parsed by the given parser.
+
+        Arguments:
+            parser (configparser.ConfigParser): parser which has read configuration file
+
+        Returns (ConfigSnapshot): parsed settings
         """
-        self.config["DIRECTORIES"]["target"] = dir_path
-        self.store()
+        directories = parser["DIRECTORIES"]
+        settings = parser["SETTINGS"]
+        target_path = directories["Target"]
+        interval = settings.getint("CheckInterval")
+        active = settings.getboolean("Active")
+        folders = [FolderSettings(target_path, active, interval)]
+        for section in parser.sections():
+            # Additional folders are configured in sections of the form [FOLDER <name>]
+            if not section.startswith("FOLDER"):
+                continue
+            folder = parser[section]
+            if folder["Path"] == target_path:
+                continue
+            folders.append(
+                FolderSettings(
+                    folder["Path"],
+                    folder.getboolean("Active", fallback=True),
+                    folder.getint("CheckInterval", fallback=interval),
+                )
+            )
+        return ConfigSnapshot(
+            target_path=target_path,
+            temp_path=directories["Temp"],
+            interval=interval,
+            active=active,
+            watch=settings.getboolean("WatchChanges", fallback=True),
+            quiet_period=settings.getfloat("QuietPeriod", fallback=2),
+            max_delay=settings.getfloat("MaxDelay", fallback=60),
+            batch_size=settings.getint("CommitBatchSize", fallback=0),
+            preview_cache_size=settings.getint("PreviewCacheSize", fallback=512),
+            chunk_threshold=settings.getint("ChunkThreshold", fallback=0),
+            maintenance_idle_time=settings.getfloat(
+                "MaintenanceIdleTime", fallback=300
+            ),
+            retention=self._get_retention(settings),
+            metrics_path=settings.get("MetricsFile", fallback=""),
+            metrics_log_path=settings.get("MetricsLog", fallback=""),
+            metrics_interval=settings.getfloat("MetricsInterval", fallback=15),
+            workers=settings.getint("Workers", fallback=4),
+            folders=tuple(folders),
+        )
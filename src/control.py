@@ -1,38 +1,341 @@
+import backend
 import manage
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import config
+import maintain
+import metrics
+import retain
+import schedule
+import watch
 
 def control_loop():
     """
-    Main program loop. Refers to state of files in target directory at regular (five
-    second) intervals and stores any changes. 
+    Main program loop. Tracks every configured folder, waiting for files in each folder
+    to change (or, if changes cannot be watched, referring to the state of files at
+    regular intervals) and storing any changes once they have settled.
+    """
+    configure = config.get_config_manager()
+    daemon = TrackingDaemon(configure)
+    daemon.run()
+
+
+class TrackingDaemon:
+    """
+    Tracks all configured folders concurrently. Each folder is watched by its own
+    tracker, while changes are scanned for and stored by a bounded pool of workers shared
+    by all folders, so that a slow or large folder does not delay the others.
+    """
+
+    def __init__(self, configure):
+        """
+        Creates new daemon for the folders in the given configuration.
+
+        Arguments:
+            configure (config.ConfigManager): configuration of program
+        """
+        self.configure = configure
+        self.pool = ThreadPoolExecutor(configure.get_snapshot().workers)
+        # Paths of tracked folders and their trackers
+        self.trackers = {}
+        self.exporter = None
+        self.lock = threading.Lock()
+
+    def run(self, poll_interval=1):
+        """
+        Starts a tracker for each folder and keeps the set of trackers consistent with
+        the configuration until interrupted.
+
+        Arguments:
+            poll_interval (float): seconds between checks of configuration file
+        """
+        self.update_trackers()
+        self.update_exporter()
+        try:
+            while True:
+                time.sleep(poll_interval)
+                # Configuration file is only reloaded if it has changed
+                self.update_trackers()
+                self.update_exporter()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def update_trackers(self):
+        """
+        Starts trackers for newly configured folders and stops the trackers of folders
+        which are no longer configured. Trackers which have stopped unexpectedly are
+        replaced, and folders which could not be tracked are tried again.
+        """
+        settings = self.configure.get_snapshot()
+        paths = [x.path for x in settings.folders]
+        with self.lock:
+            for path in list(self.trackers):
+                if path not in paths:
+                    self.trackers.pop(path).stop()
+                    print(f"Stopped tracking {path}")
+                elif not self.trackers[path].is_alive():
+                    del self.trackers[path]
+                    print(f"Tracker of {path} stopped unexpectedly, restarting")
+            for path in paths:
+                if path in self.trackers:
+                    continue
+                try:
+                    tracker = FolderTracker(path, self.configure, self.pool)
+                except (manage.InvalidDirectoryError, OSError) as e:
+                    print(f"Unable to track {path}: {e}")
+                    continue
+                except backend.GitError as e:
+                    # Retried by the next update (e.g. once a lock file is removed)
+                    print(f"Unable to track {path}: {e.message}")
+                    continue
+                self.trackers[path] = tracker
+                tracker.start()
+                print(f"Tracking {path}")
+
+    def update_exporter(self):
+        """
+        Starts, restarts or stops the export of metrics according to the configuration.
+        """
+        settings = self.configure.get_snapshot()
+        target = (
+            settings.metrics_path or None,
+            settings.metrics_log_path or None,
+            settings.metrics_interval,
+        )
+        if self.exporter is not None:
+            exporter = self.exporter
+            if (exporter.metrics_path, exporter.log_path, exporter.interval) == target:
+                return
+            exporter.stop()
+            self.exporter = None
+        if settings.metrics_path or settings.metrics_log_path:
+            self.exporter = metrics.MetricsExporter(metrics.get_registry(), *target)
+            self.exporter.start()
+
+    def stop(self):
+        with self.lock:
+            for tracker in self.trackers.values():
+                tracker.stop()
+            self.trackers.clear()
+        self.pool.shutdown(wait=True)
+        if self.exporter is not None:
+            self.exporter.stop()
+
+
+class FolderTracker:
+    """
+    Watches a single folder on its own thread, submitting the scanning and storage of
+    changes to the daemon's worker pool.
+    """
+
+    def __init__(self, dir_path, configure, pool):
+        """
+        Creates new tracker for the folder at the given path.
+
+        Arguments:
+            dir_path (str): path of folder
+            configure (config.ConfigManager): configuration of program
+            pool (concurrent.futures.Executor): pool of workers storing changes
+        """
+        settings = configure.get_snapshot()
+        self.dir_path = dir_path
+        self.configure = configure
+        self.pool = pool
+        self.folder = self._get_folder_settings(settings)
+        self.manager = manage.FileManager(
+            dir_path,
+            settings.temp_path,
+            settings.batch_size,
+            chunk_threshold=settings.chunk_threshold,
+        )
+        self.watcher = create_watcher(
+            configure,
+            dir_path,
+            self.folder.interval,
+            self.manager.ignore,
+            self.manager.get_tracked_ignored,
+        )
+        # Bursts of changes to a file are coalesced so that each is stored once
+        self.scheduler = schedule.ChangeScheduler(
+            dir_path, settings.quiet_period, settings.max_delay
+        )
+        self.maintainer = maintain.MaintenanceScheduler(
+            self.manager.repo,
+            self.manager.git_dir,
+            get_retention_policy(settings),
+            self.manager.chunk_store,
+            self.manager.search,
+        )
+        # Time of the most recent change stored (monotonic clock)
+        self.last_change = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=dir_path, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the tracker once it finishes waiting for changes.
+        """
+        self.stopped.set()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def run(self):
+        # Changes made while the folder was not being watched are found by scanning the
+        # whole folder
+        full_scan = True
+        try:
+            while not self.stopped.is_set():
+                try:
+                    full_scan = self.run_cycle(full_scan)
+                except Exception as e:
+                    # Tracking continues after unexpected errors (e.g. of the index
+                    # database), scanning the whole folder once the interval has passed
+                    print(f"Error while tracking {self.dir_path}: {e}")
+                    full_scan = True
+                    self.stopped.wait(self.folder.interval)
+        finally:
+            self.watcher.close()
+
+    def run_cycle(self, full_scan):
+        """
+        Waits for changes to the folder, then stores any changes which are ready or
+        runs any maintenance which is due.
+
+        Arguments:
+            full_scan (bool): true if the whole folder must be scanned for changes
+
+        Returns (bool): true if the whole folder must be scanned in the next cycle
+        """
+        timeout = self.scheduler.get_timeout(self.folder.interval)
+        self.scheduler.add(self.watcher.wait(timeout))
+        if self.stopped.is_set():
+            return full_scan
+        settings = self.configure.get_snapshot()
+        self.folder = self._get_folder_settings(settings) or self.folder
+        self.manager.batch_size = settings.batch_size
+        self.scheduler.quiet_period = settings.quiet_period
+        self.scheduler.max_delay = settings.max_delay
+        if isinstance(self.watcher, watch.PollingWatcher):
+            self.watcher.interval = self.folder.interval
+        if not self.folder.active:
+            self.scheduler.clear()
+            print(f"No changes in {self.dir_path} (Active: False)")
+            return True
+        if full_scan:
+            self.scheduler.add(None)
+        paths = self.scheduler.pop_ready()
+        if paths is None or paths:
+            changes = self.pool.submit(
+                self.store_changes, paths, self.scheduler.ready_since
+            ).result()
+            print(f"{self.dir_path}: {changes}")
+            if changes:
+                self.last_change = time.monotonic()
+                return False
+        self.maintain(settings)
+        return False
+
+    def store_changes(self, paths, detected=None):
+        """
+        Stores the changes to the given paths, returning the files that were committed.
+        The duration and outcome of the cycle are recorded in the metrics registry.
+
+        Arguments:
+            paths (set(str) | None): paths to be stored, or None for the whole folder
+            detected (float): time at which the first of the changes was detected
+                (monotonic clock), if known
+
+        Returns (list(str)): all files that were committed
+        """
+        start = time.monotonic()
+        committed = []
+        error = None
+        try:
+            if self.manager.has_changed(paths):
+                committed = self.manager.store_changes(paths)
+        except backend.GitError as e:
+            # Changes will be stored by a later attempt
+            print(f"Unable to store changes in {self.dir_path}: {e.message}")
+            error = e.message
+        except Exception as e:
+            # Recorded before being handled by the tracker
+            error = str(e)
+            raise
+        finally:
+            end = time.monotonic()
+            latency = end - detected if detected is not None and committed else None
+            metrics.get_registry().observe_cycle(
+                self.dir_path, end - start, len(committed), latency, error
+            )
+        return committed
+
+    def maintain(self, settings):
+        """
+        Runs any maintenance of the repository which is due, if the folder has not
+        changed for the idle time and the machine is idle.
+
+        Arguments:
+            settings (config.ConfigSnapshot): current settings
+        """
+        idle_time = settings.maintenance_idle_time
+        if idle_time <= 0 or self.scheduler.pending:
+            return
+        if time.monotonic() - self.last_change < idle_time:
+            return
+        if not maintain.is_machine_idle():
+            return
+        self.maintainer.policy = get_retention_policy(settings)
+        durations = self.pool.submit(self.maintainer.run_due).result()
+        for task, duration in durations.items():
+            print(f"{self.dir_path}: {task} took {duration:.2f}s")
+
+    def _get_folder_settings(self, settings):
+        for folder in settings.folders:
+            if folder.path == self.dir_path:
+                return folder
+        return None
+
+
+def get_retention_policy(settings):
+    """
+    Returns the retention policy of the given settings.
+
+    Arguments:
+        settings (config.ConfigSnapshot): current settings
+
+    Returns (retain.RetentionPolicy): retention policy, or None if all versions are kept
+    """
+    if settings.retention is None:
+        return None
+    return retain.RetentionPolicy(*settings.retention)
+
+
+def create_watcher(configure, dir_path, interval, ignore=None, get_tracked=None):
+    """
+    Returns watcher for the given directory, polling for changes if watching is disabled.
 
     Arguments:
+        configure (config.ConfigManager): configuration of program
         dir_path (str): path of target directory
+        interval (int): seconds between checks for changes when polling
+        ignore (ignore.IgnoreMatcher): ignore rules of directory
+        get_tracked (callable): function returning the tracked paths which match the
+            ignore rules
+
+    Returns (watch.InotifyWatcher | watch.PollingWatcher): watcher for directory
     """
-    configure = config.ConfigManager()
-    dir_path = configure.get_target_path()
-    temp_path = configure.get_temp_path()
-    interval = configure.get_interval()
-
-    try:
-        manager = manage.FileManager(dir_path, temp_path)
-    except manage.InvalidDirectoryError:
-        return
-
-    while True:
-        time.sleep(interval)
-        interval = configure.get_interval()
-        active = configure.get_active()
-        if dir_path != configure.get_target_path():
-            dir_path = configure.get_target_path()
-            manager.set_target_directory(dir_path)
-            print(f"Change to {dir_path}")
-        if not active or not manager.has_changed():
-            print(f"No changes (Active: {active})")
-            continue
-        changes = manager.store_changes()
-        print(changes)
+    if configure.get_watch():
+        return watch.create_watcher(
+            dir_path, interval, ignore=ignore, get_tracked=get_tracked
+        )
+    return watch.PollingWatcher(interval)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+import collections
+import threading
+from dataclasses import dataclass
+
+import backend
+
+# Default number of pairs of blobs whose statistics are cached
+DEFAULT_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class DiffStats:
+    """
+    Immutable data class storing the number of lines added and removed between two
+    versions of a file.
+    """
+
+    added: int
+    removed: int
+    binary: bool = False
+
+    def __str__(self):
+        if self.binary:
+            return "binary"
+        return f"+{self.added}/-{self.removed}"
+
+
+class DiffService:
+    """
+    Computes unified diffs and change statistics between blobs of a repository. The
+    statistics of each pair of blobs are kept in a least recently used cache, so they
+    are only computed once however many versions share the same contents. Statistics
+    of many pairs of commits are computed by a single git command.
+    """
+
+    def __init__(self, repo, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Creates new diff service for the given repository.
+
+        Arguments:
+            repo (backend.GitBackend): backend of repository
+            cache_size (int): maximum number of cached pairs of blobs
+        """
+        self.repo = repo
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        # Statistics by hashes of old and new blobs, from least to most recently used
+        self.stats = collections.OrderedDict()
+        self.empty_blob = None
+
+    def get_empty_blob(self):
+        """
+        Returns the hash of the empty blob, which is compared with the first version of
+        a file, writing it to the object database if necessary.
+
+        Returns (str): hash of empty blob
+        """
+        if self.empty_blob is None:
+            output = self.repo.run(["hash-object", "-w", "-t", "blob", "--stdin"], b"")
+            self.empty_blob = output.decode("ascii").strip()
+        return self.empty_blob
+
+    def get_cached(self, old_blob, new_blob):
+        """
+        Returns the cached statistics of the given pair of blobs.
+
+        Arguments:
+            old_blob (str): hash of old blob
+            new_blob (str): hash of new blob
+
+        Returns (DiffStats): statistics of pair, or None if they are not cached
+        """
+        with self.lock:
+            stats = self.stats.get((old_blob, new_blob))
+            if stats is not None:
+                self.stats.move_to_end((old_blob, new_blob))
+            return stats
+
+    def add(self, old_blob, new_blob, stats):
+        with self.lock:
+            self.stats[(old_blob, new_blob)] = stats
+            self.stats.move_to_end((old_blob, new_blob))
+            while len(self.stats) > self.cache_size:
+                self.stats.popitem(last=False)
+
+    def get_stats(self, old_blob, new_blob, env=None):
+        """
+        Returns the number of lines added and removed between the given blobs.
+
+        Arguments:
+            old_blob (str): hash of old blob
+            new_blob (str): hash of new blob
+            env (dict(str, str)): environment variables of git commands (e.g. a
+                temporary object directory containing the blobs)
+
+        Returns (DiffStats): statistics of pair
+        """
+        stats = self.get_cached(old_blob, new_blob)
+        if stats is None:
+            output = self.repo.diff(
+                "--numstat", "--no-renames", old_blob, new_blob, _env=env
+            )
+            stats = parse_numstat(output.split("\t", 2))
+            self.add(old_blob, new_blob, stats)
+        return stats
+
+    def get_commit_stats(self, pairs, paths):
+        """
+        Returns the statistics of the given files between each pair of commits, using a
+        single 'git diff-tree --stdin' command for all uncached pairs.
+
+        Arguments:
+            pairs (list(tuple)): old commit, new commit, path of file in new commit and
+                hashes of old and new blobs of each pair
+            paths (list(str)): all paths of the file in the commits, so that renames are
+                detected
+
+        Returns (list(DiffStats)): statistics of each pair, or None where the file was
+            not changed between the commits
+        """
+        results = [self.get_cached(x[3], x[4]) for x in pairs]
+        pending = [x for x, y in zip(pairs, results) if y is None]
+        if pending:
+            commits = dict.fromkeys((x[0], x[1]) for x in pending)
+            commands = "".join(f"{new} {old}\n" for old, new in commits)
+            output = self.repo(
+                "diff-tree",
+                "--stdin",
+                "-r",
+                "-M",
+                "--numstat",
+                "-z",
+                "--",
+                *dict.fromkeys(paths),
+                _in=commands,
+                _env=backend.LITERAL_PATHSPECS,
+            )
+            found = parse_diff_tree(output)
+            for old_commit, new_commit, path, old_blob, new_blob in pending:
+                stats = found.get((new_commit, path))
+                if stats is not None:
+                    self.add(old_blob, new_blob, stats)
+            results = [self.get_cached(x[3], x[4]) for x in pairs]
+        return results
+
+    def iter_diff(self, old_blob, new_blob, context=3, paths=None, env=None):
+        """
+        Generates the lines of the unified diff between the given blobs as they are
+        produced by git, so that large diffs need not be held in memory. Once the diff
+        has been read completely, its statistics are added to the cache.
+
+        Arguments:
+            old_blob (str): hash of old blob
+            new_blob (str): hash of new blob
+            context (int): number of unchanged lines shown around each change
+            paths (tuple(str, str)): old and new paths of file shown in the header in
+                place of the hashes of the blobs
+            env (dict(str, str)): environment variables of git command (e.g. a
+                temporary object directory containing the blobs)
+
+        Returns (generator(str)): lines of diff, without line endings
+        """
+        args = ["diff", "--no-color", "--no-ext-diff", f"-U{context}"]
+        args += [old_blob, new_blob]
+        added = removed = 0
+        binary = False
+        in_header = True
+        for line in self.repo.stream(args, separator=b"\n", env=env):
+            if line.startswith("@@"):
+                in_header = False
+            elif in_header:
+                if paths is not None:
+                    # Blobs are named by their hashes in the header
+                    line = line.replace(f"a/{old_blob}", f"a/{paths[0]}", 1)
+                    line = line.replace(f"b/{new_blob}", f"b/{paths[1]}", 1)
+                binary = binary or line.startswith("Binary files ")
+            elif line.startswith("+"):
+                added += 1
+            elif line.startswith("-"):
+                removed += 1
+            yield line
+        self.add(old_blob, new_blob, DiffStats(added, removed, binary))
+
+
+def parse_numstat(fields):
+    """
+    Returns the statistics of a record of 'git diff --numstat', in which binary files
+    have '-' in place of the numbers of lines.
+
+    Arguments:
+        fields (list(str)): lines added and removed (and any following fields)
+
+    Returns (DiffStats): statistics of record
+    """
+    if len(fields) < 2 or fields[0] == "-":
+        return DiffStats(0, 0, binary=len(fields) >= 2)
+    return DiffStats(int(fields[0]), int(fields[1]))
+
+
+def parse_diff_tree(output):
+    """
+    Parses the output of 'git diff-tree --stdin -r -M --numstat -z', in which the hash
+    of each commit is followed by records of the form "<added>\t<removed>\t<path>\0"
+    (or "<added>\t<removed>\t\0<old path>\0<new path>\0" for renames).
+
+    Arguments:
+        output (str): output of diff-tree command
+
+    Returns (dict(tuple(str, str), DiffStats)): statistics by commit and new path
+    """
+    stats = {}
+    fields = output.split("\0")
+    commit = None
+    i = 0
+    while i < len(fields):
+        field = fields[i].lstrip("\n")
+        i += 1
+        if not field:
+            continue
+        if "\t" not in field:
+            commit = field.strip()
+            continue
+        added, removed, path = field.split("\t", 2)
+        if not path:
+            # Renamed, so old and new paths follow
+            path = fields[i + 1]
+            i += 2
+        stats[(commit, path)] = parse_numstat([added, removed])
+    return stats
@@ -44,10 +44,16 @@ class VersionWindow(QTabWidget):
         """
         super(VersionWindow, self).__init__()
 
-        configure = config.ConfigManager()
+        configure = config.get_config_manager()
         dir_path = configure.get_target_path()
         temp_path = configure.get_temp_path()
-        self.manager = manage.FileManager(dir_path, temp_path)
+        self.manager = manage.FileManager(
+            dir_path,
+            temp_path,
+            configure.get_batch_size(),
+            configure.get_preview_cache_size(),
+            configure.get_chunk_threshold(),
+        )
 
         self.init_window()
 
@@ -90,6 +96,14 @@ class VersionWindow(QTabWidget):
             return
         self.setCurrentIndex(self.tab_names.index(tab_name))
 
+    def cancel_tasks(self):
+        """
+        Cancels the tasks of all tabs using the manager (e.g. before its target
+        directory is changed).
+        """
+        for tab in (self.versions_tab, self.settings_tab):
+            tab.cancel_all_tasks()
+
 
 class AbstractTab(QWidget):
     """
@@ -107,14 +121,74 @@ class AbstractTab(QWidget):
         """
         super(QWidget, self).__init__(parent)
         self.manager = manager
+        self.pool = QThreadPool.globalInstance()
+        # Tasks running on the pool by name, of which only the most recent is reported
+        self.tasks = {}
 
-    def get_truncated_file_name(self):
-        file_name = os.path.splitext(os.path.basename(self.current_file))[0]
+    def get_truncated_file_name(self, file_path=None):
+        file_path = self.current_file if file_path is None else file_path
+        file_name = os.path.splitext(os.path.basename(file_path))[0]
         return (
             file_name[:30]
             + (file_name[30:] and "[...]")
-            + os.path.splitext(self.current_file)[1]
+            + os.path.splitext(file_path)[1]
+        )
+
+    def start_task(self, name, function, *args, succeeded=None, status=None):
+        """
+        Calls the given function on the worker pool, so that the window remains
+        responsive while git is running. A previous task with the same name is
+        cancelled, and its result is discarded.
+
+        Arguments:
+            name (str): name of task
+            function (function): function to be called
+            args: arguments of function
+            succeeded (function): called on the UI thread with the result of the
+                function if it succeeds
+            status (str): status shown while the task is running
+        """
+        self.cancel_task(name)
+        worker = Worker(function, *args)
+        worker.signals.succeeded.connect(
+            partial(self.task_finished, name, worker, succeeded)
+        )
+        worker.signals.failed.connect(
+            partial(self.task_finished, name, worker, self.task_failed)
         )
+        self.tasks[name] = worker
+        if status is not None:
+            self.status_label.setText(status)
+        self.pool.start(worker)
+
+    def cancel_task(self, name):
+        """
+        Cancels the task with the given name, if it is running.
+
+        Arguments:
+            name (str): name of task
+        """
+        previous = self.tasks.pop(name, None)
+        if previous is not None:
+            previous.cancel()
+            # Removed from the queue if it has not started
+            self.pool.tryTake(previous)
+
+    def cancel_all_tasks(self):
+        for name in list(self.tasks):
+            self.cancel_task(name)
+
+    def task_finished(self, name, worker, callback, value):
+        if self.tasks.get(name) is not worker:
+            # Task has been replaced by a more recent one
+            return
+        del self.tasks[name]
+        if callback is not None:
+            callback(value)
+
+    def task_failed(self, message):
+        self.show_error_dialog(message)
+        self.status_label.setText("")
 
     def show_error_dialog(self, message):
         """
@@ -172,7 +246,6 @@ class VersionsTab(AbstractTab):
         """
         super().__init__(parent, manager)
         self.current_file = ""
-        self.version_rows = []
         self.version_data = []
         self.init_layout()
 
@@ -180,33 +253,124 @@ class VersionsTab(AbstractTab):
         """
         Updates the contents of the file version list with the versions of the currently
         selected file.
+
+        Arguments:
+            refresh (bool): True if the versions are retrieved again before they are
+                shown
         """
         if not self.current_file:
             return
-        self.clear_version_list()
-
         if refresh:
-            data = self.get_version_data(self.current_file)
-            if not data:
-                return
-            self.version_data = data
+            self.load_versions(self.current_file, refresh=True)
+        else:
+            self.show_versions(f"Loaded '{self.get_truncated_file_name()}'")
+
+    def load_versions(self, file_path, refresh=False, restored=None):
+        """
+        Retrieves the most recent versions of the given file on the worker pool, then
+        shows them. Any retrieval of versions which is still in progress is cancelled.
+
+        Arguments:
+            file_path (str): path of file
+            refresh (bool): True if the versions of the current file are being refreshed
+            restored (int): number of version which has just been restored, if any
+        """
+        file_name = self.get_truncated_file_name(file_path)
+        self.cancel_task("older versions")
+        for name in [x for x in self.tasks if x.startswith("summaries")]:
+            self.cancel_task(name)
+        self.start_task(
+            "versions",
+            self.manager.get_file_versions,
+            file_path,
+            VersionListModel.PAGE_SIZE,
+            succeeded=partial(self.versions_loaded, file_path, refresh, restored),
+            status=f"Loading '{file_name}'...",
+        )
+
+    def load_older_versions(self, before):
+        """
+        Retrieves the next page of versions of the current file on the worker pool, then
+        adds them to the end of the list.
+
+        Arguments:
+            before (int): number of the oldest version in the list
+        """
+        self.start_task(
+            "older versions",
+            self.manager.get_file_versions,
+            self.current_file,
+            VersionListModel.PAGE_SIZE,
+            0,
+            before,
+            succeeded=partial(self.older_versions_loaded, self.current_file),
+        )
+
+    def older_versions_loaded(self, file_path, data):
+        if file_path == self.current_file:
+            self.version_model.add_versions(data)
+            self.load_summaries(file_path, data)
+
+    def load_summaries(self, file_path, versions):
+        """
+        Retrieves the numbers of lines added and removed by the given versions on the
+        worker pool, then shows them in the version list.
+
+        Arguments:
+            file_path (str): path of file
+            versions (list(manage.VersionData)): page of versions of file
+        """
+        if not versions:
+            return
+        self.start_task(
+            f"summaries {versions[0].number}",
+            self.manager.get_version_summaries,
+            file_path,
+            versions,
+            succeeded=partial(self.summaries_loaded, file_path, versions),
+        )
 
-        self.add_version_rows()
+    def summaries_loaded(self, file_path, versions, stats):
+        if file_path == self.current_file:
+            self.version_model.set_stats({x.number: y for x, y in zip(versions, stats)})
 
+    def versions_loaded(self, file_path, refresh, restored, data):
+        if not data:
+            self.status_label.setText("")
+            return
+        self.version_data = data
+        self.current_file = file_path
+        self.file_text.setText(file_path)
         file_name = self.get_truncated_file_name()
-        if refresh:
-            self.status_label.setText(f"Refreshed '{file_name}'")
+        if restored is not None:
+            self.show_versions(
+                f"Restored version {restored} of '{file_name}' "
+                f"(now version {data[0].number})"
+            )
+        elif refresh:
+            self.show_versions(f"Refreshed '{file_name}'")
         else:
-            self.status_label.setText(f"Loaded '{file_name}'")
+            self.show_versions(f"Loaded '{file_name}'")
+        self.load_summaries(file_path, data)
+
+    def show_versions(self, status):
+        self.version_model.set_versions(self.version_data)
+        self.no_files_label.hide()
+        self.version_view.show()
+        self.status_label.setText(status)
 
     def view_version(self, version_num):
-        try:
-            self.manager.open_file_version(self.current_file, version_num)
-            file_name = self.get_truncated_file_name()
-            self.status_label.setText(f"Opened version {version_num} of '{file_name}'")
-        except manage.VersionError as e:
-            self.show_error_dialog(e.message)
-            self.status_label.setText("")
+        file_name = self.get_truncated_file_name()
+        self.start_task(
+            "view",
+            self.manager.open_file_version,
+            self.current_file,
+            version_num,
+            succeeded=lambda _: self.status_label.setText(
+                f"Opened version {version_num} of '{file_name}'"
+            ),
+            status=f"Opening version {version_num} of '{file_name}'...",
+        )
 
     def restore_version(self, version_num):
         file_name = self.get_truncated_file_name()
@@ -215,93 +379,45 @@ class VersionsTab(AbstractTab):
         if not confirmed:
             return
 
-        try:
-            self.manager.restore_file_version(self.current_file, version_num)
-            self.update_version_list(refresh=True)
-            file_name = self.get_truncated_file_name()
+        self.start_task(
+            "restore",
+            self.manager.restore_file_version,
+            self.current_file,
+            version_num,
+            succeeded=partial(self.version_restored, self.current_file, version_num),
+            status=f"Restoring version {version_num} of '{file_name}'...",
+        )
+
+    def version_restored(self, file_path, version_num, _):
+        if file_path == self.current_file and "versions" not in self.tasks:
+            self.load_versions(file_path, restored=version_num)
+        else:
+            # Another file has been selected since the version was restored
+            file_name = self.get_truncated_file_name(file_path)
             self.status_label.setText(
-                f"Restored version {version_num} of '{file_name}' (now version {len(self.version_data)})"
+                f"Restored version {version_num} of '{file_name}'"
             )
-        except manage.VersionError as e:
-            self.show_error_dialog(e.message)
-            self.status_label.setText("")
 
     def set_status(self, message):
         self.status_label.setText(message)
 
-    def add_version_rows(self):
-        # Maximum length of version number, used for padding
-        max_ver_length = len(str(len(self.version_data)))
-        for i, x in enumerate(self.version_data):
-            version_num = len(self.version_data) - i
-            version_str = str(version_num).ljust(max_ver_length)
-            row = QHBoxLayout()
-            label = QLabel(
-                f"Version {version_str} ({str(x.timestamp.strftime('%x %X'))})"
-            )
-
-            view_button = QPushButton("View")
-            restore_button = QPushButton("Restore")
-
-            view_button.clicked.connect(partial(self.view_version, version_num))
-            restore_button.clicked.connect(partial(self.restore_version, version_num))
-            row.addWidget(label)
-            row.addWidget(view_button)
-            row.addWidget(restore_button)
-
-            self.version_rows.append(row)
-            self.version_layout.insertLayout(
-                self.version_layout.count() - 1, self.version_rows[-1]
-            )
-
-    def clear_version_list(self):
-        """
-        Clears the contents of the file version list.
-        """
-        for x in self.version_rows:
-            self.remove_layout_contents(x)
-            self.version_layout.removeItem(x)
-            x.deleteLater()
-            del (x)
-        self.version_rows.clear()
-
     def select_file(self):
         """
-        Sets the current file to the one selected by the user using a file dialog.
+        Sets the current file to the one selected by the user using a file dialog, once
+        its versions have been retrieved.
         """
         file_name = QFileDialog.getOpenFileName(
             self, "Select File", self.manager.dir_path, "All Files (*.*)"
         )[0]
         if not file_name:
             return
-        data = self.get_version_data(file_name)
-        if not data:
-            return
-        self.version_data = data
-        self.file_text.setText(file_name)
-        self.current_file = file_name
-
-    def get_version_data(self, file_name):
-        try:
-            data = self.manager.get_file_versions(file_name)
-            return data
-        except manage.VersionError as e:
-            self.show_error_dialog(e.message)
-            self.status_label.setText("")
-            return None
+        self.load_versions(file_name)
 
     def change_file(self):
         """
         Change the file being displayed to the one selected by the user using a file.
         """
         self.select_file()
-        self.update_version_list(False)
-
-    def add_no_files_row(self):
-        no_files_row = QHBoxLayout()
-        no_files_row.addWidget(QLabel("No file selected"))
-        self.version_rows.append(no_files_row)
-        self.version_layout.insertLayout(0, self.version_rows[0])
 
     def init_layout(self):
         """
@@ -322,23 +438,30 @@ class VersionsTab(AbstractTab):
         refresh_button.clicked.connect(partial(self.update_version_list, True))
         refresh_button.setFixedWidth(60)
 
-        version_container = QWidget()
-        self.version_layout = QVBoxLayout()
-        self.version_layout.addStretch()
-        self.version_layout.setAlignment(Qt.AlignTop)
-        self.add_no_files_row()
-        version_container.setLayout(self.version_layout)
-
-        scroll_area = QScrollArea()
-        scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        scroll_area.setWidgetResizable(True)
-        scroll_area.setWidget(version_container)
-        scroll_area.setVerticalScrollBar(QScrollBar())
+        # Only the visible rows of the version list are painted, and rows are added to
+        # the model as the list is scrolled
+        self.version_model = VersionListModel(self)
+        self.version_model.more_requested.connect(self.load_older_versions)
+        self.version_view = QListView()
+        self.version_view.setModel(self.version_model)
+        self.version_view.setUniformItemSizes(True)
+        self.version_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.version_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.version_view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.version_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        delegate = VersionDelegate(self.version_view)
+        delegate.view_clicked.connect(self.view_version)
+        delegate.restore_clicked.connect(self.restore_version)
+        self.version_view.setItemDelegate(delegate)
+        self.version_view.hide()
+
+        self.no_files_label = QLabel("No file selected")
+        self.no_files_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
 
         grid.addWidget(self.file_text, 0, 0)
         grid.addWidget(file_button, 0, 2)
-        grid.addWidget(scroll_area, 1, 0, 1, 3)
+        grid.addWidget(self.no_files_label, 1, 0, 1, 3)
+        grid.addWidget(self.version_view, 1, 0, 1, 3)
 
         bottom_row = QHBoxLayout()
         bottom_row.addWidget(refresh_button)
@@ -348,6 +471,195 @@ class VersionsTab(AbstractTab):
         self.setLayout(grid)
 
 
+class VersionListModel(QAbstractListModel):
+    """
+    Model of the versions of a file, from most to least recent. Versions are retrieved
+    a page at a time: the most recent page is shown first, and each older page is
+    requested (by emitting more_requested) when the view is scrolled to the end of the
+    list. The time taken to display the list therefore does not depend on the length
+    of the history.
+    """
+
+    # Number of versions retrieved at a time
+    PAGE_SIZE = 100
+    # Role of the number of the version in each row
+    VersionRole = Qt.UserRole
+
+    # Emitted with the number of the oldest version in the model when the versions
+    # before it are needed
+    more_requested = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.versions = []
+        self.complete = True
+        self.fetching = False
+        # Lines added and removed by each version, by number of version
+        self.stats = {}
+
+    def set_versions(self, versions):
+        """
+        Replaces the versions in the model with the most recent page of versions.
+
+        Arguments:
+            versions (list(manage.VersionData)): versions, from most to least recent
+        """
+        self.beginResetModel()
+        self.versions = list(versions)
+        self.stats = {}
+        self.complete = self.is_last_page(versions)
+        self.fetching = False
+        self.endResetModel()
+
+    def add_versions(self, versions):
+        """
+        Adds the next page of versions to the end of the model.
+
+        Arguments:
+            versions (list(manage.VersionData)): versions, from most to least recent
+        """
+        self.fetching = False
+        self.complete = self.is_last_page(versions)
+        if not versions:
+            return
+        start = len(self.versions)
+        self.beginInsertRows(QModelIndex(), start, start + len(versions) - 1)
+        self.versions.extend(versions)
+        self.endInsertRows()
+
+    def set_stats(self, stats):
+        """
+        Adds the numbers of lines added and removed by versions in the model.
+
+        Arguments:
+            stats (dict(int, diff.DiffStats)): statistics by number of version
+        """
+        self.stats.update(stats)
+        if self.versions:
+            self.dataChanged.emit(
+                self.index(0), self.index(len(self.versions) - 1), [Qt.DisplayRole]
+            )
+
+    def is_last_page(self, versions):
+        return len(versions) < self.PAGE_SIZE or versions[-1].number <= 1
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.versions)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.complete and not self.fetching
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        self.fetching = True
+        self.more_requested.emit(self.versions[-1].number)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.versions):
+            return None
+        version = self.versions[index.row()]
+        if role == Qt.DisplayRole:
+            # Version numbers are padded to the length of the largest number
+            width = len(str(self.versions[0].number))
+            version_str = str(version.number).ljust(width)
+            text = f"Version {version_str} ({version.timestamp.strftime('%x %X')})"
+            stats = self.stats.get(version.number)
+            return text if stats is None else f"{text}  {stats}"
+        if role == Qt.ToolTipRole:
+            return version.message
+        if role == self.VersionRole:
+            return version.number
+        return None
+
+
+class VersionDelegate(QStyledItemDelegate):
+    """
+    Delegate painting each row of the version list with 'View' and 'Restore' buttons.
+    The buttons are drawn rather than created as widgets, and a click on either emits
+    the number of the version in the row.
+    """
+
+    view_clicked = pyqtSignal(int)
+    restore_clicked = pyqtSignal(int)
+
+    BUTTONS = ("View", "Restore")
+    BUTTON_WIDTH = 75
+    BUTTON_SPACING = 5
+    ROW_HEIGHT = 30
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Row and button which the mouse was pressed on
+        self.pressed = None
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        return QSize(size.width(), max(size.height(), self.ROW_HEIGHT))
+
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget else QApplication.style()
+        buttons = self.get_button_rects(option.rect)
+
+        text_option = QStyleOptionViewItem(option)
+        self.initStyleOption(text_option, index)
+        text_option.rect = QRect(option.rect)
+        text_option.rect.setRight(buttons[0].left() - self.BUTTON_SPACING)
+        style.drawControl(QStyle.CE_ItemViewItem, text_option, painter, option.widget)
+
+        for i, (text, rect) in enumerate(zip(self.BUTTONS, buttons)):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.State_Enabled
+            if self.pressed == (index.row(), i):
+                button.state |= QStyle.State_Sunken
+            else:
+                button.state |= QStyle.State_Raised
+            style.drawControl(QStyle.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() not in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease):
+            return super().editorEvent(event, model, option, index)
+        if event.button() != Qt.LeftButton:
+            return False
+        clicked = None
+        for i, rect in enumerate(self.get_button_rects(option.rect)):
+            if rect.contains(event.pos()):
+                clicked = (index.row(), i)
+        if event.type() == QEvent.MouseButtonPress:
+            self.pressed = clicked
+            self.parent().viewport().update(option.rect)
+            return clicked is not None
+        pressed, self.pressed = self.pressed, None
+        self.parent().viewport().update(option.rect)
+        # Buttons are clicked only if the mouse is pressed and released on them
+        if clicked is None or clicked != pressed:
+            return False
+        version_num = index.data(VersionListModel.VersionRole)
+        if clicked[1] == 0:
+            self.view_clicked.emit(version_num)
+        else:
+            self.restore_clicked.emit(version_num)
+        return True
+
+    def get_button_rects(self, rect):
+        """
+        Returns the areas of the buttons of a row, from left to right.
+
+        Arguments:
+            rect (QRect): area of row
+
+        Returns (list(QRect)): area of each button
+        """
+        rects = []
+        left = rect.right() - len(self.BUTTONS) * (self.BUTTON_WIDTH + self.BUTTON_SPACING)
+        for i in range(len(self.BUTTONS)):
+            x = left + i * (self.BUTTON_WIDTH + self.BUTTON_SPACING)
+            rects.append(QRect(x, rect.top() + 2, self.BUTTON_WIDTH, rect.height() - 4))
+        return rects
+
+
 class SettingsTab(AbstractTab):
     """
     Tab containing settings interface.
@@ -368,9 +680,15 @@ class SettingsTab(AbstractTab):
             manager (manage.FileManager): file management interface
         """
         super().__init__(parent, manager)
-        self.configure = config.ConfigManager()
+        self.configure = config.get_config_manager()
         self.ignore_keywords = []
         self.init_layout()
+        self.configure.subscribe(self.settings_changed)
+        # Configuration file is checked regularly so that changes made by other
+        # processes are shown (it is only reloaded if it has been modified)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.configure.refresh)
+        self.refresh_timer.start(1000)
 
     def init_layout(self):
         settings_layout = QVBoxLayout()
@@ -439,6 +757,7 @@ class SettingsTab(AbstractTab):
         ignore_add_layout.addWidget(self.ignore_entry)
         ignore_add_layout.addWidget(ignore_button)
         self.ignore_rows = []
+        self.status_label = QLabel()
 
         self.update_ignored_list()
 
@@ -453,6 +772,7 @@ class SettingsTab(AbstractTab):
         settings_layout.addWidget(ignore_label)
         settings_layout.addWidget(scroll_area)
         settings_layout.addLayout(ignore_add_layout)
+        settings_layout.addWidget(self.status_label)
 
         self.setLayout(settings_layout)
 
@@ -490,9 +810,47 @@ class SettingsTab(AbstractTab):
                 if not confirm:
                     continue
 
+        # Manager is changed to the new directory once the setting has been stored
         self.configure.set_target_path(target_dir)
-        self.manager.set_target_directory(target_dir)
-        self.dir_label.setText(target_dir)
+
+    def settings_changed(self, previous, current):
+        """
+        Updates the displayed settings to match the given configuration snapshot.
+
+        Arguments:
+            previous (config.ConfigSnapshot): settings before change
+            current (config.ConfigSnapshot): settings after change
+        """
+        for widget in (self.active_checkbox, self.interval_select):
+            widget.blockSignals(True)
+        self.active_checkbox.setCheckState(self.checked_states[current.active])
+        self.interval_select.setValue(current.interval)
+        for widget in (self.active_checkbox, self.interval_select):
+            widget.blockSignals(False)
+        if current.target_path != previous.target_path:
+            self.change_manager_directory(current.target_path)
+
+    def change_manager_directory(self, dir_path):
+        """
+        Changes the target directory of the manager on the worker pool, as it runs
+        several git commands. The tasks of all tabs are cancelled first, so that their
+        results (for the previous directory) are discarded.
+
+        Arguments:
+            dir_path (str): path of new target directory
+        """
+        self.window().cancel_tasks()
+        self.start_task(
+            "target",
+            self.manager.set_target_directory,
+            dir_path,
+            succeeded=partial(self.manager_directory_changed, dir_path),
+            status="Changing folder...",
+        )
+
+    def manager_directory_changed(self, dir_path, _):
+        self.dir_label.setText(dir_path)
+        self.status_label.setText("")
 
     def toggle_active(self):
         """
@@ -524,19 +882,27 @@ class SettingsTab(AbstractTab):
 
     def new_ignored(self):
         """
-        Add new ignore keyword entered by user.
+        Add new ignore keywords entered by user. Several extensions may be entered at
+        once (separated by spaces or commas), and are added in a single update.
         """
-        keyword = self.parse_ignore_text()
-        if not keyword or keyword in self.manager.get_all_ignored():
-            return
-        try:
-            self.manager.add_ignored(keyword)
-        except manage.IgnoreError as e:
-            self.show_error_dialog(e.message)
+        ignored = self.manager.get_all_ignored()
+        keywords = [x for x in self.parse_ignore_text() if x not in ignored]
+        if not keywords:
             return
-        self.update_ignored_list()
+        description = ", ".join(keywords)
+        self.start_task(
+            f"ignore {description}",
+            self.manager.update_ignored,
+            keywords,
+            succeeded=partial(self.ignored_changed, f"Ignoring {description}"),
+            status=f"Adding {description}...",
+        )
         self.ignore_entry.setText("")
 
+    def ignored_changed(self, status, _):
+        self.update_ignored_list()
+        self.status_label.setText(status)
+
     def add_ignored_row(self, keyword):
         """
         Add an ignore row containing the given ignore keyword. The keyword will be added
@@ -560,16 +926,13 @@ class SettingsTab(AbstractTab):
         self.ignore_rows.append(row)
 
     def parse_ignore_text(self):
-        text = self.ignore_entry.text().strip()
-        if not text:
-            return ""
-        file_ext = ""
-        # Add initial '*.' and eliminate duplicate precending '.'s
-        for i in range(0, len(text)):
-            if text[i] != ".":
-                file_ext = "*." + text[i:]
-                break
-        return file_ext
+        keywords = []
+        for text in self.ignore_entry.text().replace(",", " ").split():
+            # Add initial '*.' and eliminate duplicate precending '.'s
+            text = text.lstrip(".")
+            if text and "*." + text not in keywords:
+                keywords.append("*." + text)
+        return keywords
 
     def remove_ignored_row(self, keyword):
         """
@@ -578,12 +941,14 @@ class SettingsTab(AbstractTab):
         Arguments:
             keyword (str): keyword of row to be removed
         """
-        try:
-            self.manager.remove_ignored(keyword)
-        except manage.IgnoreError as e:
-            self.show_error_dialog(e.message)
-            return
-        self.update_ignored_list()
+        self.start_task(
+            f"ignore {keyword}",
+            self.manager.update_ignored,
+            (),
+            [keyword],
+            succeeded=partial(self.ignored_changed, f"No longer ignoring {keyword}"),
+            status=f"Removing {keyword}...",
+        )
 
 
 class AboutTab(AbstractTab):
@@ -641,6 +1006,50 @@ class AboutTab(AbstractTab):
         self.setLayout(about_layout)
 
 
+class WorkerSignals(QObject):
+    """
+    Signals of a worker. As they belong to the UI thread, connected slots are called
+    on the UI thread.
+    """
+
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class Worker(QRunnable):
+    """
+    Task calling a function on a thread pool and emitting its result, or the message of
+    the error it raised. Nothing is emitted once the worker has been cancelled, although
+    a function which has started is not interrupted.
+    """
+
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        # Owned by the tab rather than deleted by the pool once run, so that a cancelled
+        # worker can be removed from the queue whether or not it has finished
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            # Errors of the backend and manager have a message for the user
+            if not self.cancelled:
+                self.signals.failed.emit(getattr(e, "message", str(e)))
+            return
+        if not self.cancelled:
+            self.signals.succeeded.emit(result)
+
+
 class SystemTrayIcon(QSystemTrayIcon):
     def __init__(self, parent):
         self.parent = parent
@@ -0,0 +1,393 @@
+import os
+import re
+
+# Maximum number of directories whose result is remembered by IgnoreRules
+MAX_CACHED_DIRS = 100000
+
+
+class IgnoreMatcher:
+    """
+    Matcher for the ignore rules of a directory (its .gitignore files and the exclude
+    file of its repository). The rules are compiled when first used and whenever the
+    .gitignore file of the directory or the exclude file changes, so that paths can be
+    checked without reading the files or running git.
+
+    The .gitignore files of subdirectories are read when paths inside them are first
+    checked, and are read again once the matcher is invalidated (e.g. when a watcher
+    reports that one has changed).
+    """
+
+    def __init__(self, dir_path, git_dir=None):
+        """
+        Creates new matcher for the given directory.
+
+        Arguments:
+            dir_path (str): path of directory
+            git_dir (str): path of git directory of repository, if its exclude file is
+                to be read
+        """
+        self.dir_path = dir_path
+        self.ignore_path = os.path.join(dir_path, ".gitignore")
+        self.rule_paths = [self.ignore_path]
+        if git_dir is not None:
+            self.rule_paths.insert(0, os.path.join(git_dir, "info", "exclude"))
+        self.rules = None
+        self.patterns = None
+        self.signature = None
+
+    def get_rules(self):
+        """
+        Returns the compiled rules, compiling them again if a rule file has changed.
+
+        Returns (IgnoreRules): current rules
+        """
+        self._load()
+        return self.rules
+
+    def get_patterns(self):
+        """
+        Returns the patterns of the .gitignore file of the directory.
+
+        Returns (list(str)): patterns in the order they appear in the file
+        """
+        self._load()
+        return list(self.patterns)
+
+    def invalidate(self):
+        """
+        Causes the rules to be compiled again when next used, e.g. after the rule file
+        has been rewritten within the resolution of its modification time, or after a
+        .gitignore file of a subdirectory has changed.
+        """
+        self.rules = None
+
+    def is_ignored(self, path, is_dir=False):
+        return self.get_rules().is_ignored(path, is_dir)
+
+    def filter(self, paths):
+        """
+        Returns the given paths which are not ignored.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the directory, with '/' separators
+
+        Returns (list(str)): paths which are not ignored
+        """
+        rules = self.get_rules()
+        return [x for x in paths if not rules.is_ignored(x)]
+
+    def _load(self):
+        signature = tuple(_get_file_signature(x) for x in self.rule_paths)
+        if self.rules is not None and signature == self.signature:
+            return
+        # The .gitignore file is last, so that its patterns take precedence
+        lines = [read_patterns(x) for x in self.rule_paths]
+        self.patterns = lines[-1]
+        self.rules = IgnoreRules([x for y in lines for x in y], self.dir_path)
+        self.signature = signature
+
+
+class IgnoreRules:
+    """
+    Compiled form of a list of gitignore patterns. Patterns which only match file
+    extensions or literal names are held in sets, and the remaining patterns are
+    combined into a single regular expression. If any pattern is negated, the patterns
+    are instead tested individually from last to first, as the last matching pattern
+    determines whether a path is ignored.
+
+    If the directory is given, the .gitignore files of its subdirectories are compiled
+    as they are reached, and their patterns take precedence over those of the files of
+    the directories containing them (as in git).
+    """
+
+    def __init__(self, patterns, dir_path=None):
+        """
+        Compiles the given patterns.
+
+        Arguments:
+            patterns (list(str)): patterns in the order they appear in rule files
+            dir_path (str): path of directory, if the .gitignore files of its
+                subdirectories are to be read
+        """
+        self.dir_path = dir_path
+        # Rules of the .gitignore files of subdirectories (None where there is none)
+        self.nested = {}
+        self.rules = [x for x in map(compile_pattern, patterns) if x is not None]
+        self.ordered = any(x.negated for x in self.rules)
+        # Extensions, names, paths and expressions matching any path, and those only
+        # matching directories
+        self.suffixes = ([], [])
+        self.names = (set(), set())
+        self.paths = (set(), set())
+        expressions = ([], [])
+        for rule in self.rules:
+            kind = 1 if rule.dir_only else 0
+            if rule.suffix is not None:
+                self.suffixes[kind].append(rule.suffix)
+            elif rule.literal is not None and rule.anchored:
+                self.paths[kind].add(rule.literal)
+            elif rule.literal is not None:
+                self.names[kind].add(rule.literal)
+            else:
+                expressions[kind].append(rule.expression)
+        self.suffixes = tuple(tuple(x) for x in self.suffixes)
+        self.expressions = tuple(
+            re.compile("|".join(f"(?:{x})" for x in y), re.DOTALL) if y else None
+            for y in expressions
+        )
+        self.dirs = {}
+
+    def is_ignored(self, path, is_dir=False):
+        """
+        Returns true if the given path is ignored, either by a pattern matching it or
+        because a directory containing it is ignored.
+
+        Arguments:
+            path (str): path relative to the directory, with '/' separators
+            is_dir (bool): true if path is a directory
+
+        Returns (bool): true if path is ignored
+        """
+        if not self.rules and self.dir_path is None:
+            return False
+        parent, _, _ = path.rpartition("/")
+        if parent and self._is_dir_ignored(parent):
+            return True
+        if is_dir:
+            return self._is_dir_ignored(path)
+        return bool(self._match_all(path, False))
+
+    def _is_dir_ignored(self, path):
+        ignored = self.dirs.get(path)
+        if ignored is None:
+            parent, _, _ = path.rpartition("/")
+            ignored = bool(parent and self._is_dir_ignored(parent)) or bool(
+                self._match_all(path, True)
+            )
+            if len(self.dirs) >= MAX_CACHED_DIRS:
+                self.dirs.clear()
+            self.dirs[path] = ignored
+        return ignored
+
+    def _match_all(self, path, is_dir):
+        """
+        Returns whether the given path is ignored by the patterns of the .gitignore
+        files of the directories containing it, from the deepest, followed by the
+        patterns of the directory.
+
+        Arguments:
+            path (str): path relative to the directory, with '/' separators
+            is_dir (bool): true if path is a directory
+
+        Returns (bool): true if path is ignored, false if it is not ignored, or None if
+            no pattern matches it
+        """
+        directory = path
+        while True:
+            directory = directory.rpartition("/")[0]
+            if not directory:
+                return self._matches(path, is_dir)
+            rules = self._get_nested(directory)
+            if rules is not None:
+                matched = rules._matches(path[len(directory) + 1 :], is_dir)
+                if matched is not None:
+                    return matched
+
+    def _get_nested(self, directory):
+        """
+        Returns the rules of the .gitignore file of the given subdirectory, reading the
+        file when first needed.
+
+        Arguments:
+            directory (str): path of subdirectory, with '/' separators
+
+        Returns (IgnoreRules): rules of subdirectory, or None if it has no patterns
+        """
+        if self.dir_path is None:
+            return None
+        if directory not in self.nested:
+            path = os.path.join(self.dir_path, *directory.split("/"), ".gitignore")
+            patterns = read_patterns(path)
+            if len(self.nested) >= MAX_CACHED_DIRS:
+                self.nested.clear()
+            self.nested[directory] = IgnoreRules(patterns) if patterns else None
+        return self.nested[directory]
+
+    def _matches(self, path, is_dir):
+        """
+        Returns whether the given path is matched by the patterns, without considering
+        the directories containing it.
+
+        Arguments:
+            path (str): path relative to the directory, with '/' separators
+            is_dir (bool): true if path is a directory
+
+        Returns (bool): true if path is ignored, false if it is excluded by a negated
+            pattern, or None if no pattern matches it
+        """
+        if self.ordered:
+            for rule in reversed(self.rules):
+                if rule.dir_only and not is_dir:
+                    continue
+                if rule.matches(path):
+                    return not rule.negated
+            return None
+        name = path.rpartition("/")[2]
+        for kind in (0, 1) if is_dir else (0,):
+            if name in self.names[kind] or path in self.paths[kind]:
+                return True
+            if self.suffixes[kind] and name.endswith(self.suffixes[kind]):
+                return True
+            expression = self.expressions[kind]
+            if expression is not None and expression.fullmatch(path):
+                return True
+        return None
+
+
+class IgnoreRule:
+    """
+    Single compiled gitignore pattern.
+    """
+
+    def __init__(self, expression, negated, dir_only, anchored, literal, suffix):
+        """
+        Arguments:
+            expression (str): regular expression matching the whole of a relative path
+            negated (bool): true if matching paths are not ignored ('!' patterns)
+            dir_only (bool): true if only directories are matched (trailing '/')
+            anchored (bool): true if the pattern is relative to the directory, rather
+                than matching a name at any depth
+            literal (str): path or name matched, if the pattern has no wildcards
+            suffix (str): suffix of names matched, if the pattern has the form '*.ext'
+        """
+        self.expression = expression
+        self.pattern = re.compile(expression, re.DOTALL)
+        self.negated = negated
+        self.dir_only = dir_only
+        self.anchored = anchored
+        self.literal = literal
+        self.suffix = suffix
+
+    def matches(self, path):
+        return self.pattern.fullmatch(path) is not None
+
+
+def compile_pattern(line):
+    """
+    Compiles a line of a gitignore file (see gitignore(5)).
+
+    Arguments:
+        line (str): line of file
+
+    Returns (IgnoreRule): compiled pattern, or None if the line is blank or a comment
+    """
+    line = line.rstrip("\r\n")
+    # Trailing spaces are removed unless escaped
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    line = stripped
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    anchored = "/" in line
+    line = line.lstrip("/")
+    expression = _translate(line)
+    literal = None
+    suffix = None
+    if not re.search(r"[*?\[\\]", line):
+        literal = line
+    elif (
+        not anchored
+        and line.startswith("*")
+        and not re.search(r"[*?\[\\]", line[1:])
+    ):
+        suffix = line[1:]
+    if not anchored:
+        expression = "(?:.*/)?" + expression
+    return IgnoreRule(expression, negated, dir_only, anchored, literal, suffix)
+
+
+def _translate(pattern):
+    """
+    Returns a regular expression matching the same paths as the given glob, where '*'
+    and '?' do not match '/', and '**' matches any number of directories when it forms a
+    whole component.
+
+    Arguments:
+        pattern (str): glob relative to the directory
+
+    Returns (str): regular expression
+    """
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            whole = (i == 0 or pattern[i - 1] == "/") and pattern.startswith("**", i)
+            if whole and i + 2 == n:
+                parts.append(".*")
+                i += 2
+                continue
+            if whole and pattern.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            # A ']' immediately after '[' or '[!' is part of the class
+            end = i + 1
+            if pattern.startswith("!", end):
+                end += 1
+            if pattern.startswith("]", end):
+                end += 1
+            end = pattern.find("]", end)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : end].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append(f"[{body}]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+def read_patterns(path):
+    """
+    Returns the patterns of a rule file, eliminating blank lines.
+
+    Arguments:
+        path (str): path of rule file
+
+    Returns (list(str)): patterns in file, or an empty list if it does not exist
+    """
+    try:
+        with open(path, "r") as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return []
+    return [x.strip() for x in lines if x.strip()]
+
+
+def _get_file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
@@ -0,0 +1,405 @@
+import os
+import re
+import sqlite3
+import threading
+
+import backend
+
+SCHEMA_VERSION = "3"
+
+# Status of an entry of 'git log --name-status' (e.g. "M" or "R100")
+STATUS_PATTERN = re.compile(r"^[ACDMRTUXB]\d*$")
+
+LOG_FORMAT = "--format=%H%x00%ct%x00%s%x00%b"
+
+# Line of a commit message describing the change to a file (see
+# FileManager._get_change_message), e.g. "Modify x" or "Rename and modify x to y"
+_ACTION = r"(?:modify|add|delete|rename|copy|change type of|update)"
+CHANGE_PATTERN = re.compile(
+    rf"({_ACTION}(?: and {_ACTION})*) (.+)", re.IGNORECASE | re.DOTALL
+)
+
+# Number of versions retrieved by each query of iter_versions
+PAGE_SIZE = 500
+
+# Seconds for which a connection waits for another process (e.g. the GUI and the
+# tracking daemon) to finish writing to the index
+BUSY_TIMEOUT = 60
+
+
+class VersionIndex:
+    """
+    Persistent index mapping the path of each file in a repository to its ordered
+    versions, enabling file histories to be retrieved without walking the history of
+    the whole repository. The index is stored in an SQLite database inside the git
+    directory and is brought up to date with any new commits before each lookup.
+    """
+
+    def __init__(self, repo, dir_path):
+        """
+        Creates new index for the given repository. The database is created (or rebuilt
+        from the repository history) when first used.
+
+        Arguments:
+            repo (backend.GitBackend): backend of repository
+            dir_path (str): path of repository
+        """
+        self.repo = repo
+        self.dir_path = dir_path
+        self.connection = None
+        self.lock = threading.RLock()
+
+    def sync(self):
+        """
+        Adds all commits made since the index was last updated. The index is rebuilt if
+        it is missing or no longer consistent with the history of the repository (e.g.
+        if the history has been rewritten).
+
+        Other processes may update the same index, so the index is locked for writing
+        before the indexed commit is read and the new commits are numbered.
+        """
+        with self.lock:
+            connection = self._connect()
+            if self._get_head() == self._get_meta("head"):
+                return
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                head = self._get_head()
+                indexed = self._get_meta("head")
+                if head != indexed:
+                    self._update(head, indexed)
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+    def _update(self, head, indexed):
+        """
+        Adds the commits between the indexed commit and the given commit, rebuilding
+        the index if the indexed commit is not an ancestor of the given commit.
+
+        Arguments:
+            head (str): hash of current commit, or an empty string if there are none
+            indexed (str): hash of indexed commit, or None if nothing has been indexed
+        """
+        if indexed and head and self._is_ancestor(indexed, head):
+            self._add_commits(f"{indexed}..{head}")
+        else:
+            self.connection.execute("DELETE FROM versions")
+            self._set_meta("count", "0")
+            # Counted so that indexes derived from the versions detect rebuilds
+            generation = int(self._get_meta("generation") or 0) + 1
+            self._set_meta("generation", str(generation))
+            if head:
+                self._add_commits(head)
+        self._set_meta("head", head)
+
+    def _get_head(self):
+        try:
+            return self.repo.check_object("HEAD")[0]
+        except backend.GitError:
+            # No commits have been made
+            return ""
+
+    def get_versions(self, path, **kwargs):
+        """
+        Returns the versions of the file having the given path, in order of most recent
+        to least recent (see iter_versions).
+
+        Arguments:
+            path (str): path of file relative to the repository, with '/' separators
+            kwargs: limit, offset, before, since and until filters of iter_versions
+
+        Returns (list(tuple(str, int, str, str, str, int))): commit hash, commit time
+            (seconds since the epoch), change type, message, path of file in commit and
+            number of each version
+        """
+        return list(self.iter_versions(path, **kwargs))
+
+    def iter_versions(
+        self, path, limit=None, offset=0, before=None, since=None, until=None
+    ):
+        """
+        Generates the versions of the file having the given path, in order of most
+        recent to least recent. Deletions of the file are omitted. Versions are read in
+        pages located by their number, so the cost of each page does not depend on the
+        number of versions before it.
+
+        Arguments:
+            path (str): path of file relative to the repository, with '/' separators
+            limit (int): maximum number of versions generated (None for no limit)
+            offset (int): number of most recent versions skipped
+            before (int): number of version preceding the first version generated, as
+                a cursor for continuing from the last version of a previous page
+            since (int): earliest commit time of versions (seconds since the epoch)
+            until (int): latest commit time of versions (seconds since the epoch)
+
+        Returns (generator(tuple(str, int, str, str, str, int))): commit hash, commit
+            time, change type, message, path of file in commit and number of each
+            version
+        """
+        conditions = ""
+        times = []
+        if since is not None:
+            conditions += " AND timestamp >= ?"
+            times.append(int(since))
+        if until is not None:
+            conditions += " AND timestamp <= ?"
+            times.append(int(until))
+        with self.lock:
+            self.sync()
+            row = self.connection.execute(
+                "SELECT MAX(number) FROM versions WHERE path = ?", (path,)
+            ).fetchone()
+        if row[0] is None:
+            return
+        # Versions are numbered consecutively, so offsets are converted to numbers
+        highest = row[0] - offset
+        if before is not None:
+            highest = min(highest, before - 1)
+        remaining = limit
+        while highest > 0 and (remaining is None or remaining > 0):
+            size = PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining)
+            with self.lock:
+                page = self.connection.execute(
+                    "SELECT c_hash, timestamp, action, message, origin, number "
+                    "FROM versions WHERE path = ? AND number <= ?"
+                    + conditions
+                    + " ORDER BY number DESC LIMIT ?",
+                    (path, highest, *times, size),
+                ).fetchall()
+            yield from page
+            if len(page) < size:
+                return
+            highest = page[-1][5] - 1
+            if remaining is not None:
+                remaining -= len(page)
+
+    def get_version(self, path, version_num):
+        """
+        Returns the given version of the file having the given path, where version 1 is
+        the earliest version of the file.
+
+        Arguments:
+            path (str): path of file relative to the repository, with '/' separators
+            version_num (int): number of version
+
+        Returns (tuple(str, int, str, str, str)): commit hash, commit time, change
+            type, message and path of file in commit of version, or None if the version
+            does not exist
+        """
+        if version_num < 1:
+            return None
+        with self.lock:
+            self.sync()
+            return self.connection.execute(
+                "SELECT c_hash, timestamp, action, message, origin, number "
+                "FROM versions WHERE path = ? AND number = ?",
+                (path, version_num),
+            ).fetchone()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _connect(self):
+        """
+        Opens the index database, creating it if it does not exist or was created by an
+        incompatible version.
+
+        Returns (sqlite3.Connection): connection to index database
+        """
+        if self.connection is not None:
+            return self.connection
+        git_dir = os.path.join(self.dir_path, self.repo("rev-parse", "--git-dir").strip())
+        index_dir = os.path.join(git_dir, "verdite")
+        os.makedirs(index_dir, exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(index_dir, "index.sqlite"),
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+        )
+        # Locked so that the schema is only checked and replaced by one process
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._create_tables()
+            self.connection.commit()
+        except BaseException:
+            self.connection.close()
+            self.connection = None
+            raise
+        return self.connection
+
+    def _create_tables(self):
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        if self._get_meta("schema") != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS versions")
+            self.connection.execute("DELETE FROM meta")
+            self._set_meta("schema", SCHEMA_VERSION)
+        # Versions other than deletions are numbered from 1 for each path
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "path TEXT, seq INTEGER, c_hash TEXT, timestamp INTEGER, action TEXT, "
+            "message TEXT, origin TEXT, number INTEGER, PRIMARY KEY (path, seq)) "
+            "WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS versions_number "
+            "ON versions (path, number)"
+        )
+        # Used to find the versions of a file which contain a blob, and the versions
+        # added since the search index was last updated (see search.py)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS versions_commit ON versions (c_hash, origin)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS versions_seq ON versions (seq)"
+        )
+
+    def _add_commits(self, revisions):
+        """
+        Adds the commits in the given revision range to the index, in chronological
+        order. Renamed files inherit the versions of their previous path.
+
+        Arguments:
+            revisions (str): revision range of commits to be added
+        """
+        output = self.repo.log(
+            "--reverse", "-z", "--name-status", "-M", LOG_FORMAT, revisions, "--"
+        )
+        seq = int(self._get_meta("count") or 0)
+        for c_hash, epoch, subject, body, changes in parse_log(output):
+            seq += 1
+            messages = get_file_messages(body)
+            for action, old_path, path in changes:
+                if action == "R" and old_path != path:
+                    # Any versions of a previous file at the path are replaced
+                    self.connection.execute(
+                        "DELETE FROM versions WHERE path = ?", (path,)
+                    )
+                    self.connection.execute(
+                        "INSERT INTO versions SELECT ?, seq, c_hash, timestamp, "
+                        "action, message, origin, number FROM versions WHERE path = ?",
+                        (path, old_path),
+                    )
+                number = None
+                if action != "D":
+                    number = self.connection.execute(
+                        "SELECT IFNULL(MAX(number), 0) + 1 FROM versions "
+                        "WHERE path = ?",
+                        (path,),
+                    ).fetchone()[0]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        seq,
+                        c_hash,
+                        int(epoch),
+                        action,
+                        messages.get(path, subject),
+                        path,
+                        number,
+                    ),
+                )
+        self._set_meta("count", str(seq))
+
+    def _is_ancestor(self, ancestor, commit):
+        try:
+            self.repo("merge-base", "--is-ancestor", ancestor, commit)
+            return True
+        except backend.GitError:
+            return False
+
+    def _get_meta(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+        )
+
+
+def parse_log(output):
+    """
+    Parses the output of 'git log -z --name-status' having the format
+    "%H%x00%ct%x00%s%x00%b", in which each entry has form
+    "<hash>\0<epoch>\0<subject>\0<body>\0\n<status>\0<path>\0..." (with a second path
+    following the status of renames and copies).
+
+    Arguments:
+        output (str): output of log command
+
+    Returns (generator(tuple)): hash, commit time, subject, body and list of
+        (change type, previous path, path) tuples of each log entry
+    """
+    fields = output.split("\0")
+    i = 0
+    while i + 3 < len(fields):
+        c_hash, epoch, subject, body = fields[i : i + 4]
+        i += 4
+        changes = []
+        while i < len(fields) and STATUS_PATTERN.match(fields[i].strip()):
+            action = fields[i].strip()[:1]
+            if action in ("R", "C"):
+                changes.append((action, fields[i + 1], fields[i + 2]))
+                i += 3
+            else:
+                changes.append((action, fields[i + 1], fields[i + 1]))
+                i += 2
+        yield c_hash.strip(), epoch, subject, body, changes
+
+
+def get_file_message(subject, body, path):
+    """
+    Returns the line of the given commit message describing the change to the given
+    file. Batched commits list the change to each file on a separate line of the
+    message body, while single file commits consist only of a subject line.
+
+    Arguments:
+        subject (str): subject of commit message
+        body (str): body of commit message
+        path (str): path of file relative to the repository
+
+    Returns (str): description of change to file
+    """
+    return get_file_messages(body).get(path, subject)
+
+
+def get_file_messages(body):
+    """
+    Returns the lines of the given commit message body describing the change to each
+    file, so that the messages of all files of a commit are found in a single pass.
+    Each line (e.g. "Modify x") is found by the path following its actions. Lines of
+    renames and copies (e.g. "Rename x to y") are found by the path following each " to
+    ", as paths may themselves contain it, but lines naming a path exactly take
+    precedence.
+
+    Arguments:
+        body (str): body of commit message
+
+    Returns (dict(str, str)): description of change to each path
+    """
+    messages = {}
+    renames = {}
+    for line in body.split("\n"):
+        match = CHANGE_PATTERN.fullmatch(line)
+        if match is None:
+            continue
+        actions, path = match.groups()
+        if not re.search("rename|copy", actions, re.IGNORECASE):
+            messages.setdefault(path, line)
+            continue
+        start = path.find(" to ")
+        while start != -1:
+            renames.setdefault(path[start + 4 :], line)
+            start = path.find(" to ", start + 1)
+    renames.update(messages)
+    return renames
@@ -0,0 +1,244 @@
+import json
+import os
+import time
+
+import backend
+import chunks
+import retain
+
+# Number of loose objects and packs beyond which they are packed and repacked
+LOOSE_OBJECT_LIMIT = 1000
+PACK_LIMIT = 10
+# Minimum seconds between checks of whether maintenance is due
+CHECK_INTERVAL = 600
+# Minimum seconds between compactions of history
+COMPACT_INTERVAL = 86400
+# Maximum load average (per processor) at which the machine is considered idle
+LOAD_LIMIT = 0.5
+
+# Commands run by each maintenance task, in the order tasks are run
+TASKS = {
+    # History is compacted by HistoryCompactor, after which objects of the removed
+    # versions are deleted
+    "compact": [
+        ["reflog", "expire", "--expire=now", "--all"],
+        ["repack", "-a", "-d", "-q"],
+        ["prune", "--expire=1.hour.ago"],
+    ],
+    # Loose objects are packed, then removed as they are now in the pack
+    "loose-objects": [
+        ["maintenance", "run", "--task=loose-objects"],
+        ["prune-packed", "-q"],
+    ],
+    # Small packs are combined and indexed by a multi-pack-index
+    "incremental-repack": [["maintenance", "run", "--task=incremental-repack"]],
+    "bitmap": [["multi-pack-index", "write", "--bitmap"]],
+    # Commit-graph with changed-path Bloom filters, written incrementally
+    "commit-graph": [
+        ["commit-graph", "write", "--reachable", "--changed-paths", "--split"]
+    ],
+    # Versions not yet in the search index are indexed by SearchIndex
+    "search-index": [],
+}
+
+# Maximum number of batches of commits added to the search index by each run
+SEARCH_BATCHES = 50
+
+
+def is_machine_idle():
+    """
+    Returns true if the machine is not busy, based on its load average. Machines which
+    do not report their load (e.g. Windows) are always considered idle.
+
+    Returns (bool): true if machine is idle
+    """
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return True
+    return load < (os.cpu_count() or 1) * LOAD_LIMIT
+
+
+class MaintenanceScheduler:
+    """
+    Keeps the object database of a repository compact as commits accumulate. The counts
+    of loose objects and packs are checked periodically, and the tasks which are due are
+    run (compacting history, packing loose objects, incremental repacking, reachability
+    bitmaps, the commit-graph and completing the search index). The time and duration
+    of each task are recorded in the git directory.
+    """
+
+    def __init__(self, repo, git_dir, policy=None, chunk_store=None, search_index=None):
+        """
+        Creates new scheduler for the given repository.
+
+        Arguments:
+            repo (backend.GitBackend): backend of repository
+            git_dir (str): path of git directory of repository
+            policy (retain.RetentionPolicy): policy by which history is compacted, or
+                None if all versions are kept
+            chunk_store (chunks.ChunkStore): store of chunked files of repository
+            search_index (search.SearchIndex): full-text index of versions, if it is
+                to be completed by maintenance
+        """
+        self.repo = repo
+        self.compactor = retain.HistoryCompactor(repo, git_dir, policy)
+        self.chunk_store = chunk_store
+        self.search_index = search_index
+        self.state_path = os.path.join(git_dir, "verdite", "maintenance.json")
+        self.last_check = None
+        self.state = self._load()
+
+    def run_due(self, now=None):
+        """
+        Runs all tasks which are due, unless they were checked recently.
+
+        Arguments:
+            now (float): current time (monotonic clock), defaults to current time
+
+        Returns (dict(str, float)): duration in seconds of each task run
+        """
+        now = time.monotonic() if now is None else now
+        if self.last_check is not None and now - self.last_check < CHECK_INTERVAL:
+            return {}
+        self.last_check = now
+        try:
+            tasks = self.get_due_tasks()
+        except backend.GitError:
+            return {}
+        return {x: self.run_task(x) for x in tasks}
+
+    def get_due_tasks(self):
+        """
+        Returns the names of the tasks which are due, in the order they must be run.
+
+        Returns (list(str)): names of due tasks
+        """
+        counts = self.get_object_counts()
+        due = set()
+        last_compact = self.state.get("tasks", {}).get("compact", {}).get("time", 0)
+        if self.policy is not None and time.time() - last_compact >= COMPACT_INTERVAL:
+            due.add("compact")
+        if counts.get("count", 0) >= LOOSE_OBJECT_LIMIT:
+            due.add("loose-objects")
+        if counts.get("packs", 0) >= PACK_LIMIT:
+            due.update(("incremental-repack", "bitmap"))
+        if self._get_head() != self.state.get("graph_head"):
+            due.add("commit-graph")
+        if self.search_index is not None and not self.search_index.is_complete():
+            due.add("search-index")
+        return [x for x in TASKS if x in due]
+
+    def get_object_counts(self):
+        """
+        Returns the numbers of loose objects and packs, as reported by
+        'git count-objects -v' (e.g. "count" and "packs").
+
+        Returns (dict(str, int)): values reported by count-objects
+        """
+        counts = {}
+        for line in self.repo("count-objects", "-v").splitlines():
+            key, _, value = line.partition(":")
+            if value.strip().isdigit():
+                counts[key.strip()] = int(value)
+        return counts
+
+    def run_task(self, task):
+        """
+        Runs the given task and records its duration.
+
+        Arguments:
+            task (str): name of task
+
+        Returns (float): duration of task in seconds
+        """
+        head = self._get_head()
+        start = time.monotonic()
+        try:
+            if task == "search-index":
+                self.search_index.update(SEARCH_BATCHES)
+            elif task != "compact":
+                self._run_commands(task)
+            elif self.compactor.compact():
+                self._run_commands(task)
+                if self.chunk_store is not None:
+                    self.chunk_store.remove_unreferenced(self._get_referenced_chunks())
+            succeeded = True
+        except backend.GitError as e:
+            print(f"Maintenance task {task} failed: {e.message}")
+            succeeded = False
+        duration = time.monotonic() - start
+        self.state.setdefault("tasks", {})[task] = {
+            "time": time.time(),
+            "duration": duration,
+            "succeeded": succeeded,
+        }
+        if task == "commit-graph" and succeeded:
+            self.state["graph_head"] = head
+        self._save()
+        return duration
+
+    def get_task_history(self):
+        """
+        Returns the time (seconds since the epoch), duration and result of the most
+        recent run of each task.
+
+        Returns (dict(str, dict)): details of most recent run of each task
+        """
+        return dict(self.state.get("tasks", {}))
+
+    @property
+    def policy(self):
+        return self.compactor.policy
+
+    @policy.setter
+    def policy(self, policy):
+        self.compactor.policy = policy
+
+    def _run_commands(self, task):
+        for args in TASKS[task]:
+            self.repo(*args)
+
+    def _get_referenced_chunks(self):
+        """
+        Returns the hashes of all chunks referenced by pointers in the object database.
+
+        Returns (set(str)): hashes of referenced chunks
+        """
+        referenced = set()
+        if not os.path.isdir(self.chunk_store.store_path):
+            return referenced
+        objects = self.repo(
+            "cat-file",
+            "--batch-check=%(objectname) %(objecttype) %(objectsize)",
+            "--batch-all-objects",
+            "--unordered",
+        )
+        for line in objects.splitlines():
+            name, obj_type, size = line.split(" ")
+            if obj_type != "blob" or int(size) > chunks.MAX_POINTER_SIZE:
+                continue
+            pointer = chunks.parse_pointer(self.repo.read_object(name)[1])
+            if pointer is not None:
+                referenced.update(x[0] for x in pointer[2])
+        return referenced
+
+    def _get_head(self):
+        try:
+            return self.repo.check_object("HEAD")[0]
+        except backend.GitError:
+            # No commits have been made
+            return None
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + ".part", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".part", self.state_path)
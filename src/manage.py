@@ -1,21 +1,25 @@
 import os
-import shutil
 import datetime
+import tempfile
+from contextlib import contextmanager
 from dataclasses import dataclass
-from subprocess import call
+from functools import partial
+from subprocess import call, Popen
 from platform import system
 
-try:
-    import sh
-except ImportError:
-    # Emulate the sh API with pbs
-    import pbs
+import backend
+import cache
+import chunks
+import diff
+import ignore
+import index
+import search
 
-    class Sh(object):
-        def __getattr__(self, attr):
-            return pbs.Command(attr)
-
-    sh = Sh()
+# Maximum number of paths for which changes are retrieved individually, beyond which
+# the whole directory is scanned
+MAX_PATHSPECS = 1000
+# Hash written to remove an entry with 'git update-index --index-info'
+EMPTY_HASH = "0" * 40
 
 class FileManager:
     """
@@ -23,139 +27,783 @@ class FileManager:
     version control.
     """
 
-    def __init__(self, dir_path, temp_path):
+    def __init__(
+        self, dir_path, temp_path, batch_size=0, preview_cache_size=None, chunk_threshold=0
+    ):
         """
         Creates new FileManager for directory at given path. 
 
         Arguments:
             dir_path (str): path of target directory
             temp_path (str): path of temp directory
+            batch_size (int): maximum number of files stored in a single commit (0 for
+                no limit, 1 to commit each file separately)
+            preview_cache_size (int): maximum size in megabytes of opened versions kept
+                in the temp directory. If given, the cache is cleaned immediately,
+                otherwise it is created (with the default size) when first used.
+            chunk_threshold (int): minimum size in megabytes of files which are split
+                into chunks stored outside the repository (0 to store all files as
+                whole files)
         """
+        self.chunk_threshold = chunk_threshold
         self.set_target_directory(dir_path)
         self.temp_path = temp_path
+        self.batch_size = batch_size
+        self.preview_cache = None
+        if preview_cache_size is not None:
+            self.preview_cache = self._create_preview_cache(preview_cache_size)
 
     def set_target_directory(self, dir_path):
-        self.repo = sh.git.bake(_cwd=dir_path)
+        self.repo = backend.get_backend(dir_path)
         try:
             self.repo("rev-parse", "--is-inside-work-tree")
-        except pbs.ErrorReturnCode:
+        except backend.GitError:
             self.repo.init()
+        # Untracked files are cached in the index, and file system changes are reported
+        # by git's file system monitor where it is supported, speeding up status
+        self.repo.config("core.untrackedCache", "true")
+        if system() in ("Windows", "Darwin"):
+            self.repo.config("core.fsmonitor", "true")
 
         self.dir_path = dir_path
-        self.ignore_path = f"{dir_path}\\.gitignore"
+        self.git_dir = os.path.join(dir_path, self.repo("rev-parse", "--git-dir").strip())
+        self.ignore_path = os.path.join(dir_path, ".gitignore")
+        # Ignore rules are compiled once, so ignored paths are skipped without git
+        self.ignore = ignore.IgnoreMatcher(dir_path, self.git_dir)
+        self.index = index.VersionIndex(self.repo, dir_path)
+        self.diff = diff.DiffService(self.repo)
+        self.search = search.SearchIndex(self.index)
+        self._configure_chunk_store(self.chunk_threshold)
+
+    def _configure_chunk_store(self, threshold):
+        """
+        Configures git to store files of at least the given size in the chunk store,
+        using the filter defined in chunks.py, and to reassemble chunked files when they
+        are checked out. If chunking is disabled after files have been chunked, the
+        filter is kept to reassemble them.
+
+        Arguments:
+            threshold (int): minimum size in megabytes of chunked files (0 to disable)
+        """
+        store_path = os.path.join(self.git_dir, "verdite", "chunks")
+        self.chunk_store = chunks.ChunkStore(store_path, threshold * 1024 * 1024)
+        if threshold <= 0 and not os.path.isdir(store_path):
+            return
+        command = chunks.get_filter_command(store_path, self.chunk_store.threshold)
+        try:
+            current = self.repo.config("--get", "filter.verdite.process").strip()
+        except backend.GitError:
+            current = ""
+        if current != command:
+            self.repo.config("filter.verdite.process", command)
+        # Attributes are set in the git directory, so the target directory is unchanged
+        attributes_path = os.path.join(self.git_dir, "info", "attributes")
+        try:
+            with open(attributes_path, "r") as f:
+                if "* filter=verdite" in f.read().split("\n"):
+                    return
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(attributes_path), exist_ok=True)
+        with open(attributes_path, "a") as f:
+            f.write("* filter=verdite\n")
 
-    def store_changes(self):
+    def store_changes(self, paths=None):
         """
         Stores all changes and returns list of files that were successfully committed.
+        Changes are grouped into commits of at most batch_size files, with the body of
+        each commit message listing the action performed on every file in the commit.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted (e.g. those reported by a watcher). All changes
+                are stored if None.
+
+        Returns: list(str): all files that were committed
+        """
+        changes = self._stage_untracked(list(self.get_changes(paths)))
+        if self.batch_size == 1:
+            committed = self._store_individually(changes)
+        else:
+            committed = self._store_batched(changes)
+        if committed:
+            self._update_indexes()
+        return committed
+
+    def _update_indexes(self):
+        """
+        Adds newly committed versions to the version index and the search index.
+        """
+        self.index.sync()
+        try:
+            # At most one batch is indexed, so that indexing a long history does not
+            # delay storing changes (the remainder is indexed by maintenance)
+            self.search.update(max_batches=1)
+        except backend.GitError:
+            # Versions which could not be read are indexed by the next update
+            pass
+
+    def _store_individually(self, changes):
+        """
+        Stores each of the given changes in a separate commit.
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
 
         Returns: list(str): all files that were committed
         """
-        changes = self.get_changes()
         committed = []
-        verbose_codes = {"M": "modify", "A": "add", "D": "delete"}
         for change in changes:
             print(f"Change: {change}")
-            codes = change.codes
             file_path = change.file_path
-
-            if "??" in codes:
-                codes = self._stage_changes(file_path)
-
-            actions = " and ".join([verbose_codes[x] for x in codes]).capitalize()
-            message = f"{actions} {file_path}"
+            message = self._get_change_message(
+                change.codes, file_path, change.orig_path
+            )
             try:
-                self.repo.add(file_path)
-                self.repo.commit(m=message)
+                self.repo.add("-f", "--", file_path, _env=backend.LITERAL_PATHSPECS)
+                # Only the given file is committed, as other new files have already been
+                # staged
+                self.repo.commit(
+                    "-m",
+                    message,
+                    "--",
+                    *self._get_commit_paths([change]),
+                    _env=backend.LITERAL_PATHSPECS,
+                )
                 committed.append(file_path)
-            except pbs.ErrorReturnCode:
+            except backend.GitError:
                 # Any git errors are ignored, enabling changes that weren't committed to
                 # be committed with the next function call
-                self.repo.reset("HEAD", file_path)
+                self.repo.reset(
+                    "-q", "HEAD", "--", file_path, _env=backend.LITERAL_PATHSPECS
+                )
                 continue
         return committed
 
-    def get_changes(self):
+    def _store_batched(self, changes):
+        """
+        Stores the given changes in groups of at most batch_size files, staging and
+        committing each group with a single git call.
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
+
+        Returns: list(str): all files that were committed
+        """
+        committed = []
+        for group, message in self._get_batches(changes):
+            with self._write_message(message) as message_path:
+                add, commit, reset = self._get_batch_commands(group, message_path)
+                try:
+                    for args, paths in (add, commit):
+                        self.repo(*args, _in=paths, _env=backend.LITERAL_PATHSPECS)
+                    committed.extend(x.file_path for x in group)
+                except backend.GitError:
+                    # As above, uncommitted changes are left to the next function call
+                    try:
+                        self.repo(
+                            *reset[0], _in=reset[1], _env=backend.LITERAL_PATHSPECS
+                        )
+                    except backend.GitError:
+                        pass
+        return committed
+
+    def _get_batches(self, changes):
+        """
+        Returns the groups of at most batch_size changes which are committed together,
+        and the message of each commit.
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
+
+        Returns (list(tuple(list(ChangeData), str))): changes and message of each commit
+        """
+        messages = []
+        for change in changes:
+            print(f"Change: {change}")
+            messages.append(
+                self._get_change_message(change.codes, change.file_path, change.orig_path)
+            )
+        group_size = self.batch_size or len(changes) or 1
+        return [
+            (
+                changes[i : i + group_size],
+                self._get_commit_message(messages[i : i + group_size]),
+            )
+            for i in range(0, len(changes), group_size)
+        ]
+
+    def _get_batch_commands(self, group, message_path):
+        """
+        Returns the commands which stage and commit the given group of changes, and the
+        command which unstages them if either fails. Paths are read from standard
+        input, and must be treated as literal pathspecs.
+
+        Arguments:
+            group (list(ChangeData)): changes committed together
+            message_path (str): path of file containing commit message
+
+        Returns (tuple(tuple(list(str), str))): arguments and NUL-separated paths of
+            the add, commit and reset commands
+        """
+        from_stdin = ["--pathspec-from-file=-", "--pathspec-file-nul"]
+        paths = "\0".join(x.file_path for x in group)
+        # Forced, as files which are tracked inside ignored directories are otherwise
+        # refused (untracked files have already been staged)
+        add = (["add", "-A", "-f"] + from_stdin, paths)
+        commit = (
+            ["commit", "-F", message_path] + from_stdin,
+            "\0".join(self._get_commit_paths(group)),
+        )
+        reset = (["reset", "-q"] + from_stdin, paths)
+        return add, commit, reset
+
+    @contextmanager
+    def _write_message(self, message):
+        """
+        Provides a temporary file containing the given commit message, which is passed
+        in a file as the paths to be committed are read from standard input. Each call
+        has its own file, so that concurrent stores (e.g. by synchronous and
+        asynchronous managers of the same repository) do not commit each other's
+        messages.
+
+        Arguments:
+            message (str): commit message
+
+        Returns (contextmanager(str)): path of message file
+        """
+        verdite_dir = os.path.join(self.git_dir, "verdite")
+        os.makedirs(verdite_dir, exist_ok=True)
+        fd, message_path = tempfile.mkstemp(prefix="message-", dir=verdite_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(message)
+            yield message_path
+        finally:
+            os.remove(message_path)
+
+    def _get_commit_message(self, messages):
+        """
+        Returns message of a commit storing the changes with the given descriptions.
+
+        Arguments:
+            messages (list(str)): description of each change in commit
+
+        Returns (str): commit message
+        """
+        if len(messages) == 1:
+            return messages[0]
+        return f"Store {len(messages)} changes\n\n" + "\n".join(messages)
+
+    def _stage_untracked(self, changes):
+        """
+        Stages all untracked files and directories among the given changes at once, and
+        returns the changes with each untracked entry replaced by the changes to the
+        individual files it contains (classified with a single status call).
+
+        Arguments:
+            changes (list(ChangeData)): changes to be stored
+
+        Returns (list(ChangeData)): changes with untracked files staged
+        """
+        untracked = [x.file_path for x in changes if "??" in x.codes]
+        tracked = [x for x in changes if "??" not in x.codes]
+        if not untracked:
+            return changes
+        args, paths = self._get_stage_command(untracked)
+        try:
+            self.repo(*args, _in=paths, _env=backend.LITERAL_PATHSPECS)
+        except backend.GitError:
+            # Untracked files will be staged by the next function call
+            return tracked
+        staged = [x for x in self.get_changes(untracked) if x.index == "A"]
+        return tracked + staged
+
+    def _get_stage_command(self, untracked):
+        """
+        Returns the command which stages the given untracked files and directories.
+        Paths are read from standard input, and must be treated as literal pathspecs.
+
+        Arguments:
+            untracked (list(str)): paths of untracked entries
+
+        Returns (tuple(list(str), str)): arguments and NUL-separated paths of command
+        """
+        args = ["add", "-A", "--pathspec-from-file=-", "--pathspec-file-nul"]
+        return args, "\0".join(untracked)
+
+    def _get_commit_paths(self, changes):
+        """
+        Returns the paths which must be committed to store the given changes, including
+        the original paths of renamed files.
+
+        Arguments:
+            changes (list(ChangeData)): changes to be committed
+
+        Returns (list(str)): paths to be committed
+        """
+        paths = []
+        for change in changes:
+            if change.orig_path and "R" in change.codes:
+                paths.append(change.orig_path)
+            paths.append(change.file_path)
+        return paths
+
+    def _get_change_message(self, codes, file_path, orig_path=None):
+        """
+        Returns message describing the change to the given file (e.g. "Modify x" or
+        "Rename x to y").
+
+        Arguments:
+            codes (list(str)): status codes of change
+            file_path (str): path of changed file
+            orig_path (str): path file was renamed or copied from, if any
+
+        Returns (str): description of change
+        """
+        verbose_codes = {
+            "M": "modify",
+            "A": "add",
+            "D": "delete",
+            "R": "rename",
+            "C": "copy",
+            "T": "change type of",
+        }
+        actions = " and ".join([verbose_codes.get(x, "update") for x in codes])
+        if orig_path:
+            return f"{actions.capitalize()} {orig_path} to {file_path}"
+        return f"{actions.capitalize()} {file_path}"
+
+    def get_changes(self, paths=None):
         """
-        Returns the changes made to files and the code corresponding to the change in
-        the form of ChangeData objects.
+        Yields the changes made to files and the code corresponding to the change in
+        the form of ChangeData objects. Changes are parsed from the output of
+        'git status --porcelain=v2 -z' as it is produced.
 
-        Returns (list(ChangeData)): changes made to files
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted. All changes are returned if None.
+
+        Returns (generator(ChangeData)): changes made to files
 
         Status codes:
         - M: modified
         - A: added
         - D: deleted
+        - R: renamed
+        - C: copied
+        - T: type changed
+        - U: unmerged
         - ??: untracked
 
         Codes are combined if multiple actions have been performed on a single file
         and the file is tracked (i.e. AM for added then modified, AD for added then
-        deleted, and MD for modified then deleted).
+        deleted, and MD for modified then deleted). The state of the file in the index
+        and working tree are also stored separately.
+        """
+        return self._parse_status(self._get_status(paths))
+
+    def _parse_status(self, records):
+        """
+        Parses the given records of the output of 'git status --porcelain=v2 -z'.
+        Records have the following forms, where <XY> holds the index and working tree
+        states and renames and copies are followed by a record holding the original path:
+
+        - 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+        - 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>
+        - u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+        - ? <path>
+
+        Arguments:
+            records (iterable(str)): NUL-separated records of status output
+
+        Returns (generator(ChangeData)): change described by each record
         """
-        changes = []
-        status = self.repo.status("-s").split("\n")
-        for line in status:
-            if not line:
+        records = iter(records)
+        for record in records:
+            kind = record[:1]
+            orig_path = None
+            if kind == "1":
+                fields = record.split(" ", 8)
+            elif kind == "2":
+                fields = record.split(" ", 9)
+                orig_path = next(records)
+            elif kind == "u":
+                fields = record.split(" ", 10)
+            elif kind == "?":
+                yield ChangeData(["??"], record[2:], "?", "?")
                 continue
-            line = line.split()
-            codes = list(line[0]) if line[0] != "??" else ["??"]
-            # git encloses file names containing spaces with double quotes
-            # Must remove quotes so file names can be matched
-            file_path = " ".join(line[1:]).replace('"', '')
-            changes.append(ChangeData(codes, file_path))
-        return changes
+            else:
+                # Ignored files and headers
+                continue
+            index_state, worktree_state = fields[1]
+            codes = [x for x in fields[1] if x != "."]
+            yield ChangeData(
+                codes, fields[-1], index_state, worktree_state, orig_path
+            )
 
-    def get_file_versions(self, file_path):
+    def get_file_versions(
+        self, file_path, limit=None, offset=0, before=None, since=None, until=None
+    ):
         """
         Returns all versions of given file, in order of most recent to least recent
         (even if file has been renamed). The version list consists of VersionData objects
-        storing the the commit hashes, commit messages and commit dates.
+        storing the the commit hashes, commit messages, commit dates, change types and
+        version numbers. The versions may be restricted to a page (see
+        iter_file_versions).
 
         Arguments:
             file_path (str): path of file for which versions will be retrieved
+            limit (int): maximum number of versions returned (None for no limit)
+            offset (int): number of most recent versions skipped
+            before (int): number of version preceding the first version returned
+            since (datetime.datetime): earliest time of versions
+            until (datetime.datetime): latest time of versions
 
-        Returns (list(VersionData)): all versions of given file
+        Returns (list(VersionData)): versions of given file
         """
-        if not os.path.realpath(file_path).startswith(self.dir_path):
-            raise VersionError("File is not inside controlled directory")
+        return list(
+            self.iter_file_versions(file_path, limit, offset, before, since, until)
+        )
+
+    def iter_file_versions(
+        self, file_path, limit=None, offset=0, before=None, since=None, until=None
+    ):
+        """
+        Generates the versions of given file, in order of most recent to least recent.
+        Versions are read from the version index in pages, so the cost of retrieving
+        the most recent versions (or those before a given version) does not depend on
+        the length of the history of the file.
+
+        Arguments:
+            file_path (str): path of file for which versions will be retrieved
+            limit (int): maximum number of versions generated (None for no limit)
+            offset (int): number of most recent versions skipped
+            before (int): number of version preceding the first version generated, e.g.
+                the number of the last version of the previous page
+            since (datetime.datetime): earliest time of versions
+            until (datetime.datetime): latest time of versions
+
+        Returns (generator(VersionData)): versions of given file
+        """
+        rel_path = self._get_relative_path(file_path)
+        rows = self.index.iter_versions(
+            rel_path,
+            limit,
+            offset,
+            before,
+            since.timestamp() if since is not None else None,
+            until.timestamp() if until is not None else None,
+        )
         try:
-            file_log = self.repo.log("--oneline", "--follow", file_path).split("\n")
-        except pbs.ErrorReturnCode:
+            for row in rows:
+                yield self._create_version_data(row)
+        except backend.GitError:
             raise VersionError("Unable to retrieve file")
-        versions = []
-        for commit in file_log:
-            if not commit:
-                continue
-            log_entry = commit.split()  # Log entry has form "<hash> <message>"
-            timestamp = self._get_commit_timestamp(log_entry[0])
-            message = " ".join(log_entry[1:])
-            if "delete" in message.lower():
-                # Omit delete commits from version list
-                continue
-            versions.append(
-                VersionData(log_entry[0], message, timestamp)
+
+    def search_versions(self, text, limit=100, file_path=None, since=None, until=None):
+        """
+        Returns the versions of files containing the given text, in order of most recent
+        to least recent. The contents of all versions are held in a full-text index, so
+        the history of the directory is searched without reading any versions.
+
+        Arguments:
+            text (str): text to be found, matched as a phrase of whole words ignoring
+                case and punctuation
+            limit (int): maximum number of versions returned
+            file_path (str): path of file to which the search is restricted (None for
+                all files)
+            since (datetime.datetime): earliest time of versions
+            until (datetime.datetime): latest time of versions
+
+        Returns (list(SearchHit)): versions containing text
+        """
+        rel_path = None if file_path is None else self._get_relative_path(file_path)
+        try:
+            rows = self.search.search(
+                text,
+                limit,
+                rel_path,
+                since.timestamp() if since is not None else None,
+                until.timestamp() if until is not None else None,
             )
-        return versions
+        except backend.GitError:
+            raise VersionError("Unable to search versions")
+        hits = []
+        for path, number, epoch, message in rows:
+            timestamp = datetime.datetime.fromtimestamp(
+                epoch, datetime.timezone.utc
+            ).astimezone()
+            file_path = os.path.join(self.dir_path, *path.split("/"))
+            hits.append(SearchHit(file_path, number, timestamp, message))
+        return hits
+
+    def _get_relative_path(self, file_path):
+        """
+        Returns path of given file relative to the target directory, in the form used
+        by git.
+
+        Arguments:
+            file_path (str): path of file inside target directory
+
+        Returns (str): relative path of file, with '/' separators
+        """
+        if not os.path.realpath(file_path).startswith(self.dir_path):
+            raise VersionError("File is not inside controlled directory")
+        rel_path = os.path.relpath(os.path.realpath(file_path), self.dir_path)
+        return rel_path.replace(os.sep, "/")
+
+    def _create_version_data(self, row):
+        """
+        Returns VersionData object for the given version index row.
+
+        Arguments:
+            row (tuple): commit hash, commit time, change type, message, path and number
+                of version
+
+        Returns (VersionData): data for version
+        """
+        c_hash, epoch, action, message, path, number = row
+        timestamp = datetime.datetime.fromtimestamp(
+            epoch, datetime.timezone.utc
+        ).astimezone()
+        return VersionData(c_hash, message, timestamp, action, path, number)
 
     def open_file_version(self, file_path, version_num):
         """
-        Open specified version of given file. Desired version is stored in temp folder
-        and working file remains unchanged.
+        Open specified version of given file. Desired version is written to the temp
+        folder directly from the repository, so the working file and index remain
+        unchanged.
         
         Arguments:
             file_path (str): path of target file. Must be an absolute file path.
             version_num (int): number of version to be retrieved
         """
         target_ver = self._get_target_version(file_path, version_num)
+        file_name = os.path.split(file_path)[1]
+        ref = f"{target_ver.c_hash}:{target_ver.path}"
+        if self.preview_cache is None:
+            self.preview_cache = self._create_preview_cache()
         try:
-            self.repo.checkout(target_ver.c_hash, file_path)
-            shutil.copy(file_path, self.temp_path)
-            os.startfile(f"{self.temp_path}\\{os.path.split(file_path)[1]}")
-            self.repo.reset("HEAD", file_path)
-            self.repo.checkout("--", file_path)
-        except pbs.ErrorReturnCode:
-            raise VersionError(
-                f"Unable to view version {version_num} of {os.path.split(file_path)[1]}"
-            )
+            # Recently opened versions are retrieved from the cache without using git
+            preview_path = self.preview_cache.get(ref, file_name)
+            if preview_path is None:
+                blob, _, size = self.repo.check_object(ref)
+                preview_path = self.preview_cache.store(
+                    ref, blob, file_name, partial(self._write_blob, blob, size)
+                )
+            self._open_destination(preview_path)
+        except (backend.GitError, OSError):
+            raise VersionError(f"Unable to view version {version_num} of {file_name}")
+
+    def get_version_diff(self, file_path, old, new=None, context=3):
+        """
+        Generates the lines of the unified diff between two versions of given file, or
+        between a version and the current contents of the file. Lines are yielded as
+        git produces them, so large diffs are not held in memory.
+
+        Arguments:
+            file_path (str): path of file
+            old (VersionData): earlier version
+            new (VersionData): later version, or None for the current contents
+            context (int): number of unchanged lines shown around each change
+
+        Returns (generator(str)): lines of diff, without line endings
+        """
+        try:
+            with self._get_diff_env(new) as env:
+                old_blob, new_blob = self._get_diff_blobs(file_path, old, new, env)
+                new_path = old.path if new is None else new.path
+                if self._is_pointer(old_blob) or self._is_pointer(new_blob, env):
+                    # Chunked files are stored as lists of chunks, so are not compared
+                    yield f"Binary files a/{old.path} and b/{new_path} differ"
+                    return
+                yield from self.diff.iter_diff(
+                    old_blob, new_blob, context, (old.path, new_path), env
+                )
+        except (backend.GitError, OSError):
+            raise VersionError("Unable to compare versions")
+
+    def get_version_stats(self, file_path, old, new=None):
+        """
+        Returns the number of lines added and removed between two versions of given
+        file, or between a version and the current contents of the file. Statistics are
+        cached by the hashes of the contents compared.
+
+        Arguments:
+            file_path (str): path of file
+            old (VersionData): earlier version
+            new (VersionData): later version, or None for the current contents
+
+        Returns (diff.DiffStats): lines added and removed
+        """
+        try:
+            with self._get_diff_env(new) as env:
+                old_blob, new_blob = self._get_diff_blobs(file_path, old, new, env)
+                return self._get_blob_stats(old_blob, new_blob, env)
+        except (backend.GitError, OSError):
+            raise VersionError("Unable to compare versions")
+
+    def get_version_summaries(self, file_path, versions):
+        """
+        Returns the number of lines added and removed by each of the given versions of
+        given file, relative to the previous version (or to an empty file for the first
+        version). The statistics of all uncached versions are computed by a single git
+        command, so summaries can be shown for a whole page of versions.
+
+        Arguments:
+            file_path (str): path of file
+            versions (list(VersionData)): versions of file (e.g. a page returned by
+                get_file_versions)
+
+        Returns (list(diff.DiffStats)): statistics of each version
+        """
+        numbers = {x.number: x for x in versions}
+        try:
+            pairs = []
+            for version in versions:
+                previous = numbers.get(version.number - 1)
+                if previous is None and version.number > 1:
+                    previous = self._get_target_version(file_path, version.number - 1)
+                new_blob = self._get_version_blob(version)
+                if previous is None:
+                    old_blob = self.diff.get_empty_blob()
+                    old_commit = None
+                else:
+                    old_blob = self._get_version_blob(previous)
+                    old_commit = previous.c_hash
+                new_commit = version.c_hash
+                pairs.append((old_commit, new_commit, version.path, old_blob, new_blob))
+            batched = [x for x in pairs if x[0] is not None and x[3] != x[4]]
+            if not any(self._is_pointer(x) for y in batched for x in y[3:]):
+                paths = [x.path for x in versions] + [x[2] for x in batched]
+                self.diff.get_commit_stats(batched, paths)
+            # Pairs which were not found by the batch (e.g. first versions) are compared
+            # individually
+            return [self._get_blob_stats(x[3], x[4]) for x in pairs]
+        except backend.GitError:
+            raise VersionError("Unable to compare versions")
+
+    @contextmanager
+    def _get_diff_env(self, new):
+        """
+        Provides the environment of git commands comparing a version with the given
+        later version. When comparing with the current contents of a file, objects are
+        written to a temporary object directory (removed afterwards) which has the
+        object database of the repository as an alternate, so that contents which are
+        never stored do not accumulate in the repository.
+
+        Arguments:
+            new (VersionData): later version, or None for the current contents
+
+        Returns (contextmanager(dict(str, str))): environment variables, or None if
+            no temporary object directory is needed
+        """
+        if new is not None:
+            yield None
+            return
+        verdite_dir = os.path.abspath(os.path.join(self.git_dir, "verdite"))
+        os.makedirs(verdite_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="objects-", dir=verdite_dir) as temp:
+            yield {
+                "GIT_OBJECT_DIRECTORY": temp,
+                "GIT_ALTERNATE_OBJECT_DIRECTORIES": os.path.abspath(
+                    os.path.join(self.git_dir, "objects")
+                ),
+            }
+
+    def _get_diff_blobs(self, file_path, old, new, env=None):
+        """
+        Returns the hashes of the blobs of the given versions, writing the current
+        contents of the file to the object directory of the given environment if no
+        later version is given.
+
+        Arguments:
+            file_path (str): path of file
+            old (VersionData): earlier version
+            new (VersionData): later version, or None for the current contents
+            env (dict(str, str)): environment with temporary object directory (see
+                _get_diff_env)
+
+        Returns (tuple(str, str)): hashes of old and new blobs
+        """
+        old_blob = self._get_version_blob(old)
+        if new is not None:
+            return old_blob, self._get_version_blob(new)
+        rel_path = self._get_relative_path(file_path)
+        # Path is given so that the same filters are applied as when storing the file
+        new_blob = self.repo(
+            "hash-object", "-w", f"--path={rel_path}", "--", file_path, _env=env
+        )
+        return old_blob, new_blob.strip()
+
+    def _get_version_blob(self, version):
+        return self.repo.check_object(f"{version.c_hash}:{version.path}")[0]
+
+    def _get_blob_stats(self, old_blob, new_blob, env=None):
+        if old_blob == new_blob:
+            return diff.DiffStats(0, 0)
+        if self._is_pointer(old_blob) or self._is_pointer(new_blob, env):
+            return diff.DiffStats(0, 0, binary=True)
+        return self.diff.get_stats(old_blob, new_blob, env)
+
+    def _is_pointer(self, blob, env=None):
+        """
+        Returns true if the given blob is a pointer to a chunked file. Blobs are only
+        read if files have been chunked in the repository.
+
+        Arguments:
+            blob (str): hash of blob
+            env (dict(str, str)): environment with temporary object directory
+                containing the blob (see _get_diff_env)
+
+        Returns (bool): true if blob is a pointer
+        """
+        if not os.path.isdir(self.chunk_store.store_path):
+            return False
+        if env is not None:
+            # Blob is not in the object database read by the persistent processes
+            size = int(self.repo("cat-file", "-s", blob, _env=env))
+            if size > chunks.MAX_POINTER_SIZE:
+                return False
+            data = self.repo.run(["cat-file", "blob", blob], env=env)
+            return chunks.parse_pointer(data) is not None
+        size = self.repo.check_object(blob)[2]
+        if size > chunks.MAX_POINTER_SIZE:
+            return False
+        return chunks.parse_pointer(self.repo.read_object(blob)[1]) is not None
+
+    def _write_blob(self, blob, size, output):
+        """
+        Writes the contents of the file stored in the given blob to the given file,
+        reassembling the file from the chunk store if the blob is a pointer.
+
+        Arguments:
+            blob (str): hash of blob
+            size (int): size of blob
+            output (file): binary file object to which contents are written
+        """
+        if size > chunks.MAX_POINTER_SIZE:
+            self.repo.copy_object(blob, output)
+            return
+        data = self.repo.read_object(blob)[1]
+        pointer = chunks.parse_pointer(data)
+        if pointer is None:
+            output.write(data)
+        else:
+            self.chunk_store.write(pointer, output.write)
+
+    def _create_preview_cache(self, size=512):
+        """
+        Returns cache of opened versions in the temp directory.
+
+        Arguments:
+            size (int): maximum size of cache in megabytes
+
+        Returns (cache.PreviewCache): cache of opened versions
+        """
+        return cache.PreviewCache(
+            os.path.join(self.temp_path, "previews"), size * 1024 * 1024
+        )
 
     def restore_file_version(self, file_path, version_num):
         """
@@ -166,17 +814,50 @@ class FileManager:
             version_num (int): number of version to be restored
         """
         target_ver = self._get_target_version(file_path, version_num)
+        rel_path = self._get_relative_path(file_path)
         try:
-            self.repo.checkout(target_ver.c_hash, file_path)
-            if self.repo.status("-s"):
+            self._write_version(target_ver, file_path)
+            self.repo.add("-f", "--", rel_path, _env=backend.LITERAL_PATHSPECS)
+            if self.repo.status("-s", "--", rel_path, _env=backend.LITERAL_PATHSPECS):
                 # Prevent error in case where the most recent versions is the most
                 # recent commit
-                self.repo.commit(m=f'Restore "{target_ver.message}"')
-        except pbs.ErrorReturnCode as e:
+                self.repo.commit(
+                    "-m",
+                    f'Restore "{target_ver.message}"',
+                    "--",
+                    rel_path,
+                    _env=backend.LITERAL_PATHSPECS,
+                )
+                self.index.sync()
+        except (backend.GitError, OSError) as e:
             raise VersionError(
                 f"Unable to restore version {version_num} of {os.path.split(file_path)[1]}"
             )
 
+    def _write_version(self, version, file_path):
+        """
+        Writes the contents of the given version to the given file, which may have had a
+        different path when the version was stored (e.g. if the file has been renamed).
+        The conversions git applies when checking out the file at its current path
+        (e.g. of line endings) are applied, and chunked files are reassembled from the
+        chunk store.
+
+        Arguments:
+            version (VersionData): version to be written
+            file_path (str): path of file to which contents are written
+        """
+        blob, _, size = self.repo.check_object(f"{version.c_hash}:{version.path}")
+        rel_path = self._get_relative_path(file_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Written in place, so that the file keeps its permissions
+        with open(file_path, "wb") as f:
+            if self._is_pointer(blob):
+                self._write_blob(blob, size, f)
+            else:
+                self.repo.run(
+                    ["cat-file", "--filters", f"--path={rel_path}", blob], output=f
+                )
+
     def _get_target_version(self, file_path, version_num):
         """
         Validates given file path and version number and returns target version. Used
@@ -191,40 +872,111 @@ class FileManager:
         if not os.path.isabs(file_path):
             raise VersionError("File path must be absolute")
 
-        versions = self.get_file_versions(file_path)
-        if version_num > len(versions) or version_num < 1:
+        rel_path = self._get_relative_path(file_path)
+        try:
+            row = self.index.get_version(rel_path, version_num)
+        except backend.GitError:
+            raise VersionError("Unable to retrieve file")
+        if row is None:
             raise VersionError("Invalid version number")
-        return versions[-version_num]
+        return self._create_version_data(row)
 
-    def has_changed(self):
+    def has_changed(self, paths=None):
         """
         Returns true if changes to files have occurred, that is, the stored state of
         files differs from the current state.
 
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory to which
+                changes are restricted. All files are checked if None.
+
         Returns (boolean): true if changes to files have occurred
         """
-        return len(self.repo.status("-s").split("\n")[0]) > 0
+        # Status is stopped once the first change is found, so must not update the index
+        changes = self._parse_status(self._get_status(paths, optional_locks=False))
+        try:
+            return next(changes, None) is not None
+        finally:
+            changes.close()
 
-    def _stage_changes(self, file_path):
+    def _get_status(self, paths=None, optional_locks=True):
         """
-        Stages untracked file and returns code corresponding to change.
+        Yields the records of the porcelain status of the given paths, or of the whole
+        directory if paths is None or too many paths are given.
 
         Arguments:
-            file_path (str): path of file to be staged
+            paths (iterable(str)): paths relative to the target directory
+            optional_locks (bool): if False, git will not update the index (e.g. to
+                store the untracked cache) while retrieving the status
 
-        Returns (list(str)): code corresponding to change 
+        Returns (generator(str)): records of output of 'git status --porcelain=v2 -z'
         """
-        self.repo.add(file_path)
-        changes = self.get_changes()
-        for change in changes:
-            if change.file_path == file_path:
-                return change.codes
-        # Initial file_path is of a directory
-        # No file paths in changes will be equal to file_path, as they will be the paths
-        # of the staged files and not the directory
-        # Initial change code is selected as it should reflect change for whole
-        # directory 
-        return changes[0].codes
+        args = self._get_status_args(paths, optional_locks)
+        if args is None:
+            return
+        yield from self.repo.stream(args)
+
+    def _get_status_args(self, paths=None, optional_locks=True):
+        """
+        Returns the arguments of the status command for the given paths.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory
+            optional_locks (bool): if False, git will not update the index
+
+        Returns (list(str)): arguments of status command, or None if there are no
+            paths to check
+        """
+        args = ["--literal-pathspecs"]
+        if not optional_locks:
+            args.append("--no-optional-locks")
+        args += ["status", "--porcelain=v2", "-z"]
+        if paths is not None:
+            # Changes to ignored paths (e.g. inside an ignored directory) are skipped
+            paths = self._filter_ignored(paths)
+            if not paths:
+                return None
+            if len(paths) <= MAX_PATHSPECS:
+                args += ["--"] + paths
+        return args
+
+    def _filter_ignored(self, paths):
+        """
+        Returns the given paths which are not ignored, or which are tracked although
+        they match an ignore rule (as git still stores changes to tracked files). Only
+        the paths matching a rule are looked up in the index.
+
+        Arguments:
+            paths (iterable(str)): paths relative to the target directory
+
+        Returns (list(str)): paths whose changes may be stored
+        """
+        paths = list(paths)
+        kept = set(self.ignore.filter(paths))
+        ignored = [x for x in paths if x not in kept]
+        if not ignored:
+            return paths
+        pathspecs = ["--"] + ignored if len(ignored) <= MAX_PATHSPECS else []
+        output = self.repo("ls-files", "-z", *pathspecs, _env=backend.LITERAL_PATHSPECS)
+        # Directories containing tracked files are also kept
+        tracked = set()
+        for path in output.split("\0"):
+            while path and path not in tracked:
+                tracked.add(path)
+                path = path.rpartition("/")[0]
+        return [x for x in paths if x in kept or x in tracked]
+
+    def get_tracked_ignored(self):
+        """
+        Returns the tracked files which match an ignore rule, whose changes are still
+        stored.
+
+        Returns (list(str)): paths of files relative to the target directory
+        """
+        output = self.repo(
+            "ls-files", "-z", "--cached", "--ignored", "--exclude-standard"
+        )
+        return [x for x in output.split("\0") if x]
 
     def get_all_ignored(self):
         """
@@ -243,20 +995,7 @@ class FileManager:
         Arguments:
             keyword (str): ignore keyword to add
         """
-        if not self._ignore_file_exists():
-            self._create_ignore_file()
-        ignored = self._collect_all_ignored()
-        if keyword in ignored:
-            return
-        # Necessary to unhide hidden file to write to it
-        self._unhide_destination(self.ignore_path)
-        with open(self.ignore_path, "a") as f:
-            f.write(keyword + "\n")
-            try:
-                self.store_changes()
-            except pbs.ErrorReturnCode:
-                pass
-            self._hide_destination(self.ignore_path)            
+        self.update_ignored(added=[keyword])
 
     def remove_ignored(self, keyword):
         """
@@ -265,21 +1004,177 @@ class FileManager:
         Arguments:
             keyword (str): ignore keyword to remove 
         """
+        self.update_ignored(removed=[keyword])
+
+    def update_ignored(self, added=(), removed=()):
+        """
+        Adds and removes any number of ignore keywords as a single transaction. The
+        ignore file is replaced once, tracked files which become ignored are removed
+        from the index (but not from the target directory) with a single command, and
+        both are stored in one commit. Only these changes are committed, even if other
+        changes are staged. If any step fails, the ignore file and index are restored.
+
+        Arguments:
+            added (iterable(str)): ignore keywords to add
+            removed (iterable(str)): ignore keywords to remove
+
+        Returns (list(str)): tracked files which are no longer tracked
+        """
         if not self._ignore_file_exists():
             self._create_ignore_file()
-        ignored = self._collect_all_ignored()
-        # Necessary to unhide hidden file to write to it
-        self._unhide_destination(self.ignore_path)
-        with open(self.ignore_path, "w") as f:
-            if ignored:
-                ignored.remove(keyword)
-            for x in ignored:
-                f.write(x + "\n")
+        previous = self._collect_all_ignored()
+        removed = [x for x in dict.fromkeys(removed) if x in previous]
+        ignored = [x for x in previous if x not in removed]
+        added = [x for x in dict.fromkeys(added) if x not in ignored]
+        if not added and not removed:
+            return []
+        previous_rules = self.ignore.get_rules()
+        try:
+            self._write_ignore_file(ignored + added)
+        except OSError:
+            raise IgnoreError("Unable to update ignored files")
+        untracked = []
+        try:
+            untracked = self._untrack_ignored(previous_rules)
+            self.repo.add(
+                "--",
+                os.path.basename(self.ignore_path),
+                _env=backend.LITERAL_PATHSPECS,
+            )
+            self._commit_ignore_changes(
+                self._get_ignore_message(added, removed, untracked), untracked
+            )
+        except (backend.GitError, OSError):
             try:
-                self.store_changes()
-            except pbs.ErrorReturnCode:
+                self._write_ignore_file(previous)
+            except OSError:
+                # The original error is reported, and the ignore file is left changed
                 pass
+            try:
+                self.repo.reset(
+                    "-q",
+                    "--pathspec-from-file=-",
+                    "--pathspec-file-nul",
+                    _in="\0".join([os.path.basename(self.ignore_path)] + untracked),
+                    _env=backend.LITERAL_PATHSPECS,
+                )
+            except backend.GitError:
+                pass
+            raise IgnoreError("Unable to update ignored files")
+        self.index.sync()
+        return untracked
+
+    def _write_ignore_file(self, keywords):
+        """
+        Replaces the contents of the ignore file with the given keywords. The keywords
+        are written to a temporary file which then replaces the ignore file, so that the
+        file is never partially written.
+
+        Arguments:
+            keywords (list(str)): ignore keywords
+        """
+        temp_path = os.path.join(self.git_dir, "VERDITE_IGNORE")
+        with open(temp_path, "w") as f:
+            f.write("".join(x + "\n" for x in keywords))
+        # Necessary to unhide hidden file to replace it
+        self._unhide_destination(self.ignore_path)
+        try:
+            os.replace(temp_path, self.ignore_path)
+        finally:
             self._hide_destination(self.ignore_path)
+            self.ignore.invalidate()
+
+    def _commit_ignore_changes(self, message, untracked):
+        """
+        Commits the ignore file and the removal of the given files, without committing
+        any other staged changes. The commit is built in a temporary index from the
+        current commit, as a commit restricted to paths would store the files removed
+        from the index from the target directory instead.
+
+        Arguments:
+            message (str): commit message
+            untracked (list(str)): paths of files removed from index
+        """
+        index_path = os.path.join(self.git_dir, "verdite", "ignore.index")
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        env = {"GIT_INDEX_FILE": index_path}
+        try:
+            head = self.repo.check_object("HEAD")[0]
+        except backend.GitError:
+            # No commits have been made
+            head = None
+        try:
+            if head is None:
+                self.repo("read-tree", "--empty", _env=env)
+            else:
+                self.repo("read-tree", head, _env=env)
+            blob = self.repo("hash-object", "-w", "--", self.ignore_path).strip()
+            info = f"100644 {blob}\t{os.path.basename(self.ignore_path)}\0"
+            info += "".join(f"0 {EMPTY_HASH}\t{x}\0" for x in untracked)
+            self.repo("update-index", "-z", "--index-info", _in=info, _env=env)
+            tree = self.repo("write-tree", _env=env).strip()
+            parents = ["-p", head] if head is not None else []
+            commit = self.repo("commit-tree", tree, *parents, "-F", "-", _in=message)
+            # Fails if another commit has been made since the index was read
+            subject = message.split("\n")[0]
+            self.repo(
+                "update-ref",
+                "-m",
+                f"commit: {subject}",
+                "HEAD",
+                commit.strip(),
+                head or EMPTY_HASH,
+            )
+        finally:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+
+    def _untrack_ignored(self, previous_rules):
+        """
+        Removes tracked files which were not ignored by the given rules, but are ignored
+        by the current rules, from the index. Files which were already ignored while
+        tracked are left unchanged.
+
+        Arguments:
+            previous_rules (ignore.IgnoreRules): rules before ignore file was changed
+
+        Returns (list(str)): paths of files removed from index
+        """
+        paths = [
+            x for x in self.get_tracked_ignored() if not previous_rules.is_ignored(x)
+        ]
+        if paths:
+            self.repo.rm(
+                "--cached",
+                "-q",
+                "--pathspec-from-file=-",
+                "--pathspec-file-nul",
+                _in="\0".join(paths),
+                _env=backend.LITERAL_PATHSPECS,
+            )
+        return paths
+
+    def _get_ignore_message(self, added, removed, untracked):
+        """
+        Returns message of commit updating ignored files, listing the change to the
+        ignore file and each file which is no longer tracked.
+
+        Arguments:
+            added (list(str)): ignore keywords added
+            removed (list(str)): ignore keywords removed
+            untracked (list(str)): files removed from index
+
+        Returns (str): commit message
+        """
+        actions = []
+        if added:
+            actions.append(f"ignore {', '.join(added)}")
+        if removed:
+            actions.append(f"stop ignoring {', '.join(removed)}")
+        subject = " and ".join(actions)
+        messages = [f"Modify {os.path.basename(self.ignore_path)}"]
+        messages += [f"Stop tracking {x}" for x in untracked]
+        return subject[:1].upper() + subject[1:] + "\n\n" + "\n".join(messages)
 
     def _ignore_file_exists(self):
         return os.path.isfile(self.ignore_path)
@@ -297,29 +1192,7 @@ class FileManager:
 
         Returns (list(str)): all ignore keywords in ignore file
         """
-        with open(self.ignore_path, "r") as f:
-            contents = f.read().split("\n")
-        ignored = []
-        for line in contents:
-            line = line.strip()
-            if line:
-                ignored.append(line)
-        return ignored
-
-    def _get_commit_timestamp(self, commit_hash):
-        """
-        Returns datetime object representing the commit date of the commit corresponding
-        to the given commit hash.
-
-        Arguments:
-            commit_hash (str): hash of commit for which timestamp will be generated
-
-        Returns (datetime.datetime): timestamp of given commit
-        """
-        date_str = str(
-            self.repo.show('--pretty=format:"%cd"', "--no-patch", commit_hash)
-        ).replace('"', "")
-        return datetime.datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y %z")
+        return self.ignore.get_patterns()
 
     def _hide_destination(self, path):
         """
@@ -334,6 +1207,21 @@ class FileManager:
         elif operating_system == "Darwin":
             call(["chflags", "hidden", path])
 
+    def _open_destination(self, path):
+        """
+        Open the file with the given path using the default application for its type.
+
+        Arguments:
+            path (str): path of target file
+        """
+        operating_system = system()
+        if operating_system == "Windows":
+            os.startfile(path)
+        elif operating_system == "Darwin":
+            Popen(["open", path])
+        else:
+            Popen(["xdg-open", path])
+
     def _unhide_destination(self, path):
         """
         Unhide the file or directory with the given path.
@@ -353,10 +1241,28 @@ class VersionData:
     Basic data class storing commit information for a specific file version.
     """
 
-    # Commit hash, message, and timestamp
+    # Commit hash, message, timestamp, change type (e.g. "A", "M" or "R"), path of
+    # file in commit (relative to the target directory) and number of version (from 1
+    # for the earliest version)
     c_hash: str
     message: str
     timestamp: datetime.datetime
+    action: str = ""
+    path: str = ""
+    number: int = 0
+
+
+@dataclass
+class SearchHit:
+    """
+    Basic data class storing a version of a file found by a search.
+    """
+
+    # Absolute path of file, number of version, timestamp and message of commit
+    file_path: str
+    number: int
+    timestamp: datetime.datetime
+    message: str
 
 
 @dataclass
@@ -367,6 +1273,11 @@ class ChangeData:
 
     codes: list
     file_path: str
+    # State of file in index and working tree ("." if unchanged, "?" if untracked) and
+    # path file was renamed or copied from
+    index: str = ""
+    worktree: str = ""
+    orig_path: str = None
 
 
 class InvalidDirectoryError(Exception):
@@ -0,0 +1,286 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import backend
+
+# Upper bounds in seconds of the buckets of duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Maximum number of events held for the JSON log between exports
+MAX_EVENTS = 10000
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Returns the metrics registry of the process, creating it (and registering it to
+    record every git command) if necessary.
+
+    Returns (MetricsRegistry): registry of process
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            backend.add_command_hook(_registry.observe_command)
+        return _registry
+
+
+def classify_args(args):
+    """
+    Returns the class of the given git arguments, describing how the command was
+    restricted without including any paths (so that the number of label values stays
+    small).
+
+    Arguments:
+        args (tuple(str)): arguments of git command
+
+    Returns (str): "pathspec-file", "paths", "batch" or "full"
+    """
+    if any(x.startswith("--pathspec-from-file") for x in args):
+        return "pathspec-file"
+    if "--" in args and args.index("--") < len(args) - 1:
+        return "paths"
+    if any(x.startswith("--batch") for x in args):
+        return "batch"
+    return "full"
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of counters and histograms describing git commands and
+    tracking cycles, which may be exported in the Prometheus text format. Each
+    observation is also kept as an event for the optional JSON log.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Metric names and their help text, type and values by label values
+        self.metrics = {}
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+
+    def observe_command(self, record):
+        """
+        Records a completed git command.
+
+        Arguments:
+            record (backend.CommandRecord): details of command
+        """
+        command = record.command
+        args_class = classify_args(record.args)
+        if record.returncode is None:
+            status = "terminated"
+        else:
+            status = "ok" if record.returncode == 0 else "error"
+        labels = {"command": command, "args": args_class}
+        self.increment(
+            "verdite_git_commands_total",
+            "Number of git commands run",
+            dict(labels, status=status),
+        )
+        self.observe(
+            "verdite_git_command_duration_seconds",
+            "Duration of git commands",
+            labels,
+            record.duration,
+        )
+        self.increment(
+            "verdite_git_output_bytes_total",
+            "Bytes of output read from git commands",
+            labels,
+            record.output_size,
+        )
+        self._add_event(
+            "command",
+            command=command,
+            args=args_class,
+            duration=record.duration,
+            status=status,
+            returncode=record.returncode,
+            output_bytes=record.output_size,
+        )
+
+    def observe_cycle(self, folder, duration, committed, latency=None, error=None):
+        """
+        Records a cycle of the control loop, in which changes to a folder were stored.
+
+        Arguments:
+            folder (str): path of tracked folder
+            duration (float): seconds taken to store changes
+            committed (int): number of files committed
+            latency (float): seconds between the first change being detected and it
+                being stored, if known
+            error (str): message of error which prevented changes being stored
+        """
+        labels = {"folder": folder}
+        self.observe(
+            "verdite_cycle_duration_seconds", "Duration of tracking cycles", labels, duration
+        )
+        self.increment(
+            "verdite_files_committed_total", "Number of files committed", labels, committed
+        )
+        if latency is not None:
+            self.observe(
+                "verdite_detection_latency_seconds",
+                "Time between changes being detected and stored",
+                labels,
+                latency,
+            )
+        if error is not None:
+            self.increment(
+                "verdite_cycle_errors_total", "Number of failed tracking cycles", labels
+            )
+        self._add_event(
+            "cycle",
+            folder=folder,
+            duration=duration,
+            committed=committed,
+            latency=latency,
+            error=error,
+        )
+
+    def increment(self, name, help_text, labels, amount=1):
+        with self.lock:
+            values = self._get_values(name, help_text, "counter")
+            key = tuple(sorted(labels.items()))
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, help_text, labels, value):
+        with self.lock:
+            values = self._get_values(name, help_text, "histogram")
+            key = tuple(sorted(labels.items()))
+            if key not in values:
+                values[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0, "count": 0}
+            histogram = values[key]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def format_prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+
+        Returns (str): exposition of metrics
+        """
+        lines = []
+        with self.lock:
+            for name, (help_text, kind, values) in sorted(self.metrics.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(values.items()):
+                    if kind == "counter":
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                        continue
+                    for bound, count in zip(DURATION_BUCKETS, value["buckets"]):
+                        labels = _format_labels(key + (("le", str(bound)),))
+                        lines.append(f"{name}_bucket{labels} {count}")
+                    labels = _format_labels(key + (("le", "+Inf"),))
+                    lines.append(f"{name}_bucket{labels} {value['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {value['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def pop_events(self):
+        """
+        Removes and returns all events recorded since the last call.
+
+        Returns (list(dict)): recorded events
+        """
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def _get_values(self, name, help_text, kind):
+        if name not in self.metrics:
+            self.metrics[name] = (help_text, kind, {})
+        return self.metrics[name][2]
+
+    def _add_event(self, event_type, **fields):
+        with self.lock:
+            self.events.append(dict(time=time.time(), type=event_type, **fields))
+
+
+class MetricsExporter:
+    """
+    Periodically rewrites a Prometheus text file (e.g. for the node exporter's textfile
+    collector) with the metrics of a registry, and appends its events to a JSON log (one
+    object per line). Either output may be omitted.
+    """
+
+    def __init__(self, registry, metrics_path, log_path=None, interval=15):
+        """
+        Creates new exporter, which is started by start().
+
+        Arguments:
+            registry (MetricsRegistry): registry of metrics
+            metrics_path (str): path of Prometheus text file, or None if metrics are
+                not written
+            log_path (str): path of JSON log, or None if events are not logged
+            interval (float): seconds between exports
+        """
+        self.registry = registry
+        self.metrics_path = metrics_path
+        self.log_path = log_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the exporter once it has written the final metrics.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+        self.export()
+
+    def export(self):
+        """
+        Writes the current metrics and any new events.
+        """
+        try:
+            if self.metrics_path:
+                # Written to a temporary file, so that collectors never read a partial
+                # file
+                with open(self.metrics_path + ".part", "w") as f:
+                    f.write(self.registry.format_prometheus())
+                os.replace(self.metrics_path + ".part", self.metrics_path)
+            events = self.registry.pop_events()
+            if self.log_path and events:
+                with open(self.log_path, "a") as f:
+                    for event in events:
+                        f.write(json.dumps(event) + "\n")
+        except OSError as e:
+            print(f"Unable to export metrics: {e}")
+
+
+def _format_labels(items):
+    """
+    Returns the given labels in the form '{name="value",...}'.
+
+    Arguments:
+        items (tuple(tuple(str, str))): names and values of labels
+
+    Returns (str): formatted labels
+    """
+    if not items:
+        return ""
+    labels = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        labels.append(f'{name}="{value}"')
+    return "{" + ",".join(labels) + "}"
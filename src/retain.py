@@ -0,0 +1,275 @@
+import os
+import time
+from dataclasses import dataclass
+
+import backend
+import index
+
+# Dates are read in the raw format ("<epoch> <offset>"), so that the time zone of each
+# rewritten commit is preserved
+LOG_FORMAT = "--format=%H%x00%an%x00%ae%x00%ad%x00%cn%x00%ce%x00%cd%x00%s%x00%b"
+EMPTY_HASH = "0" * 40
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    Immutable data class storing how long versions are retained. All versions are kept
+    for the first period, after which the most recent version of each file in every
+    hour, then every day, then every week is kept.
+    """
+
+    keep_all_hours: float = 24
+    hourly_days: float = 7
+    daily_days: float = 90
+
+    def get_bucket(self, timestamp, now):
+        """
+        Returns the period containing the given time, of which only the most recent
+        version of each file is kept.
+
+        Arguments:
+            timestamp (int): time of version (seconds since the epoch)
+            now (float): current time (seconds since the epoch)
+
+        Returns (tuple(str, int)): kind and number of period, or None if all versions
+            at the given time are kept
+        """
+        age = now - timestamp
+        if age < self.keep_all_hours * 3600:
+            return None
+        if age < self.hourly_days * 86400:
+            return ("hour", int(timestamp // 3600))
+        if age < self.daily_days * 86400:
+            return ("day", int(timestamp // 86400))
+        return ("week", int(timestamp // 604800))
+
+
+class HistoryCompactor:
+    """
+    Rewrites the history of a repository to contain only the versions retained by a
+    policy. Each remaining commit applies only the retained changes of the original
+    commit (its tree is otherwise that of the previous remaining commit), so every file
+    moves directly between its retained versions and the final tree is unchanged. The
+    original times, authors and per-file messages of retained changes are preserved.
+    """
+
+    def __init__(self, repo, git_dir, policy):
+        """
+        Creates new compactor for the given repository.
+
+        Arguments:
+            repo (backend.GitBackend): backend of repository
+            git_dir (str): path of git directory of repository
+            policy (RetentionPolicy): policy determining which versions are retained
+        """
+        self.repo = repo
+        self.git_dir = git_dir
+        self.policy = policy
+
+    def compact(self, now=None):
+        """
+        Removes the versions which are not retained from the history of the current
+        branch. The branch is only updated if no commits were made while the history
+        was being rewritten.
+
+        Arguments:
+            now (float): current time (seconds since the epoch), defaults to current time
+
+        Returns (int): number of changes removed
+        """
+        now = time.time() if now is None else now
+        try:
+            head = self.repo.check_object("HEAD")[0]
+        except backend.GitError:
+            # No commits have been made
+            return 0
+        output = self.repo.log(
+            "--reverse",
+            "-z",
+            "--raw",
+            "-M",
+            "--no-abbrev",
+            "--date=raw",
+            LOG_FORMAT,
+            head,
+        )
+        commits = list(parse_raw_log(output))
+        retained = self._get_retained(commits, now)
+        removed = sum(len(x["changes"]) for x in commits) - len(retained)
+        if not removed:
+            return 0
+        new_head = self._rewrite(commits, retained)
+        if self.repo.rev_parse(f"{new_head}^{{tree}}") != self.repo.rev_parse(
+            f"{head}^{{tree}}"
+        ):
+            raise backend.GitError("Rewritten history does not match current files")
+        # Fails if the branch has moved since the history was read
+        self.repo.update_ref("-m", "compact history", "HEAD", new_head, head)
+        return removed
+
+    def _get_retained(self, commits, now):
+        """
+        Returns the changes which are retained by the policy: all recent changes, and
+        the most recent change to each file in every period. Renames are always
+        retained (and are not the most recent change to the original path), so that the
+        versions of renamed files remain linked.
+
+        Arguments:
+            commits (list(dict)): commits parsed from log, from oldest to newest
+            now (float): current time (seconds since the epoch)
+
+        Returns (set(tuple(int, str))): index of commit and path of retained changes
+        """
+        retained = set()
+        latest = {}
+        for i, commit in enumerate(commits):
+            bucket = self.policy.get_bucket(commit["time"], now)
+            for change in commit["changes"]:
+                if bucket is None or change[2] == "R":
+                    retained.add((i, change[3]))
+                else:
+                    latest[(change[3], bucket)] = i
+        retained.update((i, path) for (path, _), i in latest.items())
+        return retained
+
+    def _rewrite(self, commits, retained):
+        """
+        Creates the commits of the compacted history and returns the newest. Commits
+        are reused until the first commit from which changes were removed.
+
+        Arguments:
+            commits (list(dict)): commits parsed from log, from oldest to newest
+            retained (set(tuple(int, str))): index of commit and path of retained changes
+
+        Returns (str): hash of newest commit
+        """
+        index_path = os.path.join(self.git_dir, "verdite", "compact.index")
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        env = {"GIT_INDEX_FILE": index_path}
+        parent = None
+        rewriting = False
+        try:
+            for i, commit in enumerate(commits):
+                changes = [x for x in commit["changes"] if (i, x[3]) in retained]
+                if not rewriting and len(changes) == len(commit["changes"]):
+                    parent = commit["hash"]
+                    continue
+                if not rewriting:
+                    # Temporary index holds the tree of the newest unchanged commit
+                    rewriting = True
+                    if parent is None:
+                        self.repo("read-tree", "--empty", _env=env)
+                    else:
+                        self.repo("read-tree", parent, _env=env)
+                if not changes:
+                    continue
+                self.repo(
+                    "update-index",
+                    "-z",
+                    "--index-info",
+                    _in="".join(self._get_index_info(x) for x in changes),
+                    _env=env,
+                )
+                tree = self.repo("write-tree", _env=env).strip()
+                parents = ["-p", parent] if parent else []
+                parent = self.repo(
+                    "commit-tree",
+                    tree,
+                    *parents,
+                    "-F",
+                    "-",
+                    _in=self._get_message(commit, changes),
+                    _env=dict(env, **commit["env"]),
+                ).strip()
+        finally:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        return parent
+
+    def _get_index_info(self, change):
+        """
+        Returns the records of 'git update-index -z --index-info' applying the given
+        change.
+
+        Arguments:
+            change (tuple): mode, hash, status, path and original path of change
+
+        Returns (str): NUL-terminated records
+        """
+        mode, blob, status, path, orig_path = change
+        info = f"{mode} {blob}\t{path}\0"
+        if status == "R":
+            info = f"0 {EMPTY_HASH}\t{orig_path}\0" + info
+        return info
+
+    def _get_message(self, commit, changes):
+        """
+        Returns message of rewritten commit, describing only its retained changes in the
+        same form as stored commits.
+
+        Arguments:
+            commit (dict): commit parsed from log
+            changes (list(tuple)): retained changes of commit
+
+        Returns (str): commit message
+        """
+        if len(changes) == len(commit["changes"]):
+            return f"{commit['subject']}\n\n{commit['body']}".strip() + "\n"
+        file_messages = index.get_file_messages(commit["body"])
+        messages = list(
+            dict.fromkeys(file_messages.get(x[3], commit["subject"]) for x in changes)
+        )
+        if len(messages) == 1:
+            return messages[0] + "\n"
+        return f"Store {len(messages)} changes\n\n" + "\n".join(messages) + "\n"
+
+
+def parse_raw_log(output):
+    """
+    Parses the output of 'git log -z --raw -M --no-abbrev --date=raw' having the format
+    LOG_FORMAT, in which each entry is followed by records of the form
+    ":<old mode> <new mode> <old hash> <new hash> <status>\0<path>\0" (with the
+    original path preceding the path of renames and copies).
+
+    Arguments:
+        output (str): output of log command
+
+    Returns (generator(dict)): hash, time, author and committer environment, subject,
+        body and (mode, hash, status, path, original path) tuples of changes of each
+        commit
+    """
+    fields = output.split("\0")
+    i = 0
+    while i + 8 < len(fields):
+        c_hash, a_name, a_email, a_date, c_name, c_email, c_date, subject, body = fields[
+            i : i + 9
+        ]
+        i += 9
+        changes = []
+        while i + 1 < len(fields) and fields[i].strip().startswith(":"):
+            _, mode, _, blob, status = fields[i].strip()[1:].split(" ")
+            status = status[:1]
+            if status == "D":
+                mode, blob = "0", EMPTY_HASH
+            if status in ("R", "C"):
+                changes.append((mode, blob, status, fields[i + 2], fields[i + 1]))
+                i += 3
+            else:
+                changes.append((mode, blob, status, fields[i + 1], None))
+                i += 2
+        yield {
+            "hash": c_hash.strip(),
+            "time": int(c_date.split(" ")[0]),
+            "subject": subject,
+            "body": body,
+            "changes": changes,
+            "env": {
+                "GIT_AUTHOR_NAME": a_name,
+                "GIT_AUTHOR_EMAIL": a_email,
+                "GIT_AUTHOR_DATE": f"@{a_date}",
+                "GIT_COMMITTER_NAME": c_name,
+                "GIT_COMMITTER_EMAIL": c_email,
+                "GIT_COMMITTER_DATE": f"@{c_date}",
+            },
+        }
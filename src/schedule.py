@@ -0,0 +1,142 @@
+import os
+import time
+from fnmatch import fnmatch
+
+# Names of temporary files written by editors and other programs while saving (e.g.
+# swap, backup, lock and partial download files)
+TEMPORARY_PATTERNS = [
+    "*~",
+    "*.swp",
+    "*.swx",
+    "*.tmp",
+    "*.part",
+    "*.crdownload",
+    ".#*",
+    "#*#",
+    "~$*",
+    ".~lock.*#",
+    "4913",
+]
+
+
+class ChangeScheduler:
+    """
+    Coalesces bursts of changes to files before they are stored. A changed path becomes
+    ready once it has not changed for the quiet period, so that a file written many times
+    in quick succession (or saved via a temporary file which is then renamed) is stored
+    once, in its final state. Paths which change continuously become ready after the
+    maximum delay, so that they are still stored regularly.
+    """
+
+    def __init__(self, dir_path, quiet_period=2, max_delay=60):
+        """
+        Creates new scheduler for directory at given path.
+
+        Arguments:
+            dir_path (str): path of target directory
+            quiet_period (float): seconds for which a path must be unchanged before it
+                is ready
+            max_delay (float): maximum seconds between the first change to a path and it
+                becoming ready
+        """
+        self.dir_path = dir_path
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        # Pending paths and the times of their first and most recent changes
+        self.pending = {}
+        self.full_scan = False
+        # Time of the first change to any path returned by the last call to pop_ready,
+        # or None if it is unknown (e.g. after a full scan)
+        self.ready_since = None
+
+    def add(self, paths, now=None):
+        """
+        Records that the given paths have changed.
+
+        Arguments:
+            paths (iterable(str) | None): paths relative to the target directory, or
+                None if the whole directory must be scanned
+            now (float): time of changes (monotonic clock), defaults to current time
+        """
+        if paths is None:
+            self.full_scan = True
+            return
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            first = self.pending.get(path, (now, now))[0]
+            self.pending[path] = (first, now)
+
+    def pop_ready(self, now=None):
+        """
+        Removes and returns the paths which are ready to be stored. Temporary files are
+        held back while they exist (up to the maximum delay), as the program writing them
+        is likely to rename or remove them shortly.
+
+        Arguments:
+            now (float): current time (monotonic clock), defaults to current time
+
+        Returns (set(str) | None): paths ready to be stored, or None if the whole
+            directory must be scanned
+        """
+        self.ready_since = None
+        if self.full_scan:
+            self.clear()
+            return None
+        now = time.monotonic() if now is None else now
+        ready = set()
+        for path, (first, last) in list(self.pending.items()):
+            if self._get_ready_time(path, first, last) <= now:
+                ready.add(path)
+                del self.pending[path]
+                if self.ready_since is None or first < self.ready_since:
+                    self.ready_since = first
+        return ready
+
+    def get_timeout(self, interval, now=None):
+        """
+        Returns the number of seconds until the next pending path may become ready, or
+        the given interval if it is sooner.
+
+        Arguments:
+            interval (float): maximum number of seconds to wait
+            now (float): current time (monotonic clock), defaults to current time
+
+        Returns (float): seconds to wait for further changes
+        """
+        if self.full_scan:
+            return 0
+        now = time.monotonic() if now is None else now
+        timeout = interval
+        for path, (first, last) in self.pending.items():
+            ready_time = self._get_ready_time(path, first, last)
+            timeout = min(timeout, max(ready_time - now, 0))
+        return timeout
+
+    def clear(self):
+        """
+        Discards all pending changes.
+        """
+        self.pending.clear()
+        self.full_scan = False
+
+    def _get_ready_time(self, path, first, last):
+        """
+        Returns the time at which the given pending path becomes ready.
+
+        Arguments:
+            path (str): pending path
+            first (float): time of first change to path
+            last (float): time of most recent change to path
+
+        Returns (float): time at which path is ready (monotonic clock)
+        """
+        if self._is_temporary(path) and self._exists(path):
+            return first + self.max_delay
+        return min(last + self.quiet_period, first + self.max_delay)
+
+    def _is_temporary(self, path):
+        name = path.rstrip("/").rsplit("/", 1)[-1]
+        return any(fnmatch(name, x) for x in TEMPORARY_PATTERNS)
+
+    def _exists(self, path):
+        return os.path.lexists(os.path.join(self.dir_path, path))
@@ -0,0 +1,251 @@
+import backend
+import chunks
+
+# Blobs larger than this many bytes are not indexed
+MAX_TEXT_SIZE = 4 * 1024 * 1024
+# Number of leading bytes searched for a NUL byte to detect binary files (as by git)
+BINARY_CHECK_SIZE = 8000
+# Number of commits whose versions are indexed in each transaction
+UPDATE_BATCH_SIZE = 200
+
+
+class SearchIndex:
+    """
+    Full-text index of the contents of every version of every file in a repository,
+    stored in the database of its version index. The text of each distinct blob is
+    indexed once by an SQLite FTS5 table, and each version is linked to its blob, so
+    the whole history is searched by a single query rather than a walk over every
+    commit. The index is updated incrementally with the versions added to the version
+    index since the last update, a limited number of commits at a time while changes
+    are being stored, with the remainder indexed by maintenance.
+
+    Binary files, chunked files and files larger than MAX_TEXT_SIZE are not indexed.
+    """
+
+    def __init__(self, versions):
+        """
+        Creates new search index for the given version index. The tables of the index
+        are created when first used.
+
+        Arguments:
+            versions (index.VersionIndex): version index of repository
+        """
+        self.versions = versions
+        self.repo = versions.repo
+        self.created = False
+
+    def update(self, max_batches=None):
+        """
+        Indexes the contents of the versions added to the version index since the last
+        update. Versions are indexed in order of their commits, in transactions of
+        UPDATE_BATCH_SIZE commits, so that an update which fails or is limited is
+        continued by the next.
+
+        Arguments:
+            max_batches (int): maximum number of transactions (None for no limit), so
+                that a long history can be indexed gradually
+
+        Returns (bool): true if all versions have been indexed
+        """
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            with self.versions.lock:
+                self.versions.sync()
+                connection = self._connect()
+                # Locked so that other processes do not index the same versions
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    indexed = self._add_batch()
+                    connection.commit()
+                except BaseException:
+                    connection.rollback()
+                    raise
+            if not indexed:
+                return True
+        return self.is_complete()
+
+    def is_complete(self):
+        """
+        Returns true if the versions of all commits in the version index have been
+        indexed.
+
+        Returns (bool): true if index is complete
+        """
+        with self.versions.lock:
+            self.versions.sync()
+            connection = self._connect()
+            _, seq = self._get_position()
+            row = connection.execute(
+                "SELECT 1 FROM versions WHERE seq > ? LIMIT 1", (seq,)
+            ).fetchone()
+            return row is None
+
+    def _add_batch(self):
+        """
+        Indexes the versions of the next UPDATE_BATCH_SIZE commits which have not been
+        indexed.
+
+        Returns (bool): true if any commits were indexed
+        """
+        connection = self.versions.connection
+        generation, seq = self._get_position()
+        last = connection.execute(
+            "SELECT MAX(seq) FROM (SELECT DISTINCT seq FROM versions "
+            "WHERE seq > ? ORDER BY seq LIMIT ?)",
+            (seq, UPDATE_BATCH_SIZE),
+        ).fetchone()[0]
+        if last is None:
+            return False
+        rows = connection.execute(
+            "SELECT DISTINCT c_hash, origin FROM versions "
+            "WHERE seq > ? AND seq <= ? AND action != 'D'",
+            (seq, last),
+        ).fetchall()
+        for c_hash, origin in rows:
+            self._add_version(c_hash, origin)
+        self._set_position(generation, last)
+        return True
+
+    def search(self, text, limit=100, path=None, since=None, until=None):
+        """
+        Returns the versions containing the given text, in order of most recent to
+        least recent. The text is matched as a phrase of whole words, ignoring case and
+        punctuation. A version is returned for each path of a renamed file.
+
+        Arguments:
+            text (str): text to be found
+            limit (int): maximum number of versions returned
+            path (str): path of file to which the search is restricted, relative to
+                the repository with '/' separators
+            since (int): earliest commit time of versions (seconds since the epoch)
+            until (int): latest commit time of versions (seconds since the epoch)
+
+        Returns (list(tuple(str, int, int, str))): path of file, number of version,
+            commit time and message of each version
+        """
+        if not text.strip():
+            return []
+        self.update()
+        conditions = ""
+        values = ['"' + text.replace('"', '""') + '"']
+        if path is not None:
+            conditions += " AND v.path = ?"
+            values.append(path)
+        if since is not None:
+            conditions += " AND v.timestamp >= ?"
+            values.append(int(since))
+        if until is not None:
+            conditions += " AND v.timestamp <= ?"
+            values.append(int(until))
+        with self.versions.lock:
+            return self.versions.connection.execute(
+                "SELECT v.path, v.number, v.timestamp, v.message FROM contents "
+                "JOIN version_blobs b ON b.blob_id = contents.rowid "
+                "JOIN versions v ON v.c_hash = b.c_hash AND v.origin = b.origin "
+                "WHERE contents MATCH ? AND v.number IS NOT NULL"
+                + conditions
+                + " ORDER BY v.timestamp DESC, v.seq DESC, v.path LIMIT ?",
+                (*values, limit),
+            ).fetchall()
+
+    def _connect(self):
+        """
+        Creates the tables of the index in the database of the version index, if they
+        do not exist.
+
+        Returns (sqlite3.Connection): connection to index database
+        """
+        connection = self.versions.connection
+        if self.created:
+            return connection
+        # Contentless, as the text of each blob is read from the repository
+        connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(text, content='')"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS blobs "
+            "(id INTEGER PRIMARY KEY, hash TEXT UNIQUE)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS version_blobs (c_hash TEXT, origin TEXT, "
+            "blob_id INTEGER, PRIMARY KEY (c_hash, origin)) WITHOUT ROWID"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS version_blobs_blob ON version_blobs (blob_id)"
+        )
+        connection.commit()
+        self.created = True
+        return connection
+
+    def _add_version(self, c_hash, origin):
+        """
+        Links the given version to its blob, indexing the blob if it has not been
+        indexed.
+
+        Arguments:
+            c_hash (str): hash of commit of version
+            origin (str): path of file in commit
+        """
+        connection = self.versions.connection
+        blob, _, size = self.repo.check_object(f"{c_hash}:{origin}")
+        inserted = connection.execute(
+            "INSERT OR IGNORE INTO blobs (hash) VALUES (?)", (blob,)
+        ).rowcount
+        blob_id = connection.execute(
+            "SELECT id FROM blobs WHERE hash = ?", (blob,)
+        ).fetchone()[0]
+        if inserted:
+            text = self._read_text(blob, size)
+            if text is not None:
+                connection.execute(
+                    "INSERT INTO contents (rowid, text) VALUES (?, ?)", (blob_id, text)
+                )
+        connection.execute(
+            "INSERT OR IGNORE INTO version_blobs VALUES (?, ?, ?)",
+            (c_hash, origin, blob_id),
+        )
+
+    def _read_text(self, blob, size):
+        """
+        Returns the text of the given blob.
+
+        Arguments:
+            blob (str): hash of blob
+            size (int): size of blob
+
+        Returns (str): text of blob, or None if it is not indexed
+        """
+        if size > MAX_TEXT_SIZE:
+            return None
+        data = self.repo.read_object(blob)[1]
+        if b"\0" in data[:BINARY_CHECK_SIZE] or chunks.parse_pointer(data) is not None:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _get_position(self):
+        """
+        Returns the position of the last update: the number of times the version index
+        had been rebuilt and the sequence number of the last commit indexed. The
+        position is reset if the version index has since been rebuilt.
+
+        Returns (tuple(int, int)): generation and sequence number
+        """
+        generation = int(self._get_meta("generation") or 0)
+        position = self._get_meta("search")
+        if position is None:
+            return generation, 0
+        indexed, seq = map(int, position.split(":"))
+        return (generation, seq) if indexed == generation else (generation, 0)
+
+    def _set_position(self, generation, seq):
+        self.versions.connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            ("search", f"{generation}:{seq}"),
+        )
+
+    def _get_meta(self, key):
+        row = self.versions.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,355 @@
+import os
+import select
+import struct
+import sys
+import time
+import ctypes
+import ctypes.util
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Directories which are never watched
+EXCLUDED_DIRS = {".git"}
+
+
+def create_watcher(dir_path, interval, settle_time=0.1, ignore=None, get_tracked=None):
+    """
+    Returns the most efficient watcher available for the given directory. An inotify
+    watcher is used on Linux, falling back to polling if inotify is unavailable (e.g. if
+    the limit on the number of watches has been reached).
+
+    Arguments:
+        dir_path (str): path of directory to be watched
+        interval (int): seconds between scans of directory when polling
+        settle_time (float): seconds for which further events are collected after the
+            first event is received
+        ignore (ignore.IgnoreMatcher): ignore rules of directory, if ignored paths are
+            not to be watched
+        get_tracked (callable): function returning the tracked paths which match the
+            ignore rules, as their changes are still stored
+
+    Returns (InotifyWatcher | PollingWatcher): watcher for directory
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dir_path, settle_time, ignore, get_tracked)
+        except OSError as e:
+            print(f"Unable to watch {dir_path} ({e}), polling for changes")
+    return PollingWatcher(interval)
+
+
+class PollingWatcher:
+    """
+    Watcher which reports that the whole directory should be scanned at regular
+    intervals.
+    """
+
+    def __init__(self, interval):
+        """
+        Creates new polling watcher.
+
+        Arguments:
+            interval (int): seconds between scans of directory
+        """
+        self.interval = interval
+
+    def wait(self, timeout=None):
+        """
+        Waits for the polling interval to elapse.
+
+        Arguments:
+            timeout (float): ignored, present for compatibility with InotifyWatcher
+
+        Returns (None): whole directory must be scanned for changes
+        """
+        time.sleep(self.interval)
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watcher which uses Linux inotify to detect changes to files in a directory and all of
+    its subdirectories, so that only the paths which have changed need to be examined.
+    Ignored subdirectories are not watched, and changes to ignored files are not
+    reported, unless they contain or are files which are tracked (as git still stores
+    their changes). The files containing ignore rules are watched, so that the watches
+    are updated when the rules change.
+    """
+
+    def __init__(self, dir_path, settle_time=0.1, ignore=None, get_tracked=None):
+        """
+        Creates new inotify watcher for directory at given path, registering a watch
+        for every subdirectory which is not ignored.
+
+        Arguments:
+            dir_path (str): path of directory to be watched
+            settle_time (float): seconds for which further events are collected after
+                the first event is received
+            ignore (ignore.IgnoreMatcher): ignore rules of directory
+            get_tracked (callable): function returning the tracked paths which match
+                the ignore rules, relative to the directory with '/' separators
+        """
+        self.dir_path = dir_path
+        self.settle_time = settle_time
+        self.ignore = ignore
+        self.get_tracked = get_tracked
+        self.rules_changed = False
+        # Tracked paths matching the ignore rules, and the directories containing them
+        self.tracked = set()
+        self.tracked_dirs = set()
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_error()
+        # Watch descriptors and the directories they correspond to
+        self.watches = {}
+        # Watch descriptors of directories outside the watched tree containing rule
+        # files (e.g. the exclude file of the repository)
+        self.rule_watches = set()
+        self.overflowed = False
+        try:
+            self._load_tracked()
+            self._add_rule_watches()
+            self._add_tree(dir_path)
+        except BaseException:
+            self.close()
+            raise
+
+    def wait(self, timeout=None):
+        """
+        Waits until files in the directory change or the timeout elapses, returning the
+        paths which have changed.
+
+        Arguments:
+            timeout (float): maximum number of seconds to wait
+
+        Returns (set(str) | None): paths which have changed, relative to the directory
+            and with '/' separators, or None if the whole directory must be scanned
+        """
+        dirty = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return dirty
+        deadline = time.monotonic() + self.settle_time
+        while True:
+            self._read_events(dirty)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                break
+        if self.rules_changed:
+            # Directories may no longer be ignored, and their files must be found
+            self.rules_changed = False
+            self.ignore.invalidate()
+            self._load_tracked()
+            self._update_watches()
+            return None
+        if self.overflowed:
+            # Events were lost, so changes can only be determined by a full scan
+            self.overflowed = False
+            return None
+        return dirty
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches.clear()
+
+    def _read_events(self, dirty):
+        """
+        Reads all pending events, adding the paths which have changed to the given set.
+
+        Arguments:
+            dirty (set(str)): paths which have changed
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None:
+                continue
+            if not name:
+                # Event concerns the watched directory itself, and is also reported to
+                # the directory's parent
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if self.ignore is not None and (
+                name == b".gitignore" or path in self.ignore.rule_paths
+            ):
+                self.rules_changed = True
+            if wd in self.rule_watches:
+                continue
+            relative_path = self._get_relative_path(path)
+            if mask & IN_ISDIR:
+                if self._is_excluded(path, relative_path):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_tree(path)
+                    except FileNotFoundError:
+                        pass
+                elif mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+            elif self.ignore is not None and self._is_ignored(relative_path):
+                continue
+            dirty.add(relative_path)
+
+    def _add_tree(self, path):
+        """
+        Registers a watch for the given directory and all of its subdirectories.
+
+        Arguments:
+            path (str): path of directory
+        """
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [x for x in dirs if not self._is_excluded(os.path.join(root, x))]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() in (2, 20):
+                    # Directory was removed (ENOENT) or replaced by a file (ENOTDIR)
+                    continue
+                self._raise_error()
+            self.watches[wd] = root
+
+    def _add_rule_watches(self):
+        """
+        Registers a watch for each directory containing a rule file of the ignore rules
+        which is outside the watched tree (as the git directory is not watched).
+        """
+        if self.ignore is None:
+            return
+        for path in self.ignore.rule_paths:
+            directory = os.path.dirname(path)
+            if directory == self.dir_path or not os.path.isdir(directory):
+                continue
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd < 0:
+                self._raise_error()
+            self.watches[wd] = directory
+            self.rule_watches.add(wd)
+
+    def _load_tracked(self):
+        """
+        Reads the tracked paths which match the ignore rules, so that they and the
+        directories containing them are watched.
+        """
+        if self.ignore is None or self.get_tracked is None:
+            return
+        tracked = set()
+        dirs = set()
+        for path in self.get_tracked():
+            tracked.add(path)
+            path = path.rpartition("/")[0]
+            while path and path not in dirs:
+                dirs.add(path)
+                path = path.rpartition("/")[0]
+        self.tracked = tracked
+        self.tracked_dirs = dirs
+
+    def _remove_tree(self, path):
+        """
+        Removes the watches for the given directory and all of its subdirectories.
+
+        Arguments:
+            path (str): path of directory
+        """
+        prefix = path + os.sep
+        for wd, root in list(self.watches.items()):
+            if root == path or root.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def _update_watches(self):
+        """
+        Updates the watched directories after the ignore rules have changed, removing
+        the watches of ignored directories and watching those no longer ignored.
+        """
+        for wd, root in list(self.watches.items()):
+            if wd in self.rule_watches:
+                continue
+            if root != self.dir_path and self._is_excluded(root):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+        # Watches of directories which are already watched are unchanged
+        self._add_tree(self.dir_path)
+
+    def _is_excluded(self, path, relative_path=None):
+        """
+        Returns true if the given directory is not to be watched.
+
+        Arguments:
+            path (str): path of directory
+            relative_path (str): path relative to the watched directory, if known
+
+        Returns (bool): true if directory is excluded or ignored
+        """
+        if os.path.basename(path) in EXCLUDED_DIRS:
+            return True
+        if self.ignore is None:
+            return False
+        if relative_path is None:
+            relative_path = self._get_relative_path(path)
+        if relative_path in self.tracked_dirs:
+            return False
+        return self.ignore.is_ignored(relative_path, is_dir=True)
+
+    def _is_ignored(self, relative_path):
+        if relative_path in self.tracked:
+            return False
+        return self.ignore.is_ignored(relative_path)
+
+    def _get_relative_path(self, path):
+        return os.path.relpath(path, self.dir_path).replace(os.sep, "/")
+
+    def _raise_error(self):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))